@@ -3,3 +3,44 @@ param.address = <string>
 param.port = <string>
 param.username = <string>
 param.password = <string>
+param.cleanup = <bool>
+param.min_gap = <float>
+* The minimum amount of time (in seconds) to wait between calls to the Insteon Hub
+* The actual wait is based on how quickly the devices are observed to acknowledge commands
+param.transport = <string>
+* How the messages are sent to the Insteon Hub: "http" uses the hub's web interface and "plm" connects to the
+  hub's PowerLinc Modem directly over TCP (port 9761 by default; use "plm:<port>" to use a different port)
+* The "plm" transport gets the replies from the devices as soon as they arrive instead of polling the hub
+param.coalesce_window = <float>
+* How long (in seconds) to hold on/off commands to see if a later command to the same device supersedes them
+* Only the last of the on/off commands sent to a device within the window is sent; identical commands that are already
+  waiting to be sent are dropped. Other commands (such as beeps and brighten/dim) are always sent.
+* Defaults to 0 (commands are sent right away)
+param.skip_if_in_state = <bool>
+* If true, on/off commands are not sent to devices that are known to already be in the requested state
+* The state of the devices is learned from their replies (which are waited for when this is enabled) and from the
+  broadcasts in the hub's buffer; it is kept for up to 30 minutes
+param.delivery = <string>
+* How the commands are delivered to the devices: "repeat" sends each command the number of times that it calls for
+  without checking that the device got it and "ack" waits for the device to acknowledge each command and re-sends it
+  (with a growing, jittered delay) only if the device refuses it (NAK) or doesn't reply in time
+* Defaults to "repeat"
+param.max_retries = <int>
+* How many times a command can be re-sent when the delivery is "ack"
+* Defaults to 3
+param.adaptive_hops = <bool>
+* If true, the messages to each device use one more hop than the recent replies from the device needed (instead of
+  always using the maximum of 3) which reduces the traffic on the powerline and the time it takes to get a reply
+* The hops of the replies are stored in $SPLUNK_HOME/var/run/splunk/insteon_control/link_quality.json; a device goes back
+  to 3 hops as soon as it fails to reply
+* Defaults to false
+param.batch_fields = <string>
+* A comma-separated list of the parameters (such as "device,command") that are taken from the fields of each result
+* If set, the alert is run once for each result in a single process (instead of a process per result); set the alert to
+  trigger once when using this. The parameters missing from a result are taken from the alert configuration.
+* The on/off commands that the results send directly to devices are coalesced together (see coalesce_window) so the
+  window is waited out once per batch and a later result's command to a device supersedes an earlier one's
+* Defaults to empty (the alert is run once with the configuration)
+param.max_batch_rows = <int>
+* The maximum number of results that are run when batch_fields is set; the rest are skipped (and a warning is logged)
+* Defaults to 500
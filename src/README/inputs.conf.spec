@@ -0,0 +1,23 @@
+[insteon_hub_buffer://<name>]
+* Indexes each message that the Insteon Hub's PLM sends or receives (such as the broadcasts that devices send when they
+* are switched manually) as an event. Only the data written to the hub's buffer since the last poll is decoded and the
+* position in the buffer is checkpointed so that messages are not indexed twice.
+
+address = <string>
+* The address of the Insteon Hub
+
+port = <int>
+* The port of the Insteon Hub web-server
+
+username = <string>
+* The username to authenticate to the Insteon Hub
+
+password = <string>
+* The password to authenticate to the Insteon Hub
+
+transport = <string>
+* How the messages are read from the hub: "http" polls the hub's buffer over the web interface (the default) and "plm"
+* reads them from the PLM directly (optionally with a port, e.g. "plm:9761")
+
+poll_interval = <float>
+* How often to poll the hub's buffer (in seconds); defaults to 1.0
@@ -1,4 +1,19 @@
 # Execute Insteon Command alert action settings
 action.send_insteon_command = 1
 action.send_insteon_command.param.device = <string>
-action.send_insteon_command.param.command = <number>
\ No newline at end of file
+action.send_insteon_command.param.command = <number>
+action.send_insteon_command.param.group = <string>
+* The all-link group (scene) to send the command to as a single broadcast
+* This can be a number (0-255) or the name of an entry in the insteon_devices.csv lookup with a value in the group column
+action.send_insteon_command.param.cleanup = <bool>
+* If true, the devices listed in the device parameter that don't acknowledge the group broadcast will be sent the command directly
+action.send_insteon_command.param.coalesce_window = <float>
+* How long (in seconds) to hold on/off commands to see if a later command to the same device supersedes them (see alert_actions.conf.spec)
+action.send_insteon_command.param.skip_if_in_state = <bool>
+* If true, on/off commands are not sent to devices that are known to already be in the requested state (see alert_actions.conf.spec)
+action.send_insteon_command.param.delivery = <string>
+* Set to "ack" to re-send the commands only when the devices don't acknowledge them (see alert_actions.conf.spec)
+action.send_insteon_command.param.max_retries = <int>
+* How many times a command can be re-sent when the delivery is "ack" (see alert_actions.conf.spec)
+action.send_insteon_command.param.adaptive_hops = <bool>
+* If true, the messages to nearby devices use fewer hops (see alert_actions.conf.spec)
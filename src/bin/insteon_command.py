@@ -2,20 +2,31 @@ import sys
 import urllib
 import time
 import json
+from collections import OrderedDict
 
 import splunk.rest
 from splunk import AuthenticationFailed
 from splunk.util import normalizeBoolean
 
 from insteon_control_app.search_command import SearchCommand
-from send_insteon_command import SendInsteonCommandAlert, InsteonMultipleDeviceField, InsteonCommandField, InsteonExtendedDataField, FieldValidationException
+from insteon_control_app.hub_router import HubRouter
+from insteon_control_app.device_state import DeviceStateCache
+from insteon_control_app.modular_alert import FloatField, IntegerField
+from send_insteon_command import SendInsteonCommandAlert, InsteonMultipleDeviceField, InsteonCommandField, InsteonExtendedDataField, InsteonGroupField, InsteonTransportField, InsteonDeliveryField, FieldValidationException
  
 class SendInsteonCommand(SearchCommand):
     
-    def __init__(self, device=None, command=None, cmd1=None, cmd2=None, return_response=None, data=None):
+    def __init__(self, device=None, command=None, cmd1=None, cmd2=None, return_response=None, data=None, group=None, cleanup=None, coalesce_window=None, skip_if_in_state=None, delivery=None, max_retries=None, adaptive_hops=None):
         
         # Save the parameters
         self.device = device
+        self.group = group
+        self.cleanup = cleanup
+        self.coalesce_window = coalesce_window
+        self.skip_if_in_state = skip_if_in_state
+        self.delivery = delivery
+        self.max_retries = max_retries
+        self.adaptive_hops = adaptive_hops
         self.command = command
         self.cmd1 = cmd1
         self.cmd2 = cmd2
@@ -37,6 +48,8 @@ class SendInsteonCommand(SearchCommand):
         password = None
         hub_address = None
         hub_port = None
+        min_gap = None
+        transport = None
         
         uri = urllib.quote('/servicesNS/nobody/insteon_control/admin/alert_actions/send_insteon_command') + '?output_mode=json'
         
@@ -48,6 +61,8 @@ class SendInsteonCommand(SearchCommand):
             password = info['entry'][0]['content']['param.password']
             hub_address = info['entry'][0]['content']['param.address']
             hub_port = info['entry'][0]['content']['param.port']
+            min_gap = info['entry'][0]['content'].get('param.min_gap', None)
+            transport = info['entry'][0]['content'].get('param.transport', None)
             
         except AuthenticationFailed as e:
             raise e
@@ -56,12 +71,12 @@ class SendInsteonCommand(SearchCommand):
             
             raise e
         
-        return hub_address, hub_port, username, password
+        return hub_address, hub_port, username, password, min_gap, transport
         
     def handle_results(self, results, session_key, in_preview):
         
         # Obtain the authentication information
-        hub_address, hub_port, username, password = self.get_hub_info(session_key)
+        hub_address, hub_port, username, password, min_gap, transport = self.get_hub_info(session_key)
         
         # Make sure we have the information necessary to connect to Insteon
         if hub_address is None:
@@ -85,19 +100,182 @@ class SendInsteonCommand(SearchCommand):
                                   }])
             return False
         
-        # Validate and convert the device field
-        devices = InsteonMultipleDeviceField.normalize_device_ids(self.device)
+        # Get the commands to send from the search results (in streaming mode) or from the arguments
+        try:
+            transport = InsteonTransportField("transport", none_allowed=True).to_python(transport)
+            coalesce_window = FloatField("coalesce_window", none_allowed=True).to_python(self.coalesce_window)
+            delivery = InsteonDeliveryField("delivery", none_allowed=True).to_python(self.delivery)
+            max_retries = IntegerField("max_retries", none_allowed=True).to_python(self.max_retries)
+            
+            if results is not None and len(results) > 0:
+                command_requests = self.get_command_requests_from_results(results)
+            else:
+                command_requests = [self.get_command_request(self.device, self.command, self.cmd1, self.cmd2, self.return_response, self.extended_data, self.group)]
+        except FieldValidationException as e:
+            self.output_results([{
+                                  'message' : str(e)
+                                  }])
+            return False
+        
+        # Configure the spacing between the calls to the hub and how the messages are sent to it
+        adaptive_hops = normalizeBoolean(self.adaptive_hops) is True
+        
+        SendInsteonCommandAlert.configure_session(hub_address, hub_port, username, password, min_gap, transport, adaptive_hops)
+        
+        # This will store the results that we will output at the end
+        results = []
+        
+        # Determine if the devices that don't acknowledge group broadcasts should get the command directly
+        cleanup = normalizeBoolean(self.cleanup)
+        
+        if cleanup is None:
+            cleanup = True
+        
+        # Send the commands to the groups; only the devices that didn't get the broadcast will get the command directly
+        device_commands = []
+        
+        for command_request in command_requests:
+            
+            devices = command_request['devices']
+            
+            if command_request['group'] is not None:
+                sent, devices = SendInsteonCommandAlert.broadcast_to_group(hub_address, hub_port, username, password, command_request['group'], command_request['cmd1'],
+                                                                           command_request['cmd2'], command_request['devices'], cleanup, self.logger)
+                
+                results.append({
+                                'message' : 'Successfully sent Insteon command to group' if sent else 'Failed to send Insteon command to group',
+                                'cmd1' : command_request['cmd1'],
+                                'cmd2' : command_request['cmd2'],
+                                'group' : command_request['group']
+                                })
+            
+            for device in devices:
+                device_commands.append((device, command_request))
+        
+        # Skip the commands that wouldn't change the state of the device
+        skip_if_in_state = normalizeBoolean(self.skip_if_in_state) is True
+        
+        if skip_if_in_state:
+            state_cache = SendInsteonCommandAlert.get_state_cache()
+            needed_device_commands = []
+            
+            for device, command_request in device_commands:
+                if not command_request['extended'] and state_cache.is_in_state(device, command_request['cmd1'], command_request['cmd2']):
+                    results.append({
+                                    'message' : 'Insteon command was not sent since the device is already in the requested state',
+                                    'cmd1' : command_request['cmd1'],
+                                    'cmd2' : command_request['cmd2'],
+                                    'device' : device,
+                                    'success' : True,
+                                    'skipped' : True
+                                    })
+                else:
+                    needed_device_commands.append((device, command_request))
+                    
+            device_commands = needed_device_commands
+        
+        # Skip the commands that are superseded by a later command to the same device within the window
+        coalescer = SendInsteonCommandAlert.get_coalescer(coalesce_window)
+        
+        if coalescer is not None:
+            to_send, dropped = coalescer.coalesce([(device, None if command_request['extended'] else command_request['cmd1'], command_request['cmd2'], (device, command_request))
+                                                   for device, command_request in device_commands])
+            
+            device_commands = [(device, command_request, ticket) for (device, command_request), ticket in to_send]
+            
+            for (device, command_request), reason in dropped:
+                results.append({
+                                'message' : 'Insteon command was not sent since it was %s by another command' % (reason),
+                                'cmd1' : command_request['cmd1'],
+                                'cmd2' : command_request['cmd2'],
+                                'device' : device,
+                                'success' : False
+                                })
+        else:
+            device_commands = [(device, command_request, None) for device, command_request in device_commands]
+        
+        # Send the commands to each device (the hubs will be run concurrently)
+        default_hub = (hub_address, hub_port, username, password)
+        routes = HubRouter.group_by_hub(device_commands, lambda device_command: SendInsteonCommandAlert.get_hub_for_device(device_command[0], default_hub))
+        
+        def send_to_hub(hub, hub_device_commands):
+            
+            address, port, hub_username, hub_password = hub
+            hub_results = []
+            
+            SendInsteonCommandAlert.configure_session(address, port, hub_username, hub_password, min_gap, transport, adaptive_hops)
+            
+            for device, command_request, ticket in hub_device_commands:
+                
+                # Wait for the replies to the commands that set the state so that the state is known the next time
+                response_expected = command_request['response_expected'] or \
+                                    (skip_if_in_state and DeviceStateCache.get_expected_level(command_request['cmd1'], command_request['cmd2']) is not None)
+                
+                try:
+                    hub_results.extend(self.call_insteon_web_api_repeatedly( address, port, hub_username, hub_password, device, command_request['cmd1'], command_request['cmd2'],
+                                                                             command_request['times'], response_expected, command_request['extended'], command_request['data'],
+                                                                             delivery, max_retries ))
+                finally:
+                    if ticket is not None:
+                        coalescer.finish(ticket)
+                
+            return hub_results
+        
+        for hub, hub_results, failure in HubRouter().run(routes, send_to_hub):
+            
+            # Report the devices of the hub that failed; the results of the other hubs are still output
+            if failure is not None:
+                self.logger.error("Insteon commands to the hub %s could not be completed: %s", hub[0], failure.traceback)
+                
+                for device, command_request, ticket in routes[hub]:
+                    if ticket is not None:
+                        coalescer.finish(ticket)
+                    
+                    results.append({
+                                    'message' : 'The commands to the hub could not be completed: %s' % (str(failure)),
+                                    'cmd1' : command_request['cmd1'],
+                                    'cmd2' : command_request['cmd2'],
+                                    'device' : device,
+                                    'hub' : hub[0],
+                                    'success' : False
+                                    })
+            else:
+                results.extend(hub_results)
+    
+        # Output the results so that users know if the commands succeeded
+        self.output_results(results)
+    
+    @classmethod
+    def get_command_request(cls, device, command=None, cmd1=None, cmd2=None, return_response=None, extended_data=None, group=None):
+        """
+        Validate the information describing a command and return a dictionary with the devices and the command to send.
+        Throws a FieldValidationException if the information is invalid.
+        
+        Arguments:
+        device -- The devices to send the command to (comma separated)
+        command -- The name of the command to send (e.g. "on")
+        cmd1 -- The hex string of the first command portion of the command (overrides the one from the command name)
+        cmd2 -- The hex string of the second command portion of the command (overrides the one from the command name)
+        return_response -- Whether the response should be obtained from the device
+        extended_data -- The data to send in an extended direct command
+        group -- The all-link group to broadcast the command to
+        """
+        
+        # Validate and convert the device and group fields
+        group = InsteonGroupField.normalize_group(group)
+        devices = InsteonMultipleDeviceField.normalize_device_ids(device)
+        
+        if devices is None and group is None:
+            raise FieldValidationException('Insufficient information provided: missing device')
+        elif devices is None:
+            devices = []
         
         # Validate and convert the command field
-        cmd1 = self.cmd1
-        cmd2 = self.cmd2
         times = 1
-        response_expected = normalizeBoolean(self.return_response)
-        extended_data = self.extended_data
-        command_info = None
+        response_expected = normalizeBoolean(return_response)
         
-        if self.command is not None:
-            command_info = InsteonCommandField.get_detailed_info_from_command(self.command)
+        if command is not None:
+            command_info = InsteonCommandField.get_detailed_info_from_command(command)
             
             # Populate from the command_info if we got one
             if command_info is not None:
@@ -118,15 +296,9 @@ class SendInsteonCommand(SearchCommand):
                 
         # Stop if we didn't get the proper command information
         if cmd1 is None:
-            self.output_results([{
-                                  'message' : 'Insufficient information provided: missing cmd1'
-                                  }])
-            return False
-        elif cmd1 is None:
-            self.output_results([{
-                                  'message' : 'Insufficient information provided: missing cmd2'
-                                  }])
-            return False
+            raise FieldValidationException('Insufficient information provided: missing cmd1')
+        elif cmd2 is None:
+            raise FieldValidationException('Insufficient information provided: missing cmd2')
                 
         # Determine if we are doing an extended direct command and validate the data
         if extended_data is not None:
@@ -135,26 +307,67 @@ class SendInsteonCommand(SearchCommand):
             try:
                 data = InsteonExtendedDataField.normalize_extended_data(extended_data)
             except FieldValidationException as e:
-                self.output_results([{
-                                      'message' : 'The data field is invalid: ' + str(e)
-                                      }])
+                raise FieldValidationException('The data field is invalid: ' + str(e))
             
         else:
             extended = False
             data = None
+            
+        return {
+                'devices' : sorted(devices),
+                'group' : group,
+                'cmd1' : cmd1,
+                'cmd2' : cmd2,
+                'times' : times,
+                'response_expected' : response_expected,
+                'extended' : extended,
+                'data' : data
+                }
+    
+    def get_command_requests_from_results(self, results):
+        """
+        Get the commands to send from the search results. Each result can include the device, group, command, cmd1, cmd2,
+        return_response and data fields; the arguments of the search command are used for the fields that are missing.
         
-        # This will store the results that we will output at the end
-        results = []
+        The entire set of results is validated before returning so that no commands are sent if any are invalid. The
+        commands that are identical are grouped together so that each device only gets the command once.
         
-        # Execute the command for each device
-        for device in devices:
-            results.extend(self.call_insteon_web_api_repeatedly( hub_address, hub_port, username, password, device, cmd1, cmd2, times, response_expected, extended, data ))
-            time.sleep(2*SendInsteonCommandAlert.SLEEP_BETWEEN_CALL_DURATION)
-    
-        # Output the results so that users know if the commands succeeded
-        self.output_results(results)
+        Arguments:
+        results -- The search results
+        """
+        
+        command_requests = OrderedDict()
+        
+        for row_number, result in enumerate(results, 1):
+            
+            # Get the value of the field from the result, or from the arguments if the result didn't include it
+            def get_value(name, default):
+                value = result.get(name, None)
+                
+                if value is None or len(str(value).strip()) == 0:
+                    return default
+                else:
+                    return value
+            
+            try:
+                command_request = self.get_command_request(get_value('device', self.device), get_value('command', self.command), get_value('cmd1', self.cmd1),
+                                                           get_value('cmd2', self.cmd2), get_value('return_response', self.return_response), get_value('data', self.extended_data),
+                                                           get_value('group', self.group))
+            except FieldValidationException as e:
+                raise FieldValidationException("Result %d is invalid: %s" % (row_number, str(e)))
+            
+            # Group the devices that get the same command
+            key = (command_request['cmd1'], command_request['cmd2'], command_request['times'], command_request['response_expected'], command_request['extended'], command_request['data'], command_request['group'])
+            
+            if key in command_requests:
+                existing_devices = command_requests[key]['devices']
+                existing_devices.extend([device for device in command_request['devices'] if device not in existing_devices])
+            else:
+                command_requests[key] = command_request
+        
+        return command_requests.values()
     
-    def call_insteon_web_api_repeatedly(self, address, port, username, password, device, cmd1, cmd2, times, response_expected=False, extended=False, data=None):
+    def call_insteon_web_api_repeatedly(self, address, port, username, password, device, cmd1, cmd2, times, response_expected=False, extended=False, data=None, delivery=None, max_retries=None):
         """
         Perform a call to the Insteon Web API.
         
@@ -170,6 +383,8 @@ class SendInsteonCommand(SearchCommand):
         response_expected -- If the command should expect a response
         extended -- Whether the command is an extended direct command
         data -- The data to send to the server (in hexadecimal)
+        delivery -- Set to "ack" to re-send the command until the device acknowledges it
+        max_retries -- How many times the command can be re-sent when the delivery is "ack"
         """
         
         if times < 1:
@@ -181,11 +396,22 @@ class SendInsteonCommand(SearchCommand):
         # Call the API the number of times requested
         for i in range(0, times):
             
-            # Call the API
-            result = SendInsteonCommandAlert.call_insteon_web_api(address, port, username, password, device, cmd1, cmd2, response_expected, extended, data, self.logger)
+            status = None
+            
+            # Call the API (re-sending the command until the device acknowledges it if requested)
+            if delivery == SendInsteonCommandAlert.DELIVERY_ACK:
+                status, result, retries = SendInsteonCommandAlert.deliver(address, port, username, password, device, cmd1, cmd2, extended, data, max_retries, self.logger)
+            else:
+                result = SendInsteonCommandAlert.call_insteon_web_api(address, port, username, password, device, cmd1, cmd2, response_expected, extended, data, self.logger)
             
-            # Make the result message with the correct message
-            if result is True:
+            # Make the result message with the correct message (a dictionary is returned if the device responded)
+            if status is not None:
+                result_message = {
+                                      'message' : 'Insteon command was acknowledged by the device' if status == SendInsteonCommandAlert.DELIVERY_ACKED else 'Insteon command was not acknowledged by the device',
+                                      'delivery' : status,
+                                      'retries' : retries
+                                }
+            elif result:
                 result_message = {
                                       'message' : 'Successfully sent Insteon command to device'
                                 }
@@ -203,16 +429,17 @@ class SendInsteonCommand(SearchCommand):
             if extended:
                 result_message['extended'] = 'true'
                 result_message['data'] = data
+                
+            # Add in the response from the device
+            if isinstance(result, dict):
+                result_message['response_cmd1'] = result['cmd1']
+                result_message['response_cmd2'] = result['cmd2']
 
             # Append the result            
             results.append(result_message)
-            
-            # If this isn't the last call, then wait a bit before calling it again
-            if i < times:
-                time.sleep(SendInsteonCommandAlert.SLEEP_BETWEEN_CALL_DURATION)
                 
-            # Return the results
-            return results
+        # Return the results
+        return results
         
 if __name__ == '__main__':
     try:
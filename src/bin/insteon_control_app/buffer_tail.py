@@ -0,0 +1,184 @@
+import time
+import zlib
+from collections import OrderedDict
+
+from insteon_messages import decode_message, split_hub_buffer
+
+class BufferTail(object):
+    """
+    Follows the data that the PLM writes so that each message is only decoded (and reported) once.
+
+    For the Insteon Hub, the position that the hub will write to next (the write pointer) is remembered between polls
+    of the buffer so that only the data written since the last poll is decoded. Data from the PLM socket is all new so
+    it is decoded as it arrives. A message that was cut off is kept until the rest of it arrives.
+
+    Insteon devices often send the same message more than once (e.g. when it is repeated by other devices) so the
+    messages from devices that are identical to one seen very recently (ignoring the number of hops left) are dropped.
+
+    The state can be saved as a checkpoint (see get_checkpoint()) so that a restart doesn't report the messages again.
+    Only the position in the buffer and a digest of the most recent messages are kept so that the checkpoint stays small.
+    """
+
+    # This is how long a message is remembered in order to drop the duplicates of it (in seconds)
+    DUPLICATE_WINDOW = 1.0
+
+    # This is how many of the recent messages are remembered in order to drop the duplicates of them
+    MAX_RECENT = 20
+
+    # This is the longest amount of data that can be waiting for the rest of the message (the longest message is 25 bytes)
+    MAX_PENDING_LENGTH = 50
+
+    def __init__(self, checkpoint=None):
+        """
+        Set up the tail.
+
+        Arguments:
+        checkpoint -- The checkpoint to start from (from get_checkpoint()); the data that is already in the buffer is
+                      skipped if None
+        """
+
+        if checkpoint is None:
+            checkpoint = {}
+
+        # The position in the hub's buffer (in characters) that has been read up to
+        self.pointer = checkpoint.get('pointer', None)
+
+        # The data of the message that is waiting for the rest of it to arrive
+        self.pending = checkpoint.get('pending', '')
+
+        # The messages that were seen recently (oldest first), keyed by the digest of the message (without the hops) with
+        # the time they were seen; the checkpoint stores them as a list of pairs
+        self.recent = OrderedDict()
+
+        for digest, seen in checkpoint.get('recent', []):
+            self.recent[digest] = seen
+
+    def get_checkpoint(self):
+        """
+        Get the state of the tail as a JSON-serializable dictionary.
+        """
+
+        return {
+                'pointer' : self.pointer,
+                'pending' : self.pending,
+                'recent' : [[digest, seen] for digest, seen in self.recent.items()]
+               }
+
+    def get_position(self):
+        """
+        Get where the tail is in the data as a tuple of the position in the hub's buffer and the data of the message that
+        is waiting for the rest of it. The checkpoint only needs to be saved when this changes.
+        """
+
+        return self.pointer, self.pending
+
+    def get_new_data(self, data, pointer):
+        """
+        Get the data that was written to the hub's buffer since it was last read.
+
+        Arguments:
+        data -- The ring of data of the buffer (see split_hub_buffer())
+        pointer -- The position that the next data will be written to (in characters)
+        """
+
+        previous_pointer = self.pointer
+        self.pointer = pointer
+
+        # Skip the data that was already in the buffer when we started; we don't know if it was reported already
+        if previous_pointer is None or previous_pointer > len(data):
+            return ''
+
+        if pointer >= previous_pointer:
+            return data[previous_pointer:pointer]
+
+        # The hub wrapped around to the start of the buffer (or the buffer was cleared)
+        return data[previous_pointer:] + data[:pointer]
+
+    def read_hub_buffer(self, buffer_hex, now=None):
+        """
+        Decode the messages that were written to the hub's buffer since it was last read.
+
+        Arguments:
+        buffer_hex -- The buffer the way that the hub presents it (with the write pointer at the end)
+        now -- The current time (defaults to the current time)
+        """
+
+        data, pointer = split_hub_buffer(buffer_hex)
+
+        return self.read(self.get_new_data(data, pointer), now)
+
+    @staticmethod
+    def get_duplicate_key(message):
+        """
+        Get the key that identifies the duplicates of the message (or None if the message isn't from a device); the
+        hops left are ignored since they change as the message is repeated. The key is a digest of the message.
+
+        Arguments:
+        message -- The message (an InsteonMessage)
+        """
+
+        if message.code not in ['50', '51'] or message.flags is None:
+            return None
+
+        flags = "%02X" % (message.get_flags_value() & ~0x0C)
+
+        return "%08X" % (zlib.crc32(message.raw[0:16] + flags + message.raw[18:]) & 0xFFFFFFFF)
+
+    def read(self, data, now=None):
+        """
+        Decode the messages in the new data and return the ones that aren't duplicates.
+
+        Arguments:
+        data -- The new data as a hexadecimal string
+        now -- The current time (defaults to the current time)
+        """
+
+        if now is None:
+            now = time.time()
+
+        data = self.pending + data.upper()
+        self.pending = ''
+
+        # Forget the messages that were seen too long ago to be duplicates
+        self.recent = OrderedDict((key, seen) for key, seen in self.recent.items() if now - seen < BufferTail.DUPLICATE_WINDOW)
+
+        messages = []
+        position = 0
+
+        while position < len(data):
+
+            # Keep the start of a message whose type hasn't arrived yet
+            if len(data) - position < 4 and data[position:position + 2] == '02':
+                self.pending = data[position:]
+                break
+
+            message, next_position = decode_message(data, position)
+
+            # Keep the message that was cut off until the rest of it arrives
+            if next_position is None:
+                self.pending = data[position:][:BufferTail.MAX_PENDING_LENGTH]
+                break
+
+            # Skip the bytes that aren't part of a message (such as the empty portion of the buffer)
+            if message is None:
+                position = position + 2
+                continue
+
+            position = next_position
+
+            # Drop the duplicates
+            key = BufferTail.get_duplicate_key(message)
+
+            if key is not None:
+                if key in self.recent:
+                    continue
+
+                self.recent[key] = now
+
+                # Forget the oldest message once too many are remembered
+                if len(self.recent) > BufferTail.MAX_RECENT:
+                    self.recent.popitem(last=False)
+
+            messages.append(message)
+
+        return messages
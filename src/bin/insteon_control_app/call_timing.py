@@ -0,0 +1,139 @@
+import time
+import logging
+from logging import handlers
+from collections import OrderedDict
+
+from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+
+from modular_alert import ModularAlert
+
+# This is the name of the logger (and the log file) that the timing events are written to
+TIMING_LOGGER_NAME = 'insteon_call_timing'
+
+def get_timing_logger():
+    """
+    Get the logger that the timing events are written to. The events are written to their own log file so that they
+    get their own sourcetype (see props.conf).
+    """
+
+    logger = logging.getLogger(TIMING_LOGGER_NAME)
+
+    if len(logger.handlers) > 0:
+        return logger
+
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    try:
+        file_handler = handlers.RotatingFileHandler(make_splunkhome_path(['var', 'log', 'splunk', TIMING_LOGGER_NAME + '.log']), maxBytes=25000000, backupCount=5)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        logger.addHandler(file_handler)
+    except IOError:
+        # Don't let a log file that can't be written to stop the commands from being sent
+        logger.addHandler(logging.NullHandler())
+
+    return logger
+
+class CallTiming(object):
+    """
+    Records how long each phase of a call to the hub took so that slow hubs can be told apart from slow powerline
+    delivery:
+
+        wait -- waiting for the hub to be ready for another message (see HubPacer)
+        connect -- opening the connection to the hub (0 when the connection was re-used)
+        http -- sending the message to the hub
+        ack -- from sending the message until the PLM acknowledged it
+        reply -- from sending the message until the device replied
+
+    The phases that didn't happen (e.g. the reply when no response was expected) are left out of the event.
+    """
+
+    PHASES = ['wait', 'connect', 'http', 'ack', 'reply']
+
+    def __init__(self, **fields):
+        """
+        Start timing the call. The times of the ack and the reply are measured from when the timing was started so it
+        should be started right before the message is sent.
+
+        Arguments:
+        fields -- Fields describing the call to include in the event (e.g. the hub and the device)
+        """
+
+        self.start_time = time.time()
+        self.fields = OrderedDict(sorted(fields.items()))
+        self.durations = {}
+
+        self.status = None
+        self.retries = 0
+        self.hops = None
+        self.max_hops = None
+
+    def record(self, phase, duration):
+        """
+        Record how long the given phase took.
+
+        Arguments:
+        phase -- The name of the phase (e.g. "connect")
+        duration -- How long it took (in seconds)
+        """
+
+        self.durations[phase] = duration
+
+    def mark(self, phase):
+        """
+        Record that the given phase completed now (measured from the start of the call). Only the first time is kept.
+
+        Arguments:
+        phase -- The name of the phase (e.g. "ack")
+        """
+
+        if phase not in self.durations:
+            self.durations[phase] = time.time() - self.start_time
+
+    def record_reply(self, reply):
+        """
+        Record the reply from the device, including how many hops it took.
+
+        Arguments:
+        reply -- The reply (an InsteonMessage)
+        """
+
+        self.mark('reply')
+
+        if reply.max_hops is not None:
+            self.max_hops = reply.max_hops
+            self.hops = reply.max_hops - reply.hops_left
+
+    def get_event(self):
+        """
+        Get the fields of the event describing the call (the durations are in milliseconds).
+        """
+
+        event = OrderedDict(self.fields)
+        event['status'] = self.status
+
+        for phase in CallTiming.PHASES:
+            if phase in self.durations:
+                event[phase + '_ms'] = "%.1f" % (self.durations[phase] * 1000)
+
+        event['total_ms'] = "%.1f" % ((time.time() - self.start_time) * 1000)
+        event['retries'] = self.retries
+
+        if self.hops is not None:
+            event['hops'] = self.hops
+            event['max_hops'] = self.max_hops
+
+        return event
+
+    def emit(self, status=None):
+        """
+        Write the event describing the call to the timing log.
+
+        Arguments:
+        status -- The outcome of the call (e.g. "ok" or "failed"); keeps the current status if None
+        """
+
+        if status is not None:
+            self.status = status
+
+        get_timing_logger().info(ModularAlert.create_event_string(self.get_event()))
@@ -0,0 +1,197 @@
+"""
+This module contains the catalog of the shortcuts to common Insteon commands (e.g. "on" and "beep").
+
+The catalog is compiled once when the module is loaded: each command gets the frames (everything in the message after
+the device address) for each number of max hops, with the checksum of extended messages already computed. The catalog
+also drives the list of commands in the alert action's UI (default/data/ui/alerts/send_insteon_command.html); run this
+module with the path of the HTML file to regenerate the list after changing the catalog.
+"""
+
+import re
+import sys
+from collections import OrderedDict
+
+from insteon_messages import add_checksum
+from link_quality import LinkQualityTable
+
+class InsteonCommand(object):
+    """
+    Describes a command in the catalog. The commands are immutable since they are shared.
+    """
+
+    __slots__ = ('name', 'label', 'cmd1', 'cmd2', 'response_expected', 'times', 'extended', 'data', 'show_in_ui', 'frames')
+
+    def __init__(self, name, label, cmd1, cmd2, response_expected=False, times=1, data=None, show_in_ui=True):
+        """
+        Describe the command.
+
+        Arguments:
+        name -- The name of the command (e.g. "fast_on")
+        label -- The name of the command shown to users (e.g. "Fast On")
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        response_expected -- Whether the response from the device should be obtained
+        times -- How many times the command should be sent
+        data -- The hex string of the user data; the command is an extended command if it has data
+        show_in_ui -- Whether the command is listed in the alert action's UI
+        """
+
+        extended = data is not None
+
+        if extended:
+            data = data.zfill(28).upper()
+
+        # Make the frames for each number of hops, with and without the checksum (which only i2cs devices require)
+        frames = {}
+
+        for max_hops in range(0, LinkQualityTable.MAX_HOPS + 1):
+            flags = LinkQualityTable.get_flags(max_hops, extended)
+
+            for checksum in [False, True]:
+                if extended:
+                    frames[(max_hops, checksum)] = flags + cmd1 + cmd2 + (add_checksum(cmd1, cmd2, data) if checksum else data)
+                else:
+                    frames[(max_hops, checksum)] = flags + cmd1 + cmd2
+
+        for name, value in [('name', name), ('label', label), ('cmd1', cmd1), ('cmd2', cmd2), ('response_expected', response_expected),
+                            ('times', times), ('extended', extended), ('data', data), ('show_in_ui', show_in_ui), ('frames', frames)]:
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The commands in the catalog cannot be changed")
+
+    def __repr__(self):
+        return "InsteonCommand(%s)" % (self.name)
+
+    def get_message(self, device, max_hops=LinkQualityTable.MAX_HOPS, checksum=False):
+        """
+        Get the message that sends the command to the device.
+
+        Arguments:
+        device -- The address of the device
+        max_hops -- The maximum number of hops of the message
+        checksum -- Whether the last byte of the user data of an extended message should be the checksum
+        """
+
+        return "0262" + device + self.frames[(max_hops, checksum)]
+
+# These are the commands in the order that they are listed in the UI
+COMMANDS = OrderedDict((command.name, command) for command in [
+    InsteonCommand('on', 'On', '11', 'FF'),
+    InsteonCommand('fast_on', 'Fast On', '12', 'FF'),
+    InsteonCommand('off', 'Off', '13', 'FF'),
+    InsteonCommand('fast_off', 'Fast Off', '14', 'FF'),
+    InsteonCommand('light_status', 'Light status', '19', '02', response_expected=True, show_in_ui=False),
+    InsteonCommand('status', 'Status', '15', 'FF', response_expected=True, show_in_ui=False),
+
+    # Beeps
+    InsteonCommand('beep', 'Beep', '30', '01'),
+    InsteonCommand('beep_two_times', 'Beep two times', '30', '01', times=2),
+    InsteonCommand('beep_three_times', 'Beep three times', '30', '01', times=3),
+    InsteonCommand('beep_four_times', 'Beep four times', '30', '01', times=4),
+    InsteonCommand('beep_five_times', 'Beep five times', '30', '01', times=5),
+    InsteonCommand('beep_ten_times', 'Beep ten times', '30', '01', times=10),
+
+    # iMeter
+    InsteonCommand('imeter_status', 'iMeter power status', '82', '00', response_expected=True, show_in_ui=False),
+    InsteonCommand('imeter_reset', 'iMeter power reset', '80', '00', show_in_ui=False),
+    InsteonCommand('ping', 'Ping', '0F', '00', response_expected=True, show_in_ui=False),
+
+    # Thermostat info
+    InsteonCommand('thermostat_info', 'Thermostat info', '2E', '02', data='9296', show_in_ui=False),
+    InsteonCommand('thermostat_temp', 'Thermostat temperature', '6A', '00', show_in_ui=False),
+    InsteonCommand('thermostat_humidity', 'Thermostat humidity', '6A', '20', show_in_ui=False),
+    InsteonCommand('thermostat_setpoint', 'Thermostat set-point', '6A', '60', data='9296', show_in_ui=False),
+
+    # Thermostat control
+    InsteonCommand('thermostat_mode_heat', 'Thermostat mode: heat', '6B', '04', show_in_ui=False),
+    InsteonCommand('thermostat_mode_cool', 'Thermostat mode: cool', '6B', '05', show_in_ui=False),
+    InsteonCommand('thermostat_mode_manual_auto', 'Thermostat mode: manual auto', '6B', '06', show_in_ui=False),
+    InsteonCommand('thermostat_fan_on', 'Thermostat fan on', '6B', '07', show_in_ui=False),
+    InsteonCommand('thermostat_fan_auto', 'Thermostat fan auto', '6B', '08', show_in_ui=False),
+    InsteonCommand('thermostat_all_off', 'Thermostat all off', '6B', '09', show_in_ui=False),
+    InsteonCommand('thermostat_mode_auto', 'Thermostat mode: auto', '6B', '0A', show_in_ui=False)
+])
+
+# This is an index of the commands by what they send so that the frames can be used for commands given by cmd1 and cmd2
+COMMANDS_BY_FRAME = dict(((command.cmd1, command.cmd2, command.data), command) for command in reversed(COMMANDS.values()))
+
+def get_command(name):
+    """
+    Get the command with the given name (or None if there isn't one).
+
+    Arguments:
+    name -- The name of the command (e.g. "fast_on"); case and surrounding spaces are ignored
+    """
+
+    return COMMANDS.get(name.lower().strip(), None)
+
+def build_message(device, cmd1, cmd2, extended=False, data=None, max_hops=LinkQualityTable.MAX_HOPS, checksum=False):
+    """
+    Build the message that sends the command to the device. The pre-compiled frame is used if the command is in the
+    catalog.
+
+    Arguments:
+    device -- The address of the device
+    cmd1 -- The hex string of the first command portion of the command
+    cmd2 -- The hex string of the second command portion of the command
+    extended -- Whether the command is an extended direct command
+    data -- The hex string of the 14 bytes of user data (for extended commands)
+    max_hops -- The maximum number of hops of the message
+    checksum -- Whether the last byte of the user data of an extended message should be the checksum
+    """
+
+    if not extended:
+        data = None
+
+    command = COMMANDS_BY_FRAME.get((cmd1, cmd2, data), None)
+
+    if command is not None:
+        return command.get_message(device, max_hops, checksum)
+
+    flags = LinkQualityTable.get_flags(max_hops, extended)
+
+    if not extended:
+        return "0262" + device + flags + cmd1 + cmd2
+    elif checksum:
+        return "0262" + device + flags + cmd1 + cmd2 + add_checksum(cmd1, cmd2, data)
+    else:
+        return "0262" + device + flags + cmd1 + cmd2 + data
+
+def render_command_options(indent=''):
+    """
+    Get the HTML options listing the commands shown in the alert action's UI.
+
+    Arguments:
+    indent -- The whitespace to put before each option
+    """
+
+    return "\n".join([indent + '<option value="%s">%s</option>' % (command.name, command.label) for command in COMMANDS.values() if command.show_in_ui])
+
+# This matches the list of the commands in the alert action's UI
+COMMAND_SELECT_REGEX = re.compile(r'(?P<start><select name="action\.send_insteon_command\.param\.command"[^>]*>\s*?\n)(?P<options>.*?)(?P<end>\n(?P<indent>[ \t]*)</select>)', re.DOTALL)
+
+def update_alert_html(html):
+    """
+    Replace the list of the commands in the HTML of the alert action's UI with the commands from the catalog.
+
+    Arguments:
+    html -- The content of the HTML file
+    """
+
+    def replace(match):
+        return match.group('start') + render_command_options(match.group('indent') + '  ') + match.group('end')
+
+    return COMMAND_SELECT_REGEX.sub(replace, html, 1)
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print >> sys.stderr, "Usage: python command_catalog.py <path to send_insteon_command.html>"
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as fp:
+        html = fp.read()
+
+    with open(sys.argv[1], 'w') as fp:
+        fp.write(update_alert_html(html))
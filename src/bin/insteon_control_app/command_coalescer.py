@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import errno
+import binascii
+
+try:
+    import fcntl
+except ImportError:
+    # File locks aren't available on Windows; the journal is still used but updates may race
+    fcntl = None
+
+class CommandCoalescer(object):
+    """
+    Collapses the commands that change the state of a device (on, off and their fast variants, including on with a
+    level) when several are sent to the same device within a short window; only the last one is sent. Commands that are
+    identical to one that is already waiting or being sent to the device are dropped.
+
+    Commands are submitted, then the caller waits out the window (once for the entire batch) and then claims each
+    command. A claim fails if a later command to the device was submitted in the meantime (by this or another process).
+    The commands are tracked in a journal file so that all of the processes sending commands see each other's commands.
+
+    Commands that are not idempotent (such as beeps or brighten/dim steps) are never collapsed or dropped.
+    """
+
+    # These are the commands (cmd1) that set the state of the device and thus can be collapsed into the last one
+    STATE_COMMANDS = ['11', '12', '13', '14']
+
+    # This is how long a command can be in-flight before it is assumed that the process sending it died
+    IN_FLIGHT_TIMEOUT = 30
+
+    # The ticket states
+    STATE_PENDING = 'pending'
+    STATE_IN_FLIGHT = 'in_flight'
+
+    # The reasons that commands are dropped
+    DROPPED_SUPERSEDED = 'superseded'
+    DROPPED_DUPLICATE = 'duplicate'
+
+    def __init__(self, journal_file, window):
+        """
+        Set up the coalescer.
+
+        Arguments:
+        journal_file -- The path of the file to track the commands in
+        window -- How long to wait for a later command to the same device (in seconds)
+        """
+
+        self.journal_file = journal_file
+        self.window = window
+
+    @classmethod
+    def is_coalescable(cls, cmd1):
+        """
+        Indicates if commands with the given cmd1 can be collapsed.
+
+        Arguments:
+        cmd1 -- The hex string of the first command portion of the command
+        """
+
+        return cmd1 is not None and cmd1.zfill(2).upper() in cls.STATE_COMMANDS
+
+    def update_journal(self, function):
+        """
+        Call the function with the entries of the journal (a dictionary keyed by device) while the journal is locked
+        and save the changes it makes. Returns the value returned by the function.
+
+        Arguments:
+        function -- A function that accepts the dictionary of entries
+        """
+
+        try:
+            os.makedirs(os.path.dirname(self.journal_file))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd = os.open(self.journal_file, os.O_RDWR | os.O_CREAT, 0600)
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+            # Load the journal
+            content = ''
+
+            while True:
+                data = os.read(fd, 65536)
+
+                if len(data) == 0:
+                    break
+
+                content = content + data
+
+            try:
+                entries = json.loads(content)
+            except ValueError:
+                entries = {}
+
+            # Drop the entries that are no longer relevant so that the journal doesn't keep growing
+            expired = time.time() - max(self.window, CommandCoalescer.IN_FLIGHT_TIMEOUT)
+            entries = dict((device, entry) for device, entry in entries.items() if entry['updated'] > expired)
+
+            result = function(entries)
+
+            # Save the journal
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(entries))
+
+            return result
+
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def submit(self, device, cmd1, cmd2):
+        """
+        Submit a command. Returns a ticket (to pass to claim() and finish()) or None if the command is identical to one
+        that is already waiting or being sent to the device (in which case it shouldn't be sent).
+
+        Arguments:
+        device -- The device that the command will be sent to
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        """
+
+        cmd1 = cmd1.zfill(2).upper()
+        cmd2 = cmd2.zfill(2).upper()
+
+        def submit_entry(entries):
+            entry = entries.get(device, None)
+            now = time.time()
+
+            # Drop the command if it is a duplicate of one that hasn't been sent yet
+            if entry is not None and entry['cmd1'] == cmd1 and entry['cmd2'] == cmd2 \
+               and entry['state'] in [CommandCoalescer.STATE_PENDING, CommandCoalescer.STATE_IN_FLIGHT]:
+                return None
+
+            ticket = {
+                      'device' : device,
+                      'id' : binascii.hexlify(os.urandom(8)),
+                      'submitted' : now
+                     }
+
+            entries[device] = {
+                               'ticket' : ticket['id'],
+                               'cmd1' : cmd1,
+                               'cmd2' : cmd2,
+                               'state' : CommandCoalescer.STATE_PENDING,
+                               'updated' : now
+                              }
+
+            return ticket
+
+        return self.update_journal(submit_entry)
+
+    def wait(self, tickets):
+        """
+        Wait until the window has passed for all of the given tickets. Returns how long it waited (in seconds).
+
+        Arguments:
+        tickets -- The tickets returned by submit()
+        """
+
+        tickets = [ticket for ticket in tickets if ticket is not None]
+
+        if len(tickets) == 0:
+            return 0
+
+        delay = max([ticket['submitted'] for ticket in tickets]) + self.window - time.time()
+
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+
+        return 0
+
+    def claim(self, ticket):
+        """
+        Claim the ticket so that the command can be sent. Returns False if a later command to the device was submitted
+        (in which case the command shouldn't be sent).
+
+        Arguments:
+        ticket -- The ticket returned by submit()
+        """
+
+        def claim_entry(entries):
+            entry = entries.get(ticket['device'], None)
+
+            if entry is None or entry['ticket'] != ticket['id']:
+                return False
+
+            entry['state'] = CommandCoalescer.STATE_IN_FLIGHT
+            entry['updated'] = time.time()
+
+            return True
+
+        return self.update_journal(claim_entry)
+
+    def finish(self, ticket):
+        """
+        Note that the command was sent.
+
+        Arguments:
+        ticket -- The ticket returned by submit()
+        """
+
+        def finish_entry(entries):
+            entry = entries.get(ticket['device'], None)
+
+            if entry is not None and entry['ticket'] == ticket['id']:
+                del entries[ticket['device']]
+
+        self.update_journal(finish_entry)
+
+    def coalesce(self, commands):
+        """
+        Submit the commands, wait out the window and claim them. Returns a tuple of the list of the commands to send (as
+        (command, ticket) tuples; the ticket is None for commands that can't be collapsed) and the list of the commands
+        that were dropped (as (command, reason) tuples).
+
+        Arguments:
+        commands -- A list of (device, cmd1, cmd2, command) tuples; the command can be anything that describes the
+                    command to the caller
+        """
+
+        submitted = []
+        dropped = []
+
+        for device, cmd1, cmd2, command in commands:
+
+            if not CommandCoalescer.is_coalescable(cmd1):
+                submitted.append((command, None))
+                continue
+
+            ticket = self.submit(device, cmd1, cmd2)
+
+            if ticket is None:
+                dropped.append((command, CommandCoalescer.DROPPED_DUPLICATE))
+            else:
+                submitted.append((command, ticket))
+
+        self.wait([ticket for command, ticket in submitted])
+
+        to_send = []
+
+        for command, ticket in submitted:
+            if ticket is None or self.claim(ticket):
+                to_send.append((command, ticket))
+            else:
+                dropped.append((command, CommandCoalescer.DROPPED_SUPERSEDED))
+
+        return to_send, dropped
@@ -0,0 +1,142 @@
+import threading
+
+from persistent_cache import PersistentCache
+
+class DeviceCapabilityCache(object):
+    """
+    Keeps track of the Insteon engine version (i1, i2 or i2cs) and the product information (category, sub-category and
+    firmware version) of each device so that the messages can be built the way that the device expects them.
+
+    Devices using the i2cs engine ignore extended messages whose last byte of user data isn't the checksum of the
+    message, so the checksum is filled in for them. The engine version is learned by probing the device (see
+    SendInsteonCommandAlert.probe_capabilities()) and is kept for a long time since it never changes for a device.
+    """
+
+    # These are the engine versions, indexed by the value of cmd2 in the reply to the engine version request
+    ENGINE_I1 = 'i1'
+    ENGINE_I2 = 'i2'
+    ENGINE_I2CS = 'i2cs'
+
+    ENGINES = [ENGINE_I1, ENGINE_I2, ENGINE_I2CS]
+
+    # These are the requests for the engine version and the product information
+    ENGINE_VERSION_CMD1 = '0D'
+    PRODUCT_REQUEST_CMD1 = '10'
+
+    # This is how long the capabilities are kept (in seconds); a device could be replaced with a different one
+    TTL = 30 * 86400
+
+    # This is how long to wait before probing a device that didn't answer the probe again (in seconds)
+    FAILED_PROBE_TTL = 3600
+
+    def __init__(self, cache_file):
+        """
+        Set up the cache.
+
+        Arguments:
+        cache_file -- The path of the file to store the capabilities in
+        """
+
+        self.cache = PersistentCache(cache_file)
+
+        # The cache is shared by the threads sending to each hub
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get_engine_from_reply(cls, cmd2, nak=False):
+        """
+        Get the engine version from the reply to the engine version request (or None if it can't be determined).
+
+        Arguments:
+        cmd2 -- The hex string of cmd2 of the reply
+        nak -- Whether the device refused the request
+        """
+
+        # i2cs devices refuse the request (with a cmd2 of FF) if the hub isn't in their all-link database
+        if nak:
+            return cls.ENGINE_I2CS if cmd2 == 'FF' else None
+
+        engine = int(cmd2, 16)
+
+        if engine < len(cls.ENGINES):
+            return cls.ENGINES[engine]
+
+        return None
+
+    def get_capabilities(self, device):
+        """
+        Get the capabilities of the device as a dictionary (or None if the device hasn't been probed).
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        with self.lock:
+            return self.cache.get(device.upper(), None)
+
+    def get_engine(self, device):
+        """
+        Get the engine version of the device (or None if it isn't known).
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        capabilities = self.get_capabilities(device)
+
+        if capabilities is None:
+            return None
+
+        return capabilities.get('engine', None)
+
+    def update(self, device, **capabilities):
+        """
+        Record the capabilities of the device (e.g. engine="i2cs"); the capabilities that are None are left unchanged.
+
+        Arguments:
+        device -- The address of the device
+        capabilities -- The capabilities (engine, category, subcategory and firmware)
+        """
+
+        with self.lock:
+            entry = dict(self.get_capabilities(device) or {})
+
+            for name, value in capabilities.items():
+                if value is not None:
+                    entry[name] = value
+
+            self.cache.set(device.upper(), entry, DeviceCapabilityCache.TTL)
+
+    def record_failed_probe(self, device):
+        """
+        Note that the device didn't answer the probe so that it isn't probed again for a while.
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        with self.lock:
+            if self.get_capabilities(device) is None:
+                self.cache.set(device.upper(), {}, DeviceCapabilityCache.FAILED_PROBE_TTL)
+
+    def record_product_info(self, device, broadcast):
+        """
+        Record the product information from the broadcast that the device sends in response to a product request. The
+        category, sub-category and firmware version are in place of the address that the broadcast was sent to.
+
+        Arguments:
+        device -- The address of the device
+        broadcast -- The broadcast from the device (an InsteonMessage)
+        """
+
+        self.update(device, category=broadcast.to_address[0:2], subcategory=broadcast.to_address[2:4], firmware=broadcast.to_address[4:6])
+
+    def requires_checksum(self, device):
+        """
+        Indicates if the extended messages sent to the device need the checksum in the last byte of the user data.
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        return self.get_engine(device) == DeviceCapabilityCache.ENGINE_I2CS
@@ -0,0 +1,262 @@
+import os
+import csv
+import cPickle as pickle
+import hashlib
+import errno
+import re
+import threading
+
+class DeviceLookupIndex(object):
+    """
+    Provides an index of the devices within an Insteon devices lookup file (e.g. insteon_devices.csv) by name.
+
+    The index is built once per file and is kept in memory until the file's modification time or size changes. The
+    index can also be saved to a cache directory so that new processes can skip parsing the CSV file. The indexes can be
+    used from several threads (such as the ones sending commands to each hub).
+    """
+
+    # The indexes that have been loaded, keyed by the path of the lookup file
+    indexes = {}
+    indexes_lock = threading.Lock()
+
+    # The version of the format of the cached index files; change this if the format changes
+    CACHE_VERSION = 1
+
+    def __init__(self, lookup_file, cache_directory=None):
+        """
+        Set up the index.
+
+        Arguments:
+        lookup_file -- The path to the lookup file
+        cache_directory -- The directory to store the pre-compiled index in (won't be stored if None)
+        """
+
+        self.lookup_file = lookup_file
+        self.cache_directory = cache_directory
+
+        self.signature = None
+        self.devices = {}
+        self.devices_by_address = {}
+
+        # This keeps two threads from reloading the index at the same time
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_index(cls, lookup_file, cache_directory=None):
+        """
+        Get the index for the given lookup file, creating it if necessary.
+
+        Arguments:
+        lookup_file -- The path to the lookup file
+        cache_directory -- The directory to store the pre-compiled index in (won't be stored if None)
+        """
+
+        with cls.indexes_lock:
+            index = cls.indexes.get(lookup_file, None)
+
+            if index is None:
+                index = cls(lookup_file, cache_directory)
+                cls.indexes[lookup_file] = index
+
+        return index
+
+    def get_file_signature(self):
+        """
+        Get a signature (the modification time and size) that indicates if the lookup file changed. Returns None if
+        the lookup file doesn't exist.
+        """
+
+        try:
+            stat = os.stat(self.lookup_file)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def get_cache_file(self):
+        """
+        Get the path of the file that the pre-compiled index is stored in.
+        """
+
+        if self.cache_directory is None:
+            return None
+
+        return os.path.join(self.cache_directory, hashlib.md5(self.lookup_file).hexdigest() + ".idx")
+
+    def load_lookup_file(self):
+        """
+        Parse the lookup file and return a dictionary of the device entries keyed by the name.
+        """
+
+        devices = {}
+
+        with open(self.lookup_file, 'rb') as csvfile:
+            insteon_devices = csv.DictReader(csvfile)
+
+            for insteon_device in insteon_devices:
+                name = insteon_device.get('name', None)
+
+                # Keep the first entry if the name was listed more than once
+                if name is not None and name not in devices:
+                    devices[name] = insteon_device
+
+        return devices
+
+    def load_cache_file(self, signature):
+        """
+        Load the pre-compiled index if it exists and matches the given signature of the lookup file. Returns None if
+        the pre-compiled index could not be used.
+
+        Arguments:
+        signature -- The signature of the lookup file
+        """
+
+        cache_file = self.get_cache_file()
+
+        if cache_file is None:
+            return None
+
+        try:
+            with open(cache_file, 'rb') as fp:
+                version, cached_signature, devices = pickle.load(fp)
+
+            if version == DeviceLookupIndex.CACHE_VERSION and cached_signature == signature:
+                return devices
+
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        return None
+
+    def save_cache_file(self, signature, devices):
+        """
+        Save the index so that other processes can use it.
+
+        Arguments:
+        signature -- The signature of the lookup file
+        devices -- The dictionary of the devices
+        """
+
+        cache_file = self.get_cache_file()
+
+        if cache_file is None:
+            return
+
+        try:
+            try:
+                os.makedirs(self.cache_directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            # Write to a temporary file and then move it into place so that other processes don't read a partial file
+            temp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+
+            with open(temp_file, 'wb') as fp:
+                pickle.dump((DeviceLookupIndex.CACHE_VERSION, signature, devices), fp, pickle.HIGHEST_PROTOCOL)
+
+            os.rename(temp_file, cache_file)
+
+        except (IOError, OSError):
+            # The index still works without the pre-compiled file
+            pass
+
+    def refresh(self):
+        """
+        Reload the index if the lookup file changed.
+        """
+
+        signature = self.get_file_signature()
+
+        if signature == self.signature:
+            return
+
+        with self.lock:
+
+            # Another thread may have reloaded it while we waited
+            if signature == self.signature:
+                return
+
+            if signature is None:
+                devices = {}
+            else:
+                devices = self.load_cache_file(signature)
+
+                if devices is None:
+                    devices = self.load_lookup_file()
+                    self.save_cache_file(signature, devices)
+
+            # Index the devices by the address too (without the separators and in upper-case, e.g. "56789A")
+            devices_by_address = {}
+
+            for device in devices.values():
+                address = DeviceLookupIndex.normalize_address(device.get('address', None))
+
+                if address is not None and address not in devices_by_address:
+                    devices_by_address[address] = device
+
+            # Replace the index once it is complete so that the other threads don't see it partially built
+            self.devices = devices
+            self.devices_by_address = devices_by_address
+            self.signature = signature
+
+    def get_device(self, name):
+        """
+        Get the entry from the lookup for the device with the given name (or None if it isn't in the lookup).
+
+        Arguments:
+        name -- The name of the device
+        """
+
+        self.refresh()
+
+        return self.devices.get(name, None)
+
+    @staticmethod
+    def normalize_address(address):
+        """
+        Remove the separators from the address and convert it to upper-case (e.g. "56.78.9a" becomes "56789A").
+
+        Arguments:
+        address -- The address of the device
+        """
+
+        if address is None or len(address.strip()) == 0:
+            return None
+
+        return re.sub("[-:. ]", "", address).upper()
+
+    def get_device_by_address(self, address):
+        """
+        Get the entry from the lookup for the device with the given address (or None if it isn't in the lookup).
+
+        Arguments:
+        address -- The address of the device
+        """
+
+        self.refresh()
+
+        return self.devices_by_address.get(DeviceLookupIndex.normalize_address(address), None)
+
+    def get_addresses(self):
+        """
+        Get the addresses of all of the devices in the lookup (without the separators and in upper-case).
+        """
+
+        self.refresh()
+
+        return sorted(self.devices_by_address.keys())
+
+    def get_address(self, name):
+        """
+        Get the address of the device with the given name (or None if it isn't in the lookup).
+
+        Arguments:
+        name -- The name of the device
+        """
+
+        device = self.get_device(name)
+
+        if device is None:
+            return None
+
+        return device.get('address', None)
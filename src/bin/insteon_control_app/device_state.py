@@ -0,0 +1,198 @@
+import threading
+
+from persistent_cache import PersistentCache
+from insteon_messages import MESSAGE_TYPE_DIRECT_ACK, MESSAGE_TYPE_ALL_LINK_BROADCAST, MESSAGE_TYPE_ALL_LINK_CLEANUP, MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK
+
+class DeviceStateCache(object):
+    """
+    Keeps track of the last known light level (0-255) of each device so that commands that wouldn't change the state of
+    a device (like turning off a light that is already off) can be skipped.
+
+    The levels are learned from the messages in the PLM's buffer: the replies to the commands sent to the devices
+    (including status requests), the acknowledgements of group broadcasts and the broadcasts that devices send when
+    they are switched manually. Each entry expires based on how it was learned since a device can be changed without the
+    hub seeing it (e.g. by a scene controlled from another device).
+
+    A device is forgotten whenever a command is sent to it without the reply being observed since its state is no
+    longer known.
+    """
+
+    # These are the commands that turn the device off (off and fast off)
+    OFF_COMMANDS = ['13', '14']
+
+    # These are the commands whose reply includes the level of the device in cmd2
+    LEVEL_REPLY_COMMANDS = ['11', '12', '15', '16', '19']
+
+    # These are the commands that don't change the state of the device
+    QUERY_COMMANDS = ['0F', '19']
+
+    # This is how long the levels are trusted (in seconds), based on how they were learned
+    SOURCE_REPLY = 'reply'
+    SOURCE_BROADCAST = 'broadcast'
+
+    TTLS = {
+            SOURCE_REPLY : 1800,
+            SOURCE_BROADCAST : 600
+           }
+
+    def __init__(self, cache_file):
+        """
+        Set up the cache.
+
+        Arguments:
+        cache_file -- The path of the file to store the levels in
+        """
+
+        self.cache = PersistentCache(cache_file)
+
+        # The cache is shared by the threads sending to each hub
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get_expected_level(cls, cmd1, cmd2):
+        """
+        Get the level that the command will put the device in (or None if the command doesn't set the level).
+
+        Arguments:
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        """
+
+        cmd1 = cmd1.zfill(2).upper()
+
+        if cmd1 == '11':
+            return int(cmd2, 16)
+
+        # Fast on always goes to the full level
+        elif cmd1 == '12':
+            return 255
+
+        elif cmd1 in cls.OFF_COMMANDS:
+            return 0
+
+        return None
+
+    def get_level(self, device):
+        """
+        Get the last known level of the device (or None if it isn't known).
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        with self.lock:
+            entry = self.cache.get(device.upper(), None)
+
+        if entry is None:
+            return None
+
+        return entry['level']
+
+    def is_in_state(self, device, cmd1, cmd2):
+        """
+        Indicates if the device is known to already be in the state that the command would put it in.
+
+        Arguments:
+        device -- The address of the device
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        """
+
+        expected_level = DeviceStateCache.get_expected_level(cmd1, cmd2)
+
+        return expected_level is not None and self.get_level(device) == expected_level
+
+    def set_level(self, device, level, source, save=True):
+        """
+        Record the level of the device.
+
+        Arguments:
+        device -- The address of the device
+        level -- The level of the device (0-255)
+        source -- How the level was learned (SOURCE_REPLY or SOURCE_BROADCAST); determines how long it is kept
+        save -- Whether the cache file should be written now
+        """
+
+        with self.lock:
+            self.cache.set(device.upper(), {'level' : level, 'source' : source}, DeviceStateCache.TTLS[source], save)
+
+    def forget(self, device, save=True):
+        """
+        Remove the level of the device since it is no longer known.
+
+        Arguments:
+        device -- The address of the device
+        save -- Whether the cache file should be written now
+        """
+
+        with self.lock:
+            self.cache.delete(device.upper(), save)
+
+    def record_sent(self, device, cmd1):
+        """
+        Note that a command was sent to the device. The device is forgotten (unless the command doesn't change its state)
+        until the reply is recorded.
+
+        Arguments:
+        device -- The address of the device
+        cmd1 -- The hex string of the first command portion of the command
+        """
+
+        if cmd1.zfill(2).upper() not in DeviceStateCache.QUERY_COMMANDS:
+            self.forget(device)
+
+    def record_messages(self, messages):
+        """
+        Record the levels of the devices from the messages in the PLM's buffer. Only the messages starting at the last
+        one that the PLM sent are used since the older ones may be stale.
+
+        Arguments:
+        messages -- A list of InsteonMessage instances (from decode_buffer())
+        """
+
+        # Find the last message that was sent
+        start = None
+
+        for index, message in enumerate(messages):
+            if message.code in ['61', '62']:
+                start = index
+
+        if start is None:
+            return
+
+        sent = messages[start]
+
+        with self.lock:
+            for message in messages[start + 1:]:
+
+                if message.code != '50':
+                    continue
+
+                device = message.from_address
+
+                # The reply to a direct command
+                if sent.code == '62' and device == sent.to_address and message.message_type == MESSAGE_TYPE_DIRECT_ACK:
+
+                    if sent.cmd1 in DeviceStateCache.OFF_COMMANDS:
+                        self.set_level(device, 0, DeviceStateCache.SOURCE_REPLY, False)
+                    elif sent.cmd1 in DeviceStateCache.LEVEL_REPLY_COMMANDS:
+                        self.set_level(device, int(message.cmd2, 16), DeviceStateCache.SOURCE_REPLY, False)
+
+                # The acknowledgement of the clean-up of a group broadcast; the level of the scene isn't known for "on"
+                elif sent.code == '61' and message.cmd1 == sent.cmd1 \
+                    and message.message_type in [MESSAGE_TYPE_DIRECT_ACK, MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK]:
+
+                    if sent.cmd1 in DeviceStateCache.OFF_COMMANDS:
+                        self.set_level(device, 0, DeviceStateCache.SOURCE_REPLY, False)
+                    else:
+                        self.forget(device, False)
+
+                # A device that was switched manually; the level it was turned on to isn't known
+                elif message.message_type in [MESSAGE_TYPE_ALL_LINK_BROADCAST, MESSAGE_TYPE_ALL_LINK_CLEANUP]:
+
+                    if message.cmd1 in DeviceStateCache.OFF_COMMANDS:
+                        self.set_level(device, 0, DeviceStateCache.SOURCE_BROADCAST, False)
+                    else:
+                        self.forget(device, False)
+
+            self.cache.save()
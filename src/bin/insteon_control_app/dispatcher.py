@@ -0,0 +1,254 @@
+"""
+This module provides a long-lived dispatcher that runs modular alerts on behalf of short-lived alert processes.
+
+Splunk starts a new process each time that an alert fires. The dispatcher allows the alert processes to hand off the
+payload over a local UNIX socket to a resident process that already has the libraries loaded and the connections to
+the hub open. The protocol is a single line of JSON in each direction:
+
+    request:  {"payload": {...}}
+    response: {"result": true} or {"error": "..."}
+
+The dispatcher responds as soon as the alert is queued (rather than once it ran) so that an alert process isn't left
+waiting on the alerts queued before it.
+"""
+
+import os
+import sys
+import json
+import socket
+import errno
+import threading
+import Queue
+import SocketServer
+
+class DispatcherUnavailableException(Exception):
+    """
+    Indicates that the dispatcher is not running.
+    """
+    pass
+
+class DispatcherException(Exception):
+    """
+    Indicates that the dispatcher failed to run the alert.
+    """
+    pass
+
+def forward_to_dispatcher(socket_path, payload, timeout=10):
+    """
+    Hand the payload off to the dispatcher. Returns True once the dispatcher queued the alert.
+
+    The alert is considered dispatched once the payload was sent even if the dispatcher doesn't respond in time since it
+    may still run it; running the alert again would send the commands twice.
+
+    Arguments:
+    socket_path -- The path of the UNIX socket that the dispatcher is listening on
+    payload -- The payload of the alert (as received from Splunk)
+    timeout -- How long to wait for the dispatcher to queue the alert (in seconds)
+    """
+
+    if not os.path.exists(socket_path):
+        raise DispatcherUnavailableException("The dispatcher socket does not exist")
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+
+    try:
+        try:
+            client.connect(socket_path)
+        except socket.error as e:
+            raise DispatcherUnavailableException("Unable to connect to the dispatcher: " + str(e))
+
+        client.sendall(json.dumps({'payload' : payload}) + "\n")
+
+        # Read the response
+        try:
+            response_file = client.makefile('rb')
+            response_line = response_file.readline()
+            response_file.close()
+        except socket.timeout:
+            return True
+
+    finally:
+        client.close()
+
+    if len(response_line) == 0:
+        raise DispatcherException("The dispatcher closed the connection without a response")
+
+    response = json.loads(response_line)
+
+    if 'error' in response:
+        raise DispatcherException(response['error'])
+
+    return response.get('result', True)
+
+class DispatcherRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Handles a request from an alert process.
+    """
+
+    def handle(self):
+
+        try:
+            request = json.loads(self.rfile.readline())
+            self.server.queue_alert(request['payload'])
+            response = {'result' : True}
+
+        except Exception as e:
+            self.server.alert.logger.exception("Dispatcher was unable to queue the alert")
+            response = {'error' : str(e)}
+
+        self.wfile.write(json.dumps(response) + "\n")
+
+class Dispatcher(SocketServer.UnixStreamServer):
+    """
+    Runs the alerts that are handed off by the alert processes. The alerts are queued and run one at a time by a worker
+    thread so that the commands sent to the hub are not interleaved.
+    """
+
+    def __init__(self, socket_path, alert):
+        """
+        Set up the dispatcher.
+
+        Arguments:
+        socket_path -- The path of the UNIX socket to listen on
+        alert -- The ModularAlert instance that runs the alerts
+        """
+
+        self.socket_path = socket_path
+        self.alert = alert
+
+        # Make the directory that will contain the socket
+        try:
+            os.makedirs(os.path.dirname(socket_path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path, DispatcherRequestHandler)
+
+        # Start the thread that runs the alerts
+        self.queue = Queue.Queue()
+
+        self.worker = threading.Thread(target=self.run_queued_alerts, name="dispatcher_worker")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def server_bind(self):
+        """
+        Create the socket so that only the owner of the process can connect to it from the moment that it exists (the
+        umask would otherwise apply until the permissions are changed).
+        """
+
+        old_umask = os.umask(0177)
+
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(old_umask)
+
+    @classmethod
+    def is_running(cls, socket_path):
+        """
+        Determine if a dispatcher is already listening on the given socket. A socket file that is left over from a
+        dispatcher that is no longer running (nothing accepts connections on it) will be removed; the socket is assumed
+        to be in use if the connection fails for another reason (such as the dispatcher being too busy to accept it).
+
+        Arguments:
+        socket_path -- The path of the UNIX socket
+        """
+
+        if not os.path.exists(socket_path):
+            return False
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(5)
+
+        try:
+            client.connect(socket_path)
+            return True
+        except socket.error as e:
+            if e.errno == errno.ECONNREFUSED:
+                os.remove(socket_path)
+                return False
+            elif e.errno == errno.ENOENT:
+                return False
+            else:
+                return True
+        finally:
+            client.close()
+
+    def run_alert(self, payload):
+        """
+        Validate the payload and run the alert.
+
+        Arguments:
+        payload -- The payload of the alert (as received from Splunk)
+        """
+
+        return self.alert.run_payload(payload)
+
+    def queue_alert(self, payload):
+        """
+        Queue the alert to be run by the worker thread.
+
+        Arguments:
+        payload -- The payload of the alert (as received from Splunk)
+        """
+
+        self.queue.put(payload)
+
+    def run_queued_alerts(self):
+        """
+        Run the queued alerts one at a time until None is queued.
+        """
+
+        while True:
+            payload = self.queue.get()
+
+            if payload is None:
+                return
+
+            try:
+                self.run_alert(payload)
+            except Exception:
+                self.alert.logger.exception("Dispatcher was unable to run the alert")
+
+    def server_close(self):
+        """
+        Stop accepting alerts and wait for the ones that were already queued to run.
+        """
+
+        SocketServer.UnixStreamServer.server_close(self)
+
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+        self.queue.put(None)
+        self.worker.join()
+
+def run_dispatcher(socket_path, alert):
+    """
+    Run the dispatcher until it is stopped. Returns immediately if a dispatcher is already running.
+
+    Arguments:
+    socket_path -- The path of the UNIX socket to listen on
+    alert -- The ModularAlert instance that runs the alerts
+    """
+
+    if Dispatcher.is_running(socket_path):
+        alert.logger.debug("Dispatcher is already running, socket=%s", socket_path)
+        return False
+
+    dispatcher = Dispatcher(socket_path, alert)
+    alert.logger.info("Dispatcher started, socket=%s", socket_path)
+
+    try:
+        dispatcher.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.server_close()
+
+    return True
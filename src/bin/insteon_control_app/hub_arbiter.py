@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import errno
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # File locks aren't available on Windows; the arbiter does nothing there
+    fcntl = None
+
+class HubArbiterTimeoutException(Exception):
+    pass
+
+class HubArbiter(object):
+    """
+    Coordinates the processes that send commands to the same Insteon Hub (such as several alerts that fire at once).
+
+    The processes take turns by holding an exclusive lock on a file for the hub while they send a command and read the
+    response; this keeps the commands from being interleaved and keeps one process from reading the response meant for
+    another. The lock file also holds a token bucket that limits how quickly commands are sent to the hub across all of
+    the processes.
+
+    The lock is re-entrant within a thread so that a command can be sent while a group broadcast holds the lock.
+    """
+
+    # This is how quickly the tokens are replenished (sends per second) and how many can be accumulated
+    DEFAULT_RATE = 10.0
+    DEFAULT_BURST = 1
+
+    # This is how long to wait for the other processes to be done with the hub before giving up
+    DEFAULT_TIMEOUT = 60
+
+    # This is how frequently to check if the lock is available
+    LOCK_POLL_INTERVAL = 0.01
+
+    def __init__(self, lock_directory, address, port, rate=DEFAULT_RATE, burst=DEFAULT_BURST, timeout=DEFAULT_TIMEOUT):
+        """
+        Set up the arbiter.
+
+        Arguments:
+        lock_directory -- The directory to store the lock files in
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        rate -- The maximum number of commands that can be sent to the hub per second (across all processes)
+        burst -- The number of commands that can be sent at once after the hub has been idle
+        timeout -- How long to wait for the lock (in seconds)
+        """
+
+        self.lock_directory = lock_directory
+        self.lock_file = os.path.join(lock_directory, "hub_%s_%s.lock" % (re.sub("[^a-zA-Z0-9.-]", "_", str(address)), port))
+
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+
+        # The lock is tracked per thread so that it can be acquired again by the thread that holds it
+        self.local = threading.local()
+
+    def is_held(self):
+        """
+        Indicates if the current thread holds the lock.
+        """
+
+        return getattr(self.local, 'depth', 0) > 0
+
+    def lock(self):
+        """
+        Wait until the lock is available and take it. Raises a HubArbiterTimeoutException if the lock could not be
+        obtained in time.
+        """
+
+        if self.is_held():
+            self.local.depth = self.local.depth + 1
+            return
+
+        try:
+            os.makedirs(self.lock_directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0600)
+
+        if fcntl is not None:
+            give_up_time = time.time() + self.timeout
+
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except IOError as e:
+                    if e.errno not in [errno.EAGAIN, errno.EACCES]:
+                        os.close(fd)
+                        raise
+
+                if time.time() >= give_up_time:
+                    os.close(fd)
+                    raise HubArbiterTimeoutException("Timed out waiting for the other processes to finish with the hub")
+
+                time.sleep(self.LOCK_POLL_INTERVAL)
+
+        self.local.fd = fd
+        self.local.depth = 1
+
+    def unlock(self):
+        """
+        Release the lock (once it has been released as many times as it was taken).
+        """
+
+        if not self.is_held():
+            return
+
+        self.local.depth = self.local.depth - 1
+
+        if self.local.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self.local.fd, fcntl.LOCK_UN)
+
+            os.close(self.local.fd)
+            self.local.fd = None
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlock()
+
+    def read_state(self):
+        """
+        Read the state of the token bucket from the lock file. Returns a tuple of the number of tokens and when they were
+        counted.
+        """
+
+        try:
+            os.lseek(self.local.fd, 0, os.SEEK_SET)
+            state = json.loads(os.read(self.local.fd, 1024))
+
+            return float(state['tokens']), float(state['updated'])
+        except (ValueError, KeyError, TypeError, OSError):
+            return float(self.burst), 0
+
+    def write_state(self, tokens, updated):
+        """
+        Write the state of the token bucket to the lock file.
+
+        Arguments:
+        tokens -- The number of tokens available
+        updated -- When the tokens were counted
+        """
+
+        os.lseek(self.local.fd, 0, os.SEEK_SET)
+        os.ftruncate(self.local.fd, 0)
+        os.write(self.local.fd, json.dumps({'tokens' : tokens, 'updated' : updated}))
+
+    def take_token(self):
+        """
+        Wait until a command can be sent to the hub and use up a token. The lock must be held. Returns how long it waited
+        (in seconds).
+        """
+
+        if not self.is_held():
+            raise ValueError("The lock must be held in order to take a token")
+
+        if self.rate is None or self.rate <= 0:
+            return 0
+
+        tokens, updated = self.read_state()
+        now = time.time()
+
+        # Replenish the tokens for the time that has passed
+        tokens = min(float(self.burst), tokens + (max(now - updated, 0) * self.rate))
+
+        # Wait for a token if there aren't any left
+        waited = 0
+
+        if tokens < 1:
+            waited = (1 - tokens) / self.rate
+            time.sleep(waited)
+
+            tokens = 1
+            now = time.time()
+
+        self.write_state(tokens - 1, now)
+
+        return waited
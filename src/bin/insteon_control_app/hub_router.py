@@ -0,0 +1,117 @@
+import threading
+import traceback
+import Queue
+from collections import OrderedDict
+
+class HubFailure(object):
+    """
+    Describes why the commands to a hub failed.
+    """
+
+    def __init__(self, exception, traceback_text):
+        """
+        Describe the failure.
+
+        Arguments:
+        exception -- The exception that the function raised for the hub
+        traceback_text -- The traceback of the exception (captured in the thread that ran the hub)
+        """
+
+        self.exception = exception
+        self.traceback = traceback_text
+
+    def __str__(self):
+        return str(self.exception)
+
+class HubRouter(object):
+    """
+    Runs the commands for several Insteon Hubs at the same time.
+
+    Each hub is on its own powerline segment so the hubs can be given commands concurrently. However, the commands to a
+    single hub must still be sent one at a time; thus, each hub's commands are run serially within one worker thread.
+    """
+
+    # This is the maximum number of hubs that will be given commands at the same time
+    DEFAULT_MAX_WORKERS = 4
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Set up the router.
+
+        Arguments:
+        max_workers -- The maximum number of hubs that will be given commands at the same time
+        """
+
+        self.max_workers = max_workers
+
+    @staticmethod
+    def group_by_hub(devices, get_hub):
+        """
+        Group the devices by the hub that they are connected to. Returns an ordered dictionary of the devices keyed by
+        the hub (in the order that the hubs were first seen).
+
+        Arguments:
+        devices -- The list of devices
+        get_hub -- A function that returns the hub for a given device
+        """
+
+        routes = OrderedDict()
+
+        for device in devices:
+            routes.setdefault(get_hub(device), []).append(device)
+
+        return routes
+
+    def run(self, routes, function):
+        """
+        Call the function for each hub and return a list of the hubs, the values returned by the function and the
+        failures (in the same order as the routes). The hubs are isolated from each other: if the function raises an
+        exception for a hub then the value for that hub is None and the failure is a HubFailure describing it (the
+        failure is None for the hubs that succeeded).
+
+        Arguments:
+        routes -- An ordered dictionary of the devices keyed by the hub (see group_by_hub())
+        function -- A function that accepts the hub and the list of devices and sends the commands to them
+        """
+
+        items = routes.items()
+        results = [None] * len(items)
+        failures = [None] * len(items)
+
+        def run_hub(i):
+            try:
+                results[i] = function(items[i][0], items[i][1])
+            except Exception as e:
+                failures[i] = HubFailure(e, traceback.format_exc())
+
+        # Don't bother with threads if there is only one hub
+        if len(items) <= 1 or self.max_workers <= 1:
+            for i in range(0, len(items)):
+                run_hub(i)
+
+            return [(items[i][0], results[i], failures[i]) for i in range(0, len(items))]
+
+        pending = Queue.Queue()
+
+        for i in range(0, len(items)):
+            pending.put(i)
+
+        def worker():
+
+            while True:
+                try:
+                    i = pending.get_nowait()
+                except Queue.Empty:
+                    return
+
+                run_hub(i)
+
+        threads = [threading.Thread(target=worker) for i in range(0, min(self.max_workers, len(items)))]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return [(items[i][0], results[i], failures[i]) for i in range(0, len(items))]
@@ -0,0 +1,213 @@
+import base64
+import httplib2
+import threading
+import time
+from contextlib import contextmanager
+
+from pacing import HubPacer
+from transports import TRANSPORTS, HTTPTransport
+
+class HubSession(object):
+    """
+    Represents a persistent connection to the web interface of an Insteon Hub.
+
+    Sessions keep the HTTP connection to the hub alive between calls and send the Basic authentication header with the
+    first request (instead of waiting for the hub to challenge with a 401). Use get_session() to obtain a session so
+    that all of the calls to the same hub share a connection.
+    """
+
+    # This is how long to wait for the hub to respond before giving up
+    DEFAULT_TIMEOUT = 5
+
+    # The sessions that have been created, keyed by the address, port and credentials
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def __init__(self, address, port, username, password, timeout=DEFAULT_TIMEOUT):
+        """
+        Set up the session.
+
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        timeout -- How long to wait for a response (in seconds)
+        """
+
+        self.address = address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+        # Make the HTTP object; this will keep the connection open across requests
+        self.http = httplib2.Http(timeout=timeout, disable_ssl_certificate_validation=True)
+
+        # Add in the credentials in case the hub challenges us anyways
+        self.http.add_credentials(username, password)
+
+        # Make the headers with the credentials so that the hub doesn't need to challenge us
+        self.headers = {
+                        'Authorization' : 'Basic ' + base64.b64encode('%s:%s' % (username, password)),
+                        'Connection' : 'keep-alive'
+                        }
+
+        # Keep a count of the requests for diagnostic purposes
+        self.request_count = 0
+
+        # This will keep the calls to the hub spaced out so that the hub isn't overwhelmed
+        self.pacer = HubPacer()
+
+        # This is how the messages will be sent to the hub's PLM (the web interface is used by default)
+        self.transport = HTTPTransport(self)
+
+        # This coordinates the calls to the hub with other processes (see HubArbiter); the calls aren't coordinated if None
+        self.arbiter = None
+
+        # This determines how many hops the messages to each device use (see LinkQualityTable); the full number of hops
+        # is always used if None
+        self.link_quality = None
+
+    @classmethod
+    def get_session(cls, address, port, username, password):
+        """
+        Get a session for the given hub, creating it if necessary.
+
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        """
+
+        key = (address, str(port), username, password)
+
+        with cls.sessions_lock:
+            session = cls.sessions.get(key, None)
+
+            if session is None:
+                session = cls(address, port, username, password)
+                cls.sessions[key] = session
+
+        return session
+
+    @classmethod
+    def close_all(cls):
+        """
+        Close all of the sessions that have been created.
+        """
+
+        with cls.sessions_lock:
+            for session in cls.sessions.values():
+                session.close()
+
+            cls.sessions.clear()
+
+    def get_url(self, path):
+        """
+        Get the URL for the given path on the hub.
+
+        Arguments:
+        path -- The path of the resource (e.g. "/buffstatus.xml")
+        """
+
+        return "http://%s:%s%s" % (self.address, self.port, path)
+
+    def connect(self):
+        """
+        Open the connection to the hub unless it is already open. Returns how long it took to connect (in seconds; 0 if
+        the existing connection was re-used).
+        """
+
+        authority = "%s:%s" % (self.address, self.port)
+        connection_key = "http:" + authority
+
+        connection = self.http.connections.get(connection_key, None)
+
+        if connection is not None and getattr(connection, 'sock', None) is not None:
+            return 0
+
+        start_time = time.time()
+
+        if connection is None:
+            connection = httplib2.HTTPConnectionWithTimeout(authority, timeout=self.timeout)
+            self.http.connections[connection_key] = connection
+
+        connection.connect()
+
+        return time.time() - start_time
+
+    def request(self, path, method='GET'):
+        """
+        Perform a request against the hub and return the response and the content.
+
+        Arguments:
+        path -- The path of the resource (e.g. "/buffstatus.xml")
+        method -- The HTTP method to use
+        """
+
+        self.request_count = self.request_count + 1
+
+        return self.http.request(self.get_url(path), method, headers=self.headers)
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Keep other processes from using the hub until the block is done (such as while waiting for a response).
+        """
+
+        if self.arbiter is None:
+            yield self
+        else:
+            with self.arbiter:
+                yield self
+
+    def wait_to_send(self):
+        """
+        Wait until a message can be sent to the hub. Returns how long it waited (in seconds).
+        """
+
+        waited = self.pacer.wait()
+
+        if self.arbiter is not None and self.arbiter.is_held():
+            waited = waited + self.arbiter.take_token()
+
+        return waited
+
+    def set_transport(self, name, port=None):
+        """
+        Change how the messages are sent to the hub's PLM. The existing transport is kept if it is already of the given
+        type and port.
+
+        Arguments:
+        name -- The name of the transport (e.g. "http" or "plm")
+        port -- The port to connect to for transports that don't use the web interface (uses the default if None)
+        """
+
+        transport_class = TRANSPORTS[name]
+
+        if port is None:
+            port = getattr(transport_class, 'DEFAULT_PORT', None)
+
+        if self.transport.name == name and getattr(self.transport, 'port', None) == port:
+            return
+
+        self.transport.close()
+
+        if port is None:
+            self.transport = transport_class(self)
+        else:
+            self.transport = transport_class(self, port)
+
+    def close(self):
+        """
+        Close the connections held by the session.
+        """
+
+        self.transport.close()
+
+        for connection in self.http.connections.values():
+            connection.close()
+
+        self.http.connections.clear()
@@ -0,0 +1,413 @@
+"""
+This module decodes the messages that the Insteon PowerLinc Modem (PLM) within the Insteon Hub writes to its buffer.
+
+The buffer is a hexadecimal string containing a series of messages. Each message starts with 0x02, followed by a byte
+indicating the message type. The message type determines the length of the message and the fields within it. See the
+INSTEON Modem Developer's Guide for the details of each message type.
+"""
+
+class MessageType(object):
+    """
+    Describes a type of message that the PLM produces.
+    """
+
+    __slots__ = ('code', 'name', 'length', 'fields', 'extended_length', 'extended_fields')
+
+    def __init__(self, code, name, length, fields, extended_length=None, extended_fields=None):
+        """
+        Describe the message type.
+
+        Arguments:
+        code -- The hex string of the byte that identifies the message type (e.g. "50")
+        name -- The name of the message type
+        length -- The length of the message in bytes (including the 0x02 prefix and the message type)
+        fields -- A tuple of (name, start byte, end byte) for each field in the message
+        extended_length -- The length of the message if it is an extended message (only applies to messages that have flags)
+        extended_fields -- The fields of the message if it is an extended message
+        """
+
+        self.code = code
+        self.name = name
+        self.length = length
+        self.fields = fields
+        self.extended_length = extended_length
+        self.extended_fields = extended_fields
+
+STANDARD_RECEIVED_FIELDS = (('from_address', 2, 5), ('to_address', 5, 8), ('flags', 8, 9), ('cmd1', 9, 10), ('cmd2', 10, 11))
+EXTENDED_RECEIVED_FIELDS = STANDARD_RECEIVED_FIELDS + (('data', 11, 25),)
+
+SEND_STANDARD_FIELDS = (('to_address', 2, 5), ('flags', 5, 6), ('cmd1', 6, 7), ('cmd2', 7, 8), ('ack', 8, 9))
+SEND_EXTENDED_FIELDS = (('to_address', 2, 5), ('flags', 5, 6), ('cmd1', 6, 7), ('cmd2', 7, 8), ('data', 8, 22), ('ack', 22, 23))
+
+# This is the table of the message types, keyed by the code that identifies the type
+MESSAGE_TYPES = dict((message_type.code, message_type) for message_type in [
+
+    # Messages from the PLM
+    MessageType('50', 'standard_received', 11, STANDARD_RECEIVED_FIELDS),
+    MessageType('51', 'extended_received', 25, EXTENDED_RECEIVED_FIELDS),
+    MessageType('52', 'x10_received', 4, (('data', 2, 4),)),
+    MessageType('53', 'all_linking_completed', 10, (('cmd1', 2, 3), ('group', 3, 4), ('from_address', 4, 7), ('data', 7, 10))),
+    MessageType('54', 'button_event_report', 3, (('data', 2, 3),)),
+    MessageType('55', 'user_reset_detected', 2, ()),
+    MessageType('56', 'all_link_cleanup_failure', 7, (('data', 2, 3), ('group', 3, 4), ('from_address', 4, 7))),
+    MessageType('57', 'all_link_record', 10, (('flags', 2, 3), ('group', 3, 4), ('from_address', 4, 7), ('data', 7, 10))),
+    MessageType('58', 'all_link_cleanup_status', 3, (('ack', 2, 3),)),
+
+    # Commands sent to the PLM (which are echoed back along with an ACK or NAK)
+    MessageType('60', 'get_im_info', 9, (('from_address', 2, 5), ('data', 5, 8), ('ack', 8, 9))),
+    MessageType('61', 'send_all_link', 6, (('group', 2, 3), ('cmd1', 3, 4), ('cmd2', 4, 5), ('ack', 5, 6))),
+    MessageType('62', 'send_message', 9, SEND_STANDARD_FIELDS, 23, SEND_EXTENDED_FIELDS),
+    MessageType('63', 'send_x10', 5, (('data', 2, 4), ('ack', 4, 5))),
+    MessageType('64', 'start_all_linking', 5, (('data', 2, 3), ('group', 3, 4), ('ack', 4, 5))),
+    MessageType('65', 'cancel_all_linking', 3, (('ack', 2, 3),)),
+    MessageType('66', 'set_host_device_category', 6, (('data', 2, 5), ('ack', 5, 6))),
+    MessageType('67', 'reset_im', 3, (('ack', 2, 3),)),
+    MessageType('68', 'set_ack_message_byte', 4, (('data', 2, 3), ('ack', 3, 4))),
+    MessageType('69', 'get_first_all_link_record', 3, (('ack', 2, 3),)),
+    MessageType('6A', 'get_next_all_link_record', 3, (('ack', 2, 3),)),
+    MessageType('6B', 'set_im_configuration', 4, (('flags', 2, 3), ('ack', 3, 4))),
+    MessageType('6C', 'get_all_link_record_for_sender', 3, (('ack', 2, 3),)),
+    MessageType('6D', 'led_on', 3, (('ack', 2, 3),)),
+    MessageType('6E', 'led_off', 3, (('ack', 2, 3),)),
+    MessageType('6F', 'manage_all_link_record', 12, (('cmd1', 2, 3), ('flags', 3, 4), ('group', 4, 5), ('from_address', 5, 8), ('data', 8, 11), ('ack', 11, 12))),
+    MessageType('70', 'set_nak_message_byte', 4, (('data', 2, 3), ('ack', 3, 4))),
+    MessageType('71', 'set_ack_message_two_bytes', 5, (('data', 2, 4), ('ack', 4, 5))),
+    MessageType('72', 'rf_sleep', 3, (('ack', 2, 3),)),
+    MessageType('73', 'get_im_configuration', 6, (('flags', 2, 3), ('data', 3, 5), ('ack', 5, 6)))
+])
+
+# This is the code of the message that the PLM sends when it is too busy to accept a command
+PLM_NAK = '15'
+PLM_ACK = '06'
+
+# These are the message types (the top three bits of the flags) of messages sent between devices
+MESSAGE_TYPE_DIRECT = 0
+MESSAGE_TYPE_DIRECT_ACK = 1
+MESSAGE_TYPE_ALL_LINK_CLEANUP = 2
+MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK = 3
+MESSAGE_TYPE_BROADCAST = 4
+MESSAGE_TYPE_DIRECT_NAK = 5
+MESSAGE_TYPE_ALL_LINK_BROADCAST = 6
+MESSAGE_TYPE_ALL_LINK_CLEANUP_NAK = 7
+
+class InsteonMessage(object):
+    """
+    Represents a single decoded message from the PLM. The fields that don't apply to the message type are None.
+    """
+
+    __slots__ = ('code', 'name', 'raw', 'from_address', 'to_address', 'flags', 'cmd1', 'cmd2', 'data', 'group', 'ack')
+
+    def __init__(self, code, name, raw, **fields):
+        self.code = code
+        self.name = name
+        self.raw = raw
+
+        for field in InsteonMessage.__slots__[3:]:
+            setattr(self, field, fields.get(field, None))
+
+    def __repr__(self):
+        return "InsteonMessage(%s, %s)" % (self.name, self.raw)
+
+    def get_flags_value(self):
+        """
+        Get the flags as an integer (or None if the message has no flags).
+        """
+
+        if self.flags is None:
+            return None
+
+        return int(self.flags, 16)
+
+    @property
+    def message_type(self):
+        """
+        The type of the message between the devices (see the MESSAGE_TYPE_* constants).
+        """
+
+        if self.flags is None:
+            return None
+
+        return self.get_flags_value() >> 5
+
+    @property
+    def extended(self):
+        if self.flags is None:
+            return False
+
+        return (self.get_flags_value() & 0x10) != 0
+
+    @property
+    def hops_left(self):
+        if self.flags is None:
+            return None
+
+        return (self.get_flags_value() >> 2) & 0x03
+
+    @property
+    def max_hops(self):
+        if self.flags is None:
+            return None
+
+        return self.get_flags_value() & 0x03
+
+    @property
+    def is_direct_ack(self):
+        return self.message_type == MESSAGE_TYPE_DIRECT_ACK
+
+    @property
+    def is_direct_nak(self):
+        return self.message_type == MESSAGE_TYPE_DIRECT_NAK
+
+    @property
+    def checksum_ok(self):
+        """
+        Indicates if the checksum in the last byte of the user data of an extended message is valid (None if the
+        message isn't an extended message). Note that only devices using the newer (i2cs) engine set the checksum.
+        """
+
+        if self.data is None or len(self.data) != 28 or self.cmd1 is None or self.cmd2 is None:
+            return None
+
+        return compute_checksum(self.cmd1, self.cmd2, self.data[:26]) == int(self.data[26:], 16)
+
+    @property
+    def is_plm_nak(self):
+        """
+        Indicates if the PLM refused the message (usually because it was busy).
+        """
+
+        return self.ack == PLM_NAK or self.code == PLM_NAK
+
+def compute_checksum(cmd1, cmd2, data):
+    """
+    Compute the checksum of an extended message (which goes in the last byte of the user data): the two's complement of
+    the sum of cmd1, cmd2 and the first 13 bytes of the user data.
+
+    Arguments:
+    cmd1 -- The hex string of the first command portion of the command
+    cmd2 -- The hex string of the second command portion of the command
+    data -- The hex string of the first 13 bytes of the user data
+    """
+
+    total = int(cmd1, 16) + int(cmd2, 16)
+
+    for position in range(0, len(data), 2):
+        total = total + int(data[position:position + 2], 16)
+
+    return (-total) & 0xFF
+
+def add_checksum(cmd1, cmd2, data):
+    """
+    Get the user data of an extended message with the checksum in the last byte (see compute_checksum()).
+
+    Arguments:
+    cmd1 -- The hex string of the first command portion of the command
+    cmd2 -- The hex string of the second command portion of the command
+    data -- The hex string of the 14 bytes of user data
+    """
+
+    return data[:26] + "%02X" % compute_checksum(cmd1, cmd2, data[:26])
+
+def decode_message(buffer_hex, position=0):
+    """
+    Decode the message at the given position of the buffer. Returns the message and the position after the message or
+    (None, position) if no message starts at the position. Returns (None, None) if the message is truncated.
+
+    Arguments:
+    buffer_hex -- The buffer as a hexadecimal string
+    position -- The position (in characters) within the string to start decoding from
+    """
+
+    # Handle the NAK that the PLM sends on its own when it is busy
+    if buffer_hex[position:position + 2] == PLM_NAK:
+        return InsteonMessage(PLM_NAK, 'plm_nak', PLM_NAK), position + 2
+
+    # Make sure a message starts here
+    if buffer_hex[position:position + 2] != '02':
+        return None, position
+
+    code = buffer_hex[position + 2:position + 4]
+    message_type = MESSAGE_TYPES.get(code, None)
+
+    if message_type is None:
+        return None, position
+
+    length = message_type.length
+    fields = message_type.fields
+
+    # Determine if this is an extended message
+    if message_type.extended_length is not None:
+        flags = buffer_hex[position + 10:position + 12]
+
+        if len(flags) == 2 and (int(flags, 16) & 0x10) != 0:
+            length = message_type.extended_length
+            fields = message_type.extended_fields
+
+    # Stop if the message was cut off
+    if len(buffer_hex) < position + (length * 2):
+        return None, None
+
+    raw = buffer_hex[position:position + (length * 2)]
+
+    values = {}
+
+    for name, start, end in fields:
+        values[name] = raw[start * 2:end * 2]
+
+    return InsteonMessage(code, message_type.name, raw, **values), position + (length * 2)
+
+def decode_buffer(buffer_hex):
+    """
+    Decode all of the messages within the buffer and return them as a list of InsteonMessage instances.
+
+    Arguments:
+    buffer_hex -- The buffer as a hexadecimal string
+    """
+
+    messages = []
+
+    if buffer_hex is None:
+        return messages
+
+    buffer_hex = buffer_hex.strip().upper()
+    position = 0
+
+    while position < len(buffer_hex):
+
+        message, next_position = decode_message(buffer_hex, position)
+
+        # Stop if the remaining message was cut off
+        if next_position is None:
+            break
+
+        # Skip bytes that aren't part of a message (such as the empty portion of the buffer)
+        if message is None:
+            position = position + 2
+        else:
+            messages.append(message)
+            position = next_position
+
+    return messages
+
+def split_hub_buffer(buffer_hex):
+    """
+    Split the buffer that the Insteon Hub presents (in buffstatus.xml) into the data and the position that the next
+    data will be written to (in characters). The hub writes into the buffer as a ring so the newest data is right before
+    the position and the oldest data is right after it. The last byte of the buffer is the position (in bytes).
+
+    Arguments:
+    buffer_hex -- The buffer as a hexadecimal string
+    """
+
+    buffer_hex = buffer_hex.strip().upper()
+
+    data = buffer_hex[:-2]
+
+    try:
+        pointer = int(buffer_hex[-2:], 16) * 2
+    except ValueError:
+        pointer = 0
+
+    return data, min(pointer, len(data))
+
+def unroll_hub_buffer(buffer_hex):
+    """
+    Get the data from the buffer of the Insteon Hub in the order that it was written (oldest first).
+
+    Arguments:
+    buffer_hex -- The buffer as a hexadecimal string
+    """
+
+    data, pointer = split_hub_buffer(buffer_hex)
+
+    return data[pointer:] + data[:pointer]
+
+def find_reply(messages, device, cmd1=None):
+    """
+    Find the message that was sent to the given device and the reply to it from the device. Returns a tuple of the
+    message that was sent and the reply; the reply will be None if the device didn't reply yet and both will be None
+    if the message that was sent could not be found.
+
+    Arguments:
+    messages -- A list of InsteonMessage instances (from decode_buffer())
+    device -- The address of the device that the message was sent to
+    cmd1 -- The hex string of the first command portion of the command that was sent (matches any command if None)
+    """
+
+    sent = None
+    reply = None
+
+    for message in messages:
+
+        # Find the last time the command was sent to the device
+        if message.code == '62' and message.to_address == device and (cmd1 is None or message.cmd1 == cmd1):
+            sent = message
+            reply = None
+
+        # Find the first reply from the device after the command was sent
+        elif sent is not None and reply is None and message.code in ['50', '51'] and message.from_address == device \
+            and (message.is_direct_ack or message.is_direct_nak):
+            reply = message
+
+    return sent, reply
+
+def find_product_info(messages, device):
+    """
+    Find the broadcast that the device sends with its product information in response to a product request (cmd1 10).
+    Returns None if the device hasn't sent it yet.
+
+    Arguments:
+    messages -- A list of InsteonMessage instances (from decode_buffer())
+    device -- The address of the device that the request was sent to
+    """
+
+    sent = None
+    broadcast = None
+
+    for message in messages:
+
+        # Find the last time the request was sent to the device
+        if message.code == '62' and message.to_address == device and message.cmd1 == '10':
+            sent = message
+            broadcast = None
+
+        # The product information is sent as a "set button pressed" broadcast
+        elif sent is not None and message.code == '50' and message.from_address == device \
+            and message.message_type == MESSAGE_TYPE_BROADCAST and message.cmd1 in ['01', '02']:
+            broadcast = message
+
+    return broadcast
+
+def find_all_link_acks(messages, group, cmd1):
+    """
+    Find the devices that acknowledged the clean-up messages of an all-link (group) broadcast. Returns a tuple of the
+    broadcast that was sent, the set of the addresses of the devices that acknowledged it and the clean-up status report
+    from the PLM (which will be None if the PLM hasn't finished the clean-up yet).
+
+    Arguments:
+    messages -- A list of InsteonMessage instances (from decode_buffer())
+    group -- The hex string of the group that the broadcast was sent to
+    cmd1 -- The hex string of the first command portion of the command that was sent
+    """
+
+    sent = None
+    acked = set()
+    status = None
+
+    for message in messages:
+
+        # Find the last time the broadcast was sent
+        if message.code == '61' and message.group == group and message.cmd1 == cmd1:
+            sent = message
+            acked = set()
+            status = None
+
+        elif sent is not None and message.code == '50' and message.cmd1 == cmd1 \
+            and message.message_type in [MESSAGE_TYPE_DIRECT_ACK, MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK]:
+            acked.add(message.from_address)
+
+        elif sent is not None and message.code == '58':
+            status = message
+
+    return sent, acked, status
+
@@ -0,0 +1,115 @@
+import threading
+
+from persistent_cache import PersistentCache
+
+class LinkQualityTable(object):
+    """
+    Keeps track of how many hops the replies from each device take to reach the hub so that the messages sent to the
+    device can use the smallest maximum number of hops that reliably reaches it. Every device that hears a message
+    repeats it until its hops run out, so sending messages to a nearby device with the full number of hops causes
+    needless traffic on the powerline (and delays the reply).
+
+    The hops of the recent replies from each device are kept. Once enough replies have been seen, the messages to the
+    device use one more hop than the most that any of those replies took so that a path that occasionally needs another
+    repeater doesn't cause the message to be lost (and re-sent). The device goes back to the full number of hops as soon
+    as a message to it goes unanswered.
+    """
+
+    # This is the most hops that a message can take (and what is used for the devices that aren't known)
+    MAX_HOPS = 3
+
+    # This is how many of the recent replies are kept for each device and how many are needed before fewer hops are used
+    MAX_OBSERVATIONS = 10
+    MIN_OBSERVATIONS = 3
+
+    # This is how many hops are added to the most that the replies took
+    HOPS_MARGIN = 1
+
+    # This is how long the hops of a device are kept (in seconds) since a device can move or the powerline can change
+    TTL = 86400
+
+    def __init__(self, cache_file):
+        """
+        Set up the table.
+
+        Arguments:
+        cache_file -- The path of the file to store the hops in
+        """
+
+        self.cache = PersistentCache(cache_file)
+
+        # The table is shared by the threads sending to each hub
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_flags(max_hops, extended=False):
+        """
+        Get the flags (as a hex string) of a direct message with the given maximum number of hops.
+
+        Arguments:
+        max_hops -- The maximum number of hops (0-3)
+        extended -- Whether the message is an extended message
+        """
+
+        flags = (max_hops << 2) | max_hops
+
+        if extended:
+            flags = flags | 0x10
+
+        return "%02X" % flags
+
+    def get_observations(self, device):
+        """
+        Get the hops that the recent replies from the device took.
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        with self.lock:
+            return self.cache.get(device.upper(), [])
+
+    def get_max_hops(self, device):
+        """
+        Get the maximum number of hops to use for the messages sent to the device.
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        observations = self.get_observations(device)
+
+        if len(observations) < LinkQualityTable.MIN_OBSERVATIONS:
+            return LinkQualityTable.MAX_HOPS
+
+        return min(max(observations) + LinkQualityTable.HOPS_MARGIN, LinkQualityTable.MAX_HOPS)
+
+    def record_reply(self, device, reply):
+        """
+        Record how many hops the reply from the device took.
+
+        Arguments:
+        device -- The address of the device
+        reply -- The reply from the device (an InsteonMessage)
+        """
+
+        if reply.max_hops is None or reply.hops_left is None:
+            return
+
+        with self.lock:
+            observations = self.get_observations(device) + [max(reply.max_hops - reply.hops_left, 0)]
+
+            self.cache.set(device.upper(), observations[-LinkQualityTable.MAX_OBSERVATIONS:], LinkQualityTable.TTL)
+
+    def record_failure(self, device):
+        """
+        Note that a message to the device went unanswered; the full number of hops will be used until enough replies
+        from the device are seen again.
+
+        Arguments:
+        device -- The address of the device
+        """
+
+        with self.lock:
+            if len(self.get_observations(device)) > 0:
+                self.cache.delete(device.upper())
@@ -5,10 +5,14 @@ import sys
 import re
 import os
 import json
+import gzip
+import csv
 import socket # Used for IP Address validation
 
 from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
 
+from insteon_control_app.dispatcher import forward_to_dispatcher, DispatcherUnavailableException
+
 class FieldValidationException(Exception):
     pass
 
@@ -340,7 +344,14 @@ class IPAddressField(Field):
 
 class ModularAlert():
     
-    def __init__(self, parameters=None, logger_name='python_modular_alert', log_level=logging.INFO, log_to_file=False):
+    # These parameters turn on the batch mode in which the alert is run once for each row of the results (see run_batch())
+    BATCH_FIELDS_PARAM = 'batch_fields'
+    MAX_BATCH_ROWS_PARAM = 'max_batch_rows'
+    
+    # This is how many rows of the results are run by default in the batch mode
+    DEFAULT_MAX_BATCH_ROWS = 500
+    
+    def __init__(self, parameters=None, logger_name='python_modular_alert', log_level=logging.INFO, log_to_file=False, dispatcher_socket=None):
         """
         Set up the modular alert.
             
@@ -349,6 +360,7 @@ class ModularAlert():
         logger_name -- The logger name to append to the logger
         log_level -- The log level of the logger
         log_to_file -- Indicates whether the log messages should be sent to a log file or just outputted to Splunk via standard output
+        dispatcher_socket -- The path of the socket of a dispatcher that the alert should be handed off to (if it is running)
         """
          
         if parameters is None:
@@ -365,6 +377,7 @@ class ModularAlert():
         self.logger_name = logger_name
         self.log_level = log_level
         self.log_to_file = log_to_file
+        self.dispatcher_socket = dispatcher_socket
         self._logger = None
     
     @classmethod
@@ -490,6 +503,161 @@ class ModularAlert():
             
         return cleaned_params
     
+    def get_batch_settings(self, configuration):
+        """
+        Get the settings of the batch mode from the configuration. Returns the configuration without the settings of the
+        batch mode, the list of the parameters that are obtained from each row of the results (None if the batch mode
+        isn't being used) and the maximum number of rows to run.
+        
+        Arguments:
+        configuration -- The configuration from the payload
+        """
+        
+        configuration = dict(configuration)
+        
+        batch_fields = configuration.pop(ModularAlert.BATCH_FIELDS_PARAM, None)
+        max_rows = IntegerField(ModularAlert.MAX_BATCH_ROWS_PARAM, none_allowed=True).to_python(configuration.pop(ModularAlert.MAX_BATCH_ROWS_PARAM, None) or None)
+        
+        if max_rows is None:
+            max_rows = ModularAlert.DEFAULT_MAX_BATCH_ROWS
+        elif max_rows < 1:
+            raise FieldValidationException("The maximum number of rows of a batch must be at least 1")
+        
+        if batch_fields is None or len(batch_fields.strip()) == 0:
+            return configuration, None, max_rows
+        
+        batch_fields = [field.strip() for field in ListField(ModularAlert.BATCH_FIELDS_PARAM).to_python(batch_fields) if len(field.strip()) > 0]
+        parameter_names = [parameter.name for parameter in self.parameters]
+        
+        for field in batch_fields:
+            if field not in parameter_names:
+                raise FieldValidationException("The batch field '%s' is not a parameter of the alert" % (field))
+        
+        return configuration, batch_fields, max_rows
+    
+    @staticmethod
+    def read_results(results_file):
+        """
+        Get the rows of the results file that Splunk provides in the payload (a gzipped CSV file) as dictionaries.
+        
+        Arguments:
+        results_file -- The path of the results file
+        """
+        
+        with gzip.open(results_file, 'rb') as fp:
+            for row in csv.DictReader(fp):
+                yield row
+    
+    def run_batch(self, configuration, payload, batch_fields, max_rows=DEFAULT_MAX_BATCH_ROWS):
+        """
+        Run the alert once for each row of the results (up to the given number of rows) in this process. The batch
+        fields of each row replace the corresponding parameters of the configuration. This allows an alert that is
+        triggered once to act on every result without starting a process per result (which would otherwise need to
+        load the libraries and lookups and connect to the hub each time).
+        
+        The rows that are invalid or fail are logged and skipped. The valid rows are run by run_rows() once all of them
+        have been read so that sub-classes can act on the batch as a whole. Returns the sum of what run() returned for
+        the rows.
+        
+        Arguments:
+        configuration -- The configuration without the settings of the batch mode
+        payload -- The data from Splunk
+        batch_fields -- The list of the parameters that are obtained from each row of the results
+        max_rows -- The maximum number of rows to run
+        """
+        
+        results_file = payload.get('results_file', None)
+        
+        if results_file is None:
+            raise FieldValidationException("The payload doesn't include the results file that the batch mode needs")
+        
+        rows = 0
+        valid_rows = []
+        
+        for row in self.read_results(results_file):
+            
+            if rows >= max_rows:
+                self.logger.warn("Only the first %i results were run since the batch is limited to that many rows", max_rows)
+                break
+            
+            rows = rows + 1
+            
+            # Get the parameters from the row (the ones missing from the row are taken from the configuration)
+            arguments = dict(configuration)
+            
+            for field in batch_fields:
+                if row.get(field, None) not in [None, '']:
+                    arguments[field] = row[field]
+            
+            row_payload = dict(payload)
+            row_payload['configuration'] = arguments
+            row_payload['result'] = row
+            
+            try:
+                valid_rows.append((rows, self.validate(arguments), row_payload))
+            except FieldValidationException as e:
+                self.logger.warn("Result %i was skipped since it is invalid: %s", rows, str(e))
+        
+        total = self.run_rows(valid_rows)
+        
+        self.logger.info("Ran the alert for %i results", rows)
+        
+        return total
+    
+    def run_rows(self, rows):
+        """
+        Run the rows of a batch (see run_batch()). Returns the sum of what run() returned for the rows.
+        
+        Arguments:
+        rows -- A list of the rows as tuples of the number of the row, the cleaned parameters and the payload of the row
+        """
+        
+        total = 0
+        
+        for row_number, cleaned_params, row_payload in rows:
+            total = total + self.run_row(row_number, cleaned_params, row_payload)
+        
+        return total
+    
+    def run_row(self, row_number, cleaned_params, row_payload):
+        """
+        Run a row of a batch, logging the failure of the row instead of letting it stop the batch. Returns what run()
+        returned (or 0 if the row failed).
+        
+        Arguments:
+        row_number -- The number of the row in the results (starting at 1)
+        cleaned_params -- The arguments of the row following validation
+        row_payload -- The payload of the row
+        """
+        
+        try:
+            return self.run(cleaned_params, row_payload) or 0
+        except FieldValidationException as e:
+            self.logger.warn("Result %i was skipped since it is invalid: %s", row_number, str(e))
+        except Exception:
+            self.logger.error("Result %i failed: %s", row_number, traceback.format_exc())
+        
+        return 0
+    
+    def run_payload(self, payload, cleaned_params=None):
+        """
+        Run the alert for the payload (once for each row of the results if the batch mode is used).
+        
+        Arguments:
+        payload -- The data from Splunk
+        cleaned_params -- The arguments following validation (these are obtained from the payload if None)
+        """
+        
+        configuration, batch_fields, max_rows = self.get_batch_settings(payload['configuration'])
+        
+        if batch_fields is not None:
+            return self.run_batch(configuration, payload, batch_fields, max_rows)
+        
+        if cleaned_params is None:
+            cleaned_params = self.validate(configuration)
+        
+        return self.run(cleaned_params, payload)
+    
     def read_config(self, in_stream=sys.stdin):
         """
         Read the config from standard input and return the configuration.
@@ -534,11 +702,24 @@ class ModularAlert():
             # Parse input
             payload = json.loads(in_stream.read())
             
-            # Validate arguments
-            cleaned_params = self.validate(payload['configuration'])
+            # Validate arguments (the arguments of each row are validated when the row is run in the batch mode)
+            configuration, batch_fields, max_rows = self.get_batch_settings(payload['configuration'])
+            cleaned_params = None
+            
+            if batch_fields is None:
+                cleaned_params = self.validate(configuration)
+            
+            # Hand the alert off to the dispatcher if it is running (it runs the alert once the ones before it are done)
+            if self.dispatcher_socket is not None:
+                try:
+                    result = forward_to_dispatcher(self.dispatcher_socket, payload)
+                    self.logger.info("Alert was handed off to the dispatcher")
+                    return result
+                except DispatcherUnavailableException as e:
+                    self.logger.debug("Dispatcher is not available, the alert will be run in this process: %s", str(e))
             
             # Run the alert
-            return self.run(cleaned_params, payload)
+            return self.run_payload(payload, cleaned_params)
             
         except Exception as e:
             
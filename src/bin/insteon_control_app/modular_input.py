@@ -0,0 +1,331 @@
+import logging
+from logging import handlers
+import traceback
+import sys
+import os
+import re
+import json
+import time
+import errno
+from xml.dom.minidom import Document
+from xml.etree import ElementTree
+
+from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+
+from modular_alert import ModularAlert, FieldValidationException
+
+class ModularInputConfig(object):
+    """
+    The configuration that Splunk passes to a modular input on standard input.
+    """
+
+    def __init__(self, server_host, server_uri, session_key, checkpoint_dir, configuration):
+        self.server_host = server_host
+        self.server_uri = server_uri
+        self.session_key = session_key
+        self.checkpoint_dir = checkpoint_dir
+
+        # The parameters of each stanza, keyed by the name of the stanza
+        self.configuration = configuration
+
+    @staticmethod
+    def get_text(element, name, default=None):
+        child = element.find(name)
+
+        if child is None or child.text is None:
+            return default
+
+        return child.text
+
+    @staticmethod
+    def get_config_from_xml(config_str_xml):
+        """
+        Parse the XML configuration from Splunk.
+
+        Arguments:
+        config_str_xml -- The XML configuration as a string
+        """
+
+        root = ElementTree.fromstring(config_str_xml)
+
+        configuration = {}
+
+        # The configuration is listed in a "configuration" element when running and an "item" element when validating
+        stanzas = root.findall('configuration/stanza') + root.findall('item')
+
+        for stanza in stanzas:
+            params = {}
+
+            for param in stanza.findall('param'):
+                params[param.get('name')] = param.text
+
+            configuration[stanza.get('name')] = params
+
+        return ModularInputConfig(ModularInputConfig.get_text(root, 'server_host'),
+                                  ModularInputConfig.get_text(root, 'server_uri'),
+                                  ModularInputConfig.get_text(root, 'session_key'),
+                                  ModularInputConfig.get_text(root, 'checkpoint_dir'),
+                                  configuration)
+
+class ModularInput(object):
+    """
+    The base class for modular inputs. Sub-classes define the parameters (as instances of Field) and implement run().
+
+    The script responds to the arguments that Splunk calls it with:
+
+        --scheme                 Print the scheme describing the input
+        --validate-arguments     Validate the parameters of the input
+        (no arguments)           Run the input
+    """
+
+    def __init__(self, scheme_args, parameters=None, logger_name='python_modular_input', log_level=logging.INFO):
+        """
+        Set up the modular input.
+
+        Arguments:
+        scheme_args -- A dictionary describing the input (title, description, use_external_validation,
+                       streaming_mode and use_single_instance)
+        parameters -- A list of the parameters (as instances of Field)
+        logger_name -- The name of the logger (and the log file)
+        log_level -- The level to log at
+        """
+
+        self.scheme_args = scheme_args
+        self.parameters = parameters or []
+
+        self.logger_name = logger_name
+        self.log_level = log_level
+        self._logger = None
+
+        # Sub-classes can check this to stop running when Splunk is shutting down
+        self.stopped = False
+
+    @property
+    def logger(self):
+
+        # Make a logger unless it already exists
+        if self._logger is not None:
+            return self._logger
+
+        logger = logging.getLogger(self.logger_name)
+        logger.propagate = False # Prevent the log messages from being duplicated in the python.log file
+        logger.setLevel(self.log_level)
+
+        file_handler = handlers.RotatingFileHandler(make_splunkhome_path(['var', 'log', 'splunk', self.logger_name + '.log']), maxBytes=25000000, backupCount=5)
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+        file_handler.setFormatter(formatter)
+
+        logger.addHandler(file_handler)
+
+        self._logger = logger
+        return self._logger
+
+    @logger.setter
+    def logger(self, logger):
+        self._logger = logger
+
+    def get_scheme(self):
+        """
+        Get the scheme of the input as an XML string.
+        """
+
+        doc = Document()
+
+        scheme = doc.createElement("scheme")
+        doc.appendChild(scheme)
+
+        for name in ['title', 'description', 'use_external_validation', 'streaming_mode', 'use_single_instance']:
+            if name in self.scheme_args:
+                element = doc.createElement(name)
+                element.appendChild(doc.createTextNode(str(self.scheme_args[name])))
+                scheme.appendChild(element)
+
+        endpoint = doc.createElement("endpoint")
+        scheme.appendChild(endpoint)
+
+        args = doc.createElement("args")
+        endpoint.appendChild(args)
+
+        for parameter in self.parameters:
+            arg = doc.createElement("arg")
+            arg.setAttribute("name", parameter.name)
+            args.appendChild(arg)
+
+            for name, value in [('data_type', parameter.get_data_type()), ('required_on_create', 'false' if parameter.none_allowed else 'true')]:
+                element = doc.createElement(name)
+                element.appendChild(doc.createTextNode(value))
+                arg.appendChild(element)
+
+        return doc.toxml()
+
+    def validate(self, arguments):
+        """
+        Validate the arguments and return a dictionary of the cleaned/converted parameters. The arguments that aren't
+        parameters of the input (such as the index and the interval) are ignored.
+
+        Arguments:
+        arguments -- A dictionary of the arguments
+        """
+
+        cleaned_params = {}
+
+        for parameter in self.parameters:
+            cleaned_params[parameter.name] = parameter.to_python(arguments.get(parameter.name, None))
+
+        return cleaned_params
+
+    def output_event(self, data_dict, stanza, index=None, sourcetype=None, source=None, host=None, event_time=None, out=sys.stdout):
+        """
+        Output the given event so that Splunk can see it (in the XML streaming format).
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        stanza -- The stanza used for the input
+        index -- The index to send the event to
+        sourcetype -- The sourcetype
+        source -- The source to use
+        host -- The host
+        event_time -- The time of the event (defaults to the current time)
+        out -- The stream to send the event to (defaults to standard output)
+        """
+
+        doc = Document()
+
+        event = doc.createElement("event")
+        event.setAttribute("stanza", stanza)
+        doc.appendChild(event)
+
+        if event_time is None:
+            event_time = time.time()
+
+        fields = [('time', "%.3f" % event_time), ('data', ModularAlert.create_event_string(data_dict)), ('index', index),
+                  ('sourcetype', sourcetype), ('source', source), ('host', host)]
+
+        for name, value in fields:
+            if value is not None:
+                element = doc.createElement(name)
+                element.appendChild(doc.createTextNode(value))
+                event.appendChild(element)
+
+        out.write(event.toxml())
+        out.flush()
+
+    @staticmethod
+    def get_checkpoint_file(checkpoint_dir, stanza):
+        """
+        Get the path of the file that stores the checkpoint for the stanza.
+
+        Arguments:
+        checkpoint_dir -- The directory that Splunk provided for storing checkpoints
+        stanza -- The name of the stanza
+        """
+
+        return os.path.join(checkpoint_dir, re.sub("[^a-zA-Z0-9_.-]", "_", stanza) + ".json")
+
+    def get_checkpoint_data(self, checkpoint_dir, stanza):
+        """
+        Get the checkpoint data that was saved for the stanza (or None if there isn't any).
+
+        Arguments:
+        checkpoint_dir -- The directory that Splunk provided for storing checkpoints
+        stanza -- The name of the stanza
+        """
+
+        try:
+            with open(ModularInput.get_checkpoint_file(checkpoint_dir, stanza), 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+    def save_checkpoint_data(self, checkpoint_dir, stanza, data):
+        """
+        Save the checkpoint data for the stanza.
+
+        Arguments:
+        checkpoint_dir -- The directory that Splunk provided for storing checkpoints
+        stanza -- The name of the stanza
+        data -- The data to save (must be JSON-serializable)
+        """
+
+        try:
+            os.makedirs(checkpoint_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        checkpoint_file = ModularInput.get_checkpoint_file(checkpoint_dir, stanza)
+
+        # Write to a temporary file and then move it into place so that a partial checkpoint is never read
+        temp_file = "%s.%d.tmp" % (checkpoint_file, os.getpid())
+
+        with open(temp_file, 'w') as fp:
+            json.dump(data, fp)
+
+        os.rename(temp_file, checkpoint_file)
+
+    def run(self, stanza, cleaned_params, input_config):
+        """
+        Run the input using the arguments provided.
+
+        Arguments:
+        stanza -- The name of the stanza
+        cleaned_params -- The arguments following validation and conversion to Python objects
+        input_config -- The configuration from Splunk (a ModularInputConfig)
+        """
+
+        raise Exception("Run function was not implemented")
+
+    def do_validation(self, in_stream=sys.stdin):
+        """
+        Validate the configuration provided by Splunk. Returns True if the configuration is valid.
+
+        Arguments:
+        in_stream -- The stream to get the input from (defaults to standard input)
+        """
+
+        input_config = ModularInputConfig.get_config_from_xml(in_stream.read())
+
+        try:
+            for stanza, params in input_config.configuration.items():
+                self.validate(params)
+
+            return True
+
+        except FieldValidationException as e:
+            print "<error><message>%s</message></error>" % (str(e).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+            return False
+
+    def execute(self, in_stream=sys.stdin, out_stream=sys.stdout):
+        """
+        Get the arguments that were provided from the command-line and execute the script.
+
+        Arguments:
+        in_stream -- The stream to get the input from (defaults to standard input)
+        out_stream -- The stream to write the output to (defaults to standard output)
+        """
+
+        try:
+            if len(sys.argv) > 1 and sys.argv[1] == "--scheme":
+                out_stream.write(self.get_scheme())
+                return True
+
+            elif len(sys.argv) > 1 and sys.argv[1] == "--validate-arguments":
+                return self.do_validation(in_stream)
+
+            input_config = ModularInputConfig.get_config_from_xml(in_stream.read())
+
+            out_stream.write("<stream>")
+            out_stream.flush()
+
+            try:
+                for stanza, params in input_config.configuration.items():
+                    self.run(stanza, self.validate(params), input_config)
+            finally:
+                out_stream.write("</stream>")
+                out_stream.flush()
+
+            return True
+
+        except Exception as e:
+            self.logger.error("Execution failed: %s", traceback.format_exc())
+            return False
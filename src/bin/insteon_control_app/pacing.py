@@ -0,0 +1,144 @@
+import time
+
+class HubPacer(object):
+    """
+    Spaces out the calls to an Insteon Hub based on how quickly the hub and the devices are observed to respond.
+
+    The Insteon Hub will drop commands if it receives them while the PLM is still busy with the previous one. Rather than
+    sleeping for a fixed duration after each call, the pacer keeps track of how long it takes for the devices to
+    acknowledge commands and only waits that long. When an acknowledgement is seen in the hub's buffer, the hub is known
+    to be ready and the next call only needs to wait for the minimum gap.
+
+    Only the commands whose replies are polled for are seen being acknowledged. The acknowledgement of a command that is
+    sent without waiting for a reply (such as turning a light on) is never observed, so the next call waits out the
+    latency learned from the other commands; for these commands, that is a fixed delay. The PLM's echo of the command
+    isn't used instead since the PLM echoes the command (0262...06) once it accepts it, before the device acknowledges it.
+    """
+
+    # The minimum amount of time between two calls to the hub (in seconds)
+    DEFAULT_MIN_GAP = 0.1
+
+    # The amount of time that it is assumed it takes for a device to acknowledge a command until it has been observed
+    DEFAULT_ACK_LATENCY = 0.5
+
+    # The longest the pacer will ever wait between calls
+    MAX_GAP = 2.0
+
+    # How much weight new observations of the acknowledgement latency are given (versus the previous observations)
+    SMOOTHING = 0.3
+
+    def __init__(self, min_gap=DEFAULT_MIN_GAP, ack_latency=DEFAULT_ACK_LATENCY):
+        """
+        Set up the pacer.
+
+        Arguments:
+        min_gap -- The minimum amount of time between two calls to the hub (in seconds)
+        ack_latency -- The initial estimate of how long it takes for a device to acknowledge a command (in seconds)
+        """
+
+        self.min_gap = min_gap
+        self.ack_latency = ack_latency
+
+        self.last_send_time = None
+        self.last_call_time = None
+        self.ready = True
+
+    def get_delay(self, now=None):
+        """
+        Get how long to wait before the hub can be called again.
+
+        Arguments:
+        now -- The current time (defaults to the current time)
+        """
+
+        if now is None:
+            now = time.time()
+
+        delay = 0
+
+        # Always keep the minimum gap between calls
+        if self.last_call_time is not None:
+            delay = self.last_call_time + self.min_gap - now
+
+        # Give the device the time it usually takes to acknowledge the last command
+        delay = max(delay, self.get_ack_delay(now))
+
+        return max(delay, 0)
+
+    def get_ack_delay(self, now=None):
+        """
+        Get how long until the last command is expected to have been acknowledged (0 if it was acknowledged).
+
+        Arguments:
+        now -- The current time (defaults to the current time)
+        """
+
+        if now is None:
+            now = time.time()
+
+        if self.ready or self.last_send_time is None:
+            return 0
+
+        gap = min(max(self.min_gap, self.ack_latency), HubPacer.MAX_GAP)
+
+        return max(self.last_send_time + gap - now, 0)
+
+    def wait(self):
+        """
+        Wait until the hub is ready to be called again. Returns how long it waited (in seconds).
+        """
+
+        delay = self.get_delay()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return max(delay, 0)
+
+    def record_call(self, finished=None):
+        """
+        Note that a call to the hub was completed (such as a request for the contents of the buffer).
+
+        Arguments:
+        finished -- When the call completed (defaults to the current time)
+        """
+
+        if finished is None:
+            finished = time.time()
+
+        self.last_call_time = finished
+
+    def record_send(self, sent=None):
+        """
+        Note that a command was sent to a device. The hub will be considered busy until the command is acknowledged or
+        until the expected acknowledgement latency elapses (which is all that is waited for if the reply to the command
+        isn't polled for).
+
+        Arguments:
+        sent -- When the command was sent (defaults to the current time)
+        """
+
+        if sent is None:
+            sent = time.time()
+
+        self.record_call(sent)
+        self.last_send_time = sent
+        self.ready = False
+
+    def record_ack(self, acked=None):
+        """
+        Note that the acknowledgement of the last command was observed, which means that the hub is ready again.
+
+        Arguments:
+        acked -- When the acknowledgement was observed (defaults to the current time)
+        """
+
+        if acked is None:
+            acked = time.time()
+
+        # Update the estimate of the latency
+        if not self.ready and self.last_send_time is not None:
+            latency = acked - self.last_send_time
+            self.ack_latency = (HubPacer.SMOOTHING * latency) + ((1 - HubPacer.SMOOTHING) * self.ack_latency)
+
+        self.ready = True
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import errno
+
+class PersistentCache(object):
+    """
+    A small cache of JSON-serializable values that is stored in a file so that the values are available to other
+    processes. Each entry has its own time-to-live.
+
+    The file is re-read whenever another process changes it. Writes replace the entire file so the last writer wins;
+    this is fine for a cache since a lost entry only means that the value needs to be obtained again.
+    """
+
+    def __init__(self, cache_file, default_ttl=None):
+        """
+        Set up the cache.
+
+        Arguments:
+        cache_file -- The path of the file to store the cache in
+        default_ttl -- How long the entries should be kept by default (in seconds); entries never expire if None
+        """
+
+        self.cache_file = cache_file
+        self.default_ttl = default_ttl
+
+        self.entries = {}
+        self.signature = None
+
+    def get_file_signature(self):
+        """
+        Get a signature (the modification time and size) that indicates if the cache file changed.
+        """
+
+        try:
+            stat = os.stat(self.cache_file)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def refresh(self):
+        """
+        Reload the entries if the cache file was changed.
+        """
+
+        signature = self.get_file_signature()
+
+        if signature == self.signature:
+            return
+
+        entries = {}
+
+        if signature is not None:
+            try:
+                with open(self.cache_file, 'r') as fp:
+                    entries = json.load(fp)
+            except (IOError, ValueError):
+                # Start over if the cache file could not be read
+                pass
+
+        self.entries = entries
+        self.signature = signature
+
+    def save(self):
+        """
+        Write the entries to the cache file.
+        """
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_file))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Drop the entries that expired so that the file doesn't keep growing
+        now = time.time()
+        self.entries = dict((key, entry) for key, entry in self.entries.items() if entry['expires'] is None or entry['expires'] > now)
+
+        # Write to a temporary file and then move it into place so that other processes don't read a partial file
+        temp_file = "%s.%d.tmp" % (self.cache_file, os.getpid())
+
+        with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w') as fp:
+            json.dump(self.entries, fp)
+
+        os.rename(temp_file, self.cache_file)
+
+        self.signature = self.get_file_signature()
+
+    def get(self, key, default=None):
+        """
+        Get the value of the entry with the given key (or the default if the entry doesn't exist or expired).
+
+        Arguments:
+        key -- The key of the entry
+        default -- The value to return if the entry doesn't exist
+        """
+
+        self.refresh()
+
+        entry = self.entries.get(key, None)
+
+        if entry is None or (entry['expires'] is not None and entry['expires'] <= time.time()):
+            return default
+
+        return entry['value']
+
+    def set(self, key, value, ttl=None, save=True):
+        """
+        Set the value of the entry with the given key.
+
+        Arguments:
+        key -- The key of the entry
+        value -- The value (must be JSON-serializable)
+        ttl -- How long the entry should be kept (in seconds); uses the default if None
+        save -- Whether the cache file should be written now
+        """
+
+        self.refresh()
+
+        if ttl is None:
+            ttl = self.default_ttl
+
+        self.entries[key] = {
+                             'value' : value,
+                             'expires' : time.time() + ttl if ttl is not None else None
+                            }
+
+        if save:
+            self.save()
+
+    def delete(self, key, save=True):
+        """
+        Remove the entry with the given key.
+
+        Arguments:
+        key -- The key of the entry
+        save -- Whether the cache file should be written now
+        """
+
+        self.refresh()
+
+        if key in self.entries:
+            del self.entries[key]
+
+            if save:
+                self.save()
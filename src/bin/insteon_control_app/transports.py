@@ -0,0 +1,398 @@
+import time
+import socket
+import select
+import binascii
+from xml.etree import ElementTree
+
+from insteon_messages import decode_message, split_hub_buffer, unroll_hub_buffer
+
+class TransportException(Exception):
+    pass
+
+class HTTPTransport(object):
+    """
+    Sends messages to the PLM through the web interface of the Insteon Hub.
+
+    Messages are sent with a request to /3?<message>=I=3 and the replies are obtained by reading the hub's copy of the
+    PLM's buffer (buffstatus.xml). The hub doesn't notify us when a reply arrives so the buffer has to be polled.
+
+    The hub writes into the buffer as a ring; the buffer is put back in the order it was written so that the replies
+    come after the messages that they are replies to.
+    """
+
+    name = 'http'
+
+    def __init__(self, session):
+        """
+        Set up the transport.
+
+        Arguments:
+        session -- The HubSession to send the requests with
+        """
+
+        self.session = session
+
+    def describe(self, message):
+        """
+        Get a description of where the message will be sent (for logging).
+
+        Arguments:
+        message -- The message as a hexadecimal string (e.g. "02622C86260F11FF")
+        """
+
+        return self.session.get_url(self.get_path(message))
+
+    def get_path(self, message):
+        return "/3?%s=I=3" % (message)
+
+    def connect(self):
+        """
+        Connect to the hub unless the connection is already open. Returns how long it took to connect (in seconds).
+        """
+
+        return self.session.connect()
+
+    def send(self, message):
+        """
+        Send the message to the PLM. Returns the HTTP status code (200 indicates that the hub accepted it).
+
+        Arguments:
+        message -- The message as a hexadecimal string (e.g. "02622C86260F11FF")
+        """
+
+        response, content = self.session.request(self.get_path(message))
+
+        return response.status
+
+    def wait_for_data(self, timeout):
+        """
+        Wait for the PLM to produce more data. The hub can't tell us when data arrives so this just waits the full time.
+
+        Arguments:
+        timeout -- How long to wait (in seconds)
+        """
+
+        if timeout > 0:
+            time.sleep(timeout)
+
+    def get_position(self):
+        """
+        Get the position that the hub will write the next data to in its buffer (or None if the buffer could not be
+        obtained). Pass it to read_buffer() to get only the data written after it.
+        """
+
+        buffer_hex = self.read_raw_buffer()
+
+        if buffer_hex is None:
+            return None
+
+        return split_hub_buffer(buffer_hex)[1]
+
+    def read_buffer(self, since=None):
+        """
+        Get the PLM's buffer as a hexadecimal string, oldest data first (or None if it could not be obtained).
+
+        Arguments:
+        since -- A position from get_position(); only the data written after it is returned if provided
+        """
+
+        if since is not None:
+            return self.read_new_data(since)[0]
+
+        buffer_hex = self.read_raw_buffer()
+
+        if buffer_hex is None:
+            return None
+
+        return unroll_hub_buffer(buffer_hex)
+
+    def read_new_data(self, since):
+        """
+        Get the data that the hub wrote to the buffer after the given position. Returns a tuple of the data as a
+        hexadecimal string (None if the buffer could not be obtained) and the position to read the next data from.
+
+        Arguments:
+        since -- A position from get_position() or from an earlier call
+        """
+
+        buffer_hex = self.read_raw_buffer()
+
+        if buffer_hex is None:
+            return None, since
+
+        data, pointer = split_hub_buffer(buffer_hex)
+
+        # The hub wrapped around to the start of the buffer since the position was obtained
+        if pointer < since:
+            return data[since:] + data[:pointer], pointer
+
+        return data[since:pointer], pointer
+
+    def read_raw_buffer(self):
+        """
+        Get the PLM's buffer as a hexadecimal string the way that the hub presents it: the ring of data followed by the
+        position that the next data will be written to (or None if it could not be obtained).
+        """
+
+        response, content = self.session.request("/buffstatus.xml")
+
+        if response.status != 200:
+            return None
+
+        response_xml = ElementTree.fromstring(content)
+
+        for data in response_xml.iter('BS'):
+            return data.text
+
+        return None
+
+    def close(self):
+        pass
+
+class PLMTransport(object):
+    """
+    Sends messages to the PLM directly over the raw serial stream that the Insteon Hub exposes over TCP.
+
+    Messages are written to the socket as binary frames and the PLM's replies are read from the socket as they arrive,
+    so there is no need to poll the hub. The most recent data received is kept so that it can be decoded the same way as
+    the hub's buffer (which also holds the most recent messages).
+    """
+
+    name = 'plm'
+
+    # This is the port that the hub exposes the PLM on
+    DEFAULT_PORT = 9761
+
+    # This is how long to wait for the socket to connect or accept a message
+    DEFAULT_TIMEOUT = 5
+
+    # This is how much of the data received from the PLM is kept (in hexadecimal characters)
+    MAX_RECEIVED_LENGTH = 2000
+
+    def __init__(self, session, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT):
+        """
+        Set up the transport.
+
+        Arguments:
+        session -- The HubSession of the hub (used for the address of the hub)
+        port -- The port that the hub exposes the PLM on
+        timeout -- How long to wait for the socket to connect or accept a message (in seconds)
+        """
+
+        self.session = session
+        self.port = port
+        self.timeout = timeout
+
+        self.socket = None
+        self.received = ''
+
+        # This is how much data was received in total (in hexadecimal characters); it is used as the position
+        self.received_length = 0
+
+    def describe(self, message):
+        return "plm://%s:%s/%s" % (self.session.address, self.port, message)
+
+    def connect(self):
+        """
+        Connect to the PLM if the socket isn't already connected. Returns how long it took to connect (in seconds).
+        """
+
+        if self.socket is not None:
+            return 0
+
+        start_time = time.time()
+
+        try:
+            self.socket = socket.create_connection((self.session.address, int(self.port)), self.timeout)
+        except socket.error as e:
+            raise TransportException("Unable to connect to the PLM at %s:%s: %s" % (self.session.address, self.port, str(e)))
+
+        return time.time() - start_time
+
+    def send(self, message):
+        """
+        Send the message to the PLM. Returns 200 once the message was written (to match the HTTP transport).
+
+        Arguments:
+        message -- The message as a hexadecimal string (e.g. "02622C86260F11FF")
+        """
+
+        frame = binascii.unhexlify(message)
+
+        # Get the data that arrived since the last read (which also drops the oldest data so that it doesn't keep growing)
+        self.read_available()
+
+        # Try again with a new connection if the hub closed the old one
+        for attempt in range(0, 2):
+            try:
+                self.connect()
+                self.socket.sendall(frame)
+                return 200
+            except socket.error:
+                self.close()
+
+                if attempt > 0:
+                    raise
+
+    def trim_received(self):
+        """
+        Drop the oldest messages from the data received so that no more than MAX_RECEIVED_LENGTH characters are kept.
+        """
+
+        position = 0
+
+        while len(self.received) - position > self.MAX_RECEIVED_LENGTH:
+            message, next_position = decode_message(self.received, position)
+
+            # Keep the message that is still arriving
+            if next_position is None:
+                break
+
+            # Skip the bytes that aren't part of a message
+            if message is None:
+                next_position = position + 2
+
+            position = next_position
+
+        self.received = self.received[position:]
+
+    def read_available(self, timeout=0):
+        """
+        Read the data that is available from the socket, waiting up to the given amount of time for it to arrive.
+        Returns the data that was read as a hexadecimal string.
+
+        The oldest data received is dropped (see trim_received()) so that it doesn't keep growing when nothing is sent
+        (such as when the data is only being followed); the replies to messages sent recently are kept since they may
+        not have been read yet.
+
+        Arguments:
+        timeout -- How long to wait for data (in seconds)
+        """
+
+        received = ''
+
+        if self.socket is None:
+            return received
+
+        try:
+            readable, writable, errored = select.select([self.socket], [], [], max(timeout, 0))
+
+            while len(readable) > 0:
+                data = self.socket.recv(4096)
+
+                # The hub closed the connection
+                if len(data) == 0:
+                    self.close()
+                    return received
+
+                received = received + binascii.hexlify(data).upper()
+                self.received = self.received + binascii.hexlify(data).upper()
+                self.received_length = self.received_length + (len(data) * 2)
+
+                readable, writable, errored = select.select([self.socket], [], [], 0)
+
+        except (socket.error, select.error):
+            self.close()
+
+        self.trim_received()
+
+        return received
+
+    def wait_for_data(self, timeout):
+        """
+        Wait until the PLM sends more data (or the timeout expires).
+
+        Arguments:
+        timeout -- How long to wait (in seconds)
+        """
+
+        self.read_available(timeout)
+
+    def get_position(self):
+        """
+        Get the position of the data that the PLM will send next. Pass it to read_buffer() to get only the data received
+        after it.
+        """
+
+        self.read_available()
+
+        return self.received_length
+
+    def read_buffer(self, since=None):
+        """
+        Get the most recent data that the PLM sent as a hexadecimal string.
+
+        Arguments:
+        since -- A position from get_position(); only the data received after it is returned if provided
+        """
+
+        if since is not None:
+            return self.read_new_data(since)[0]
+
+        self.read_available()
+
+        return self.received
+
+    def read_new_data(self, since):
+        """
+        Get the data that the PLM sent after the given position. Returns a tuple of the data as a hexadecimal string and
+        the position to read the next data from.
+
+        Arguments:
+        since -- A position from get_position() or from an earlier call
+        """
+
+        self.read_available()
+
+        # The oldest data may have been dropped since the position was obtained
+        start = len(self.received) - (self.received_length - since)
+
+        return self.received[max(start, 0):], self.received_length
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+
+        self.socket = None
+
+# These are the available transports, keyed by name
+TRANSPORTS = {
+              HTTPTransport.name : HTTPTransport,
+              PLMTransport.name : PLMTransport
+             }
+
+def parse_transport(value):
+    """
+    Parse the description of a transport (e.g. "http", "plm" or "plm:9761") and return a tuple of the name and the port
+    (which will be None if no port was provided).
+
+    Arguments:
+    value -- The description of the transport
+    """
+
+    if value is None or len(value.strip()) == 0:
+        return HTTPTransport.name, None
+
+    value = value.strip().lower()
+
+    if ':' in value:
+        name, port = value.split(':', 1)
+    else:
+        name, port = value, None
+
+    if name not in TRANSPORTS:
+        raise ValueError("The transport is not recognized (should be %s)" % (" or ".join(sorted(TRANSPORTS.keys()))))
+
+    if port is not None:
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError("The port of the transport is not a valid number")
+
+        if port < 1 or port > 65535:
+            raise ValueError("The port of the transport is not a valid port number")
+
+    return name, port
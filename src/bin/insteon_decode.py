@@ -0,0 +1,124 @@
+import sys
+import re
+from collections import OrderedDict
+
+from insteon_control_app.search_command import SearchCommand
+from insteon_control_app.insteon_messages import decode_buffer
+
+class InsteonDecode(SearchCommand):
+    """
+    Decodes the Insteon PLM messages (as hexadecimal strings) within a field of each result and adds the fields of the
+    messages to the result. A field with several messages (such as a dump of the hub's buffer) gets a multi-valued field
+    for each with one value per message (in the same order) so that the values of the messages can be paired up (e.g.
+    with mvzip); the messages that don't have the field get an empty value.
+    
+    This is a streaming command so Splunk passes the results to it in chunks. The buffer dumps tend to repeat (the same
+    buffer is often read several times) so the decoded messages are remembered and re-used for identical values.
+    """
+    
+    # These are the fields that are added to the results and the attribute of the message that each comes from
+    OUTPUT_FIELDS = [
+                     ('msg_type', 'name'),
+                     ('msg_code', 'code'),
+                     ('from', 'from_address'),
+                     ('to', 'to_address'),
+                     ('flags', 'flags'),
+                     ('hops_left', 'hops_left'),
+                     ('max_hops', 'max_hops'),
+                     ('cmd1', 'cmd1'),
+                     ('cmd2', 'cmd2'),
+                     ('user_data', 'data'),
+                     ('checksum_ok', 'checksum_ok'),
+                     ('group', 'group'),
+                     ('ack', 'ack')
+                    ]
+    
+    # This matches the runs of hexadecimal characters that could contain messages. Shorter runs are ignored so that the
+    # numbers in the text (such as dates, times and IDs) aren't decoded; the shortest message that is found on its own
+    # is a standard message sent to a device (8 bytes) without the acknowledgement.
+    HEX_RUN_REGEX = re.compile("[0-9A-Fa-f]{16,}")
+    
+    # This is how many distinct values are remembered along with their decoded fields
+    MAX_CACHED_VALUES = 10000
+    
+    def __init__(self, field="_raw"):
+        
+        # Save the parameters
+        self.field = field
+        
+        # The fields decoded from each value, keyed by the value
+        self.decoded = {}
+        
+        # Initialize the class
+        SearchCommand.__init__( self, run_in_preview=None, logger_name='insteon_decode_search_command')
+    
+    @classmethod
+    def get_fields(cls, value):
+        """
+        Decode the messages within the value and get the fields describing them. Each field will be a list with a value
+        per message if there are several messages (with an empty string for the messages that don't have the field).
+        
+        Arguments:
+        value -- A string containing the hexadecimal messages (other text around the messages is ignored)
+        """
+        
+        messages = []
+        
+        for hex_run in cls.HEX_RUN_REGEX.findall(value):
+            messages.extend(decode_buffer(hex_run))
+        
+        fields = OrderedDict()
+        
+        for name, attribute in cls.OUTPUT_FIELDS:
+            values = [getattr(message, attribute) for message in messages]
+            
+            # Leave out the fields that none of the messages have
+            if len([field_value for field_value in values if field_value is not None]) == 0:
+                continue
+            
+            if len(values) == 1:
+                fields[name] = values[0]
+            else:
+                fields[name] = ['' if field_value is None else field_value for field_value in values]
+        
+        fields['msg_count'] = len(messages)
+        
+        return fields
+    
+    def decode(self, value):
+        """
+        Get the fields describing the messages within the value, re-using the fields decoded from an identical value.
+        
+        Arguments:
+        value -- A string containing the hexadecimal messages
+        """
+        
+        fields = self.decoded.get(value, None)
+        
+        if fields is None:
+            fields = InsteonDecode.get_fields(value)
+            
+            # Start over once the cache is full so that it doesn't keep growing
+            if len(self.decoded) >= InsteonDecode.MAX_CACHED_VALUES:
+                self.decoded.clear()
+            
+            self.decoded[value] = fields
+        
+        return fields
+    
+    def handle_results(self, results, session_key, in_preview):
+        
+        for result in results:
+            value = result.get(self.field, None)
+            
+            if value:
+                result.update(self.decode(value))
+        
+        self.output_results(results)
+        
+if __name__ == '__main__':
+    try:
+        InsteonDecode.execute()
+        sys.exit(0)
+    except Exception as e:
+        sys.exit(10)
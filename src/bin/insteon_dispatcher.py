@@ -0,0 +1,23 @@
+import sys
+
+from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+
+from insteon_control_app.dispatcher import run_dispatcher
+from send_insteon_command import SendInsteonCommandAlert
+
+"""
+This script runs the dispatcher that executes the send_insteon_command alert actions on behalf of the alert processes.
+
+The dispatcher is optional; the alert action runs the command itself if the dispatcher isn't running. This script is
+intended to be run as a scripted input so that Splunk restarts the dispatcher if it stops. It exits immediately if the
+dispatcher is already running.
+"""
+if __name__ == '__main__':
+    
+    try:
+        insteon_alert = SendInsteonCommandAlert()
+        run_dispatcher(make_splunkhome_path(SendInsteonCommandAlert.DISPATCHER_SOCKET), insteon_alert)
+        sys.exit(0)
+    except Exception as e:
+        print >> sys.stderr, "Unhandled exception was caught, this may be due to a defect in the script:" + str(e) # This logs general exceptions that would have been unhandled otherwise (such as coding errors)
+        raise
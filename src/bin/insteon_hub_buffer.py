@@ -0,0 +1,168 @@
+import sys
+import time
+import logging
+from collections import OrderedDict
+
+from insteon_control_app.modular_input import ModularInput
+from insteon_control_app.modular_alert import Field, IPAddressField, PortField, FloatField
+from insteon_control_app.hub_session import HubSession
+from insteon_control_app.buffer_tail import BufferTail
+from insteon_control_app.insteon_messages import MESSAGE_TYPE_DIRECT, MESSAGE_TYPE_DIRECT_ACK, MESSAGE_TYPE_ALL_LINK_CLEANUP, MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK, MESSAGE_TYPE_BROADCAST, MESSAGE_TYPE_DIRECT_NAK, MESSAGE_TYPE_ALL_LINK_BROADCAST, MESSAGE_TYPE_ALL_LINK_CLEANUP_NAK
+from send_insteon_command import InsteonTransportField
+
+class InsteonHubBufferInput(ModularInput):
+    """
+    This modular input follows the messages that the Insteon Hub's PLM sends and receives (such as the broadcasts that
+    devices send when they are switched manually) and indexes each one as an event.
+    
+    The hub's buffer is polled over the web interface (or the PLM is read directly when the transport is "plm"). Only
+    the data written since the last poll is decoded and the position in the buffer is checkpointed so that the messages
+    aren't indexed again after a restart.
+    """
+    
+    # The names of the types of messages between devices (see the MESSAGE_TYPE_* constants)
+    MESSAGE_CLASSES = {
+                       MESSAGE_TYPE_DIRECT : 'direct',
+                       MESSAGE_TYPE_DIRECT_ACK : 'direct_ack',
+                       MESSAGE_TYPE_ALL_LINK_CLEANUP : 'all_link_cleanup',
+                       MESSAGE_TYPE_ALL_LINK_CLEANUP_ACK : 'all_link_cleanup_ack',
+                       MESSAGE_TYPE_BROADCAST : 'broadcast',
+                       MESSAGE_TYPE_DIRECT_NAK : 'direct_nak',
+                       MESSAGE_TYPE_ALL_LINK_BROADCAST : 'all_link_broadcast',
+                       MESSAGE_TYPE_ALL_LINK_CLEANUP_NAK : 'all_link_cleanup_nak'
+                      }
+    
+    # This is how often the buffer is polled by default (in seconds)
+    DEFAULT_POLL_INTERVAL = 1.0
+    
+    # This is how long to wait before trying again after the hub could not be reached (in seconds)
+    RETRY_DELAY = 10
+    
+    def __init__(self):
+        
+        scheme_args = {
+                       'title' : "Insteon Hub Buffer",
+                       'description' : "Indexes the messages that the Insteon Hub sends and receives",
+                       'use_external_validation' : "true",
+                       'streaming_mode' : "xml",
+                       'use_single_instance' : "false"
+                      }
+        
+        args = [
+                IPAddressField("address", empty_allowed=False, none_allowed=False),
+                PortField("port", empty_allowed=False, none_allowed=False),
+                Field("username", empty_allowed=False, none_allowed=False),
+                Field("password", empty_allowed=False, none_allowed=False),
+                InsteonTransportField("transport", none_allowed=True),
+                FloatField("poll_interval", none_allowed=True)
+                ]
+        
+        ModularInput.__init__(self, scheme_args, args, logger_name='insteon_hub_buffer_modular_input', log_level=logging.INFO)
+    
+    @classmethod
+    def get_event(cls, message):
+        """
+        Get the fields of the event that describes the message.
+        
+        Arguments:
+        message -- The message (an InsteonMessage)
+        """
+        
+        event = OrderedDict()
+        
+        event['message_type'] = message.name
+        event['code'] = message.code
+        
+        for field in ['from_address', 'to_address', 'flags', 'cmd1', 'cmd2', 'data', 'group', 'ack']:
+            value = getattr(message, field)
+            
+            if value is not None:
+                event[field] = value
+        
+        # Describe the messages between devices
+        if message.code in ['50', '51'] and message.flags is not None:
+            event['message_class'] = cls.MESSAGE_CLASSES.get(message.message_type, None)
+            event['extended'] = message.extended
+            event['hops_left'] = message.hops_left
+            event['max_hops'] = message.max_hops
+        
+        event['raw'] = message.raw
+        
+        return event
+    
+    def poll(self, session, tail, poll_interval):
+        """
+        Get the messages that were sent or received since the last poll.
+        
+        Arguments:
+        session -- The session of the hub (a HubSession)
+        tail -- The tail following the PLM's data (a BufferTail)
+        poll_interval -- How long to wait for new data (in seconds)
+        """
+        
+        # The PLM sends the data as it arrives so wait for it on the socket
+        if session.transport.name == 'plm':
+            session.transport.connect()
+            return tail.read(session.transport.read_available(poll_interval))
+        
+        buffer_hex = session.transport.read_raw_buffer()
+        
+        if buffer_hex is None:
+            raise Exception("The buffer could not be obtained from the hub")
+        
+        messages = tail.read_hub_buffer(buffer_hex)
+        
+        time.sleep(poll_interval)
+        
+        return messages
+    
+    def run(self, stanza, cleaned_params, input_config):
+        
+        poll_interval = cleaned_params.get("poll_interval", None) or InsteonHubBufferInput.DEFAULT_POLL_INTERVAL
+        transport = cleaned_params.get("transport", None)
+        
+        session = HubSession(cleaned_params["address"], cleaned_params["port"], cleaned_params["username"], cleaned_params["password"])
+        
+        if transport is not None:
+            session.set_transport(transport[0], transport[1])
+        
+        # Start from where we left off
+        tail = BufferTail(self.get_checkpoint_data(input_config.checkpoint_dir, stanza))
+        position = tail.get_position()
+        
+        while not self.stopped:
+            
+            try:
+                messages = self.poll(session, tail, poll_interval)
+            except Exception:
+                self.logger.exception("Unable to read the messages from the hub, stanza=%s", stanza)
+                session.transport.close()
+                time.sleep(InsteonHubBufferInput.RETRY_DELAY)
+                continue
+            
+            for message in messages:
+                self.output_event(InsteonHubBufferInput.get_event(message), stanza, host=cleaned_params["address"])
+            
+            # Save the position in the buffer if it changed
+            if tail.get_position() != position:
+                position = tail.get_position()
+                self.save_checkpoint_data(input_config.checkpoint_dir, stanza, tail.get_checkpoint())
+    
+if __name__ == '__main__':
+    
+    hub_buffer_input = None
+    
+    try:
+        hub_buffer_input = InsteonHubBufferInput()
+        
+        if not hub_buffer_input.execute():
+            sys.exit(1)
+        
+        sys.exit(0)
+    except Exception as e:
+        
+        # This logs general exceptions that would have been unhandled otherwise (such as coding errors)
+        if hub_buffer_input is not None and hub_buffer_input.logger is not None:
+            hub_buffer_input.logger.exception("Unhandled exception was caught, this may be due to a defect in the script")
+        else:
+            raise e
@@ -0,0 +1,286 @@
+import sys
+import re
+import time
+from collections import deque, OrderedDict
+
+from splunk.util import normalizeBoolean
+from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+
+from insteon_control_app.search_command import SearchCommand
+from insteon_control_app.hub_session import HubSession
+from insteon_control_app.hub_router import HubRouter
+from insteon_control_app.device_lookup import DeviceLookupIndex
+from insteon_control_app.device_state import DeviceStateCache
+from insteon_control_app.insteon_messages import decode_buffer, find_reply
+from insteon_control_app.modular_alert import IntegerField, FloatField
+from insteon_command import SendInsteonCommand
+from send_insteon_command import SendInsteonCommandAlert, InsteonDeviceField, InsteonMultipleDeviceField, InsteonTransportField, FieldValidationException
+
+class InsteonStatus(SendInsteonCommand):
+    """
+    Gets the status (the light level) of a series of devices.
+    
+    The status requests to each hub are pipelined: up to "window" requests are outstanding at once and the replies are
+    matched to the devices by their address as they are found in the PLM's buffer. The next device is asked as soon as
+    the previous one replies (or is expected to have) instead of after the reply is polled, and a device that doesn't
+    reply doesn't hold up the others until it times out. The hubs are swept concurrently.
+    
+    The results are output once all of the hubs have been swept since Intersplunk only takes a single set of results
+    from a command.
+    """
+    
+    # This is the status request command
+    STATUS_CMD1 = '19'
+    STATUS_CMD2 = '00'
+    
+    # This is how many status requests can be outstanding at once per hub by default
+    DEFAULT_WINDOW = 3
+    
+    # This is how many times a status request is sent to a device before giving up on it
+    MAX_ATTEMPTS = 2
+    
+    # This is how many times a status request is sent again because the PLM was too busy to take it (these don't count
+    # as attempts since the device never got the request)
+    MAX_PLM_NAKS = 5
+    
+    def __init__(self, device=None, lookup=None, window=None, timeout=None, adaptive_hops=None):
+        
+        # Save the parameters
+        self.device = device
+        self.lookup = lookup
+        self.window = window
+        self.timeout = timeout
+        self.adaptive_hops = adaptive_hops
+        
+        # Initialize the class
+        SearchCommand.__init__( self, run_in_preview=False, logger_name='insteon_status_search_command')
+    
+    @classmethod
+    def get_devices_from_lookup(cls, lookup):
+        """
+        Get the addresses of all of the devices in the given lookup file of the Insteon apps.
+        
+        Arguments:
+        lookup -- The name of the lookup file (e.g. "insteon_devices.csv")
+        """
+        
+        if not re.match("^[-a-zA-Z0-9_. ]+$", lookup) or lookup.startswith("."):
+            raise FieldValidationException("The lookup is not a valid file name")
+        
+        # Use the first of the Insteon apps that has the lookup
+        for lookup_file in InsteonDeviceField.LOOKUP_FILES:
+            lookup_file = lookup_file[:-1] + [lookup]
+            addresses = DeviceLookupIndex.get_index(make_splunkhome_path(lookup_file), make_splunkhome_path(InsteonDeviceField.LOOKUP_INDEX_DIRECTORY)).get_addresses()
+            
+            if len(addresses) > 0:
+                return addresses
+        
+        raise FieldValidationException("No devices were found in the lookup")
+    
+    @classmethod
+    def sweep_hub(cls, address, port, username, password, devices, window=DEFAULT_WINDOW, deadline=None, logger=None):
+        """
+        Get the status of the devices connected to a hub. Returns a list of the results (one per device) in the order
+        that the replies arrived.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        devices -- The addresses of the devices
+        window -- How many status requests can be outstanding at once
+        deadline -- How long to wait for a device to reply (in seconds)
+        logger -- The logger to use
+        """
+        
+        if deadline is None:
+            deadline = SendInsteonCommandAlert.RESPONSE_DEADLINE
+        
+        session = HubSession.get_session(address, port, username, password)
+        state_cache = SendInsteonCommandAlert.get_state_cache()
+        
+        results = []
+        
+        # The devices waiting to be asked (with the number of times they were asked and the number of times the PLM
+        # refused the request) and the ones waiting to reply (with when they were asked, the same counts and where the
+        # data written after the request starts in the data received)
+        pending = deque([(device, 0, 0) for device in devices])
+        outstanding = OrderedDict()
+        
+        # The data that the hub wrote during the sweep; only the data written after a request is matched against it so
+        # that an earlier request to the device (from a previous sweep or one that the PLM refused) isn't taken for it
+        received = ''
+        
+        def add_result(device, reply=None, sent_time=None, message=None):
+            result = OrderedDict()
+            
+            result['device'] = device
+            result['hub'] = address
+            result['success'] = reply is not None
+            
+            if reply is not None:
+                result['level'] = int(reply.cmd2, 16)
+                result['state'] = 'on' if result['level'] > 0 else 'off'
+                result['hops'] = reply.max_hops - reply.hops_left
+                result['response_time'] = "%.3f" % (time.time() - sent_time)
+                result['message'] = 'Obtained the status of the device'
+            else:
+                result['message'] = message
+            
+            results.append(result)
+        
+        # Keep the other processes from using the hub until all of the replies are in
+        with session.exclusive():
+            
+            position = SendInsteonCommandAlert.get_buffer_position(address, port, username, password)
+            delay = SendInsteonCommandAlert.RESPONSE_POLL_INITIAL_DELAY
+            
+            while len(pending) > 0 or len(outstanding) > 0:
+                
+                # Ask the next devices while there is room in the window; check for replies instead of waiting for the
+                # last request to be acknowledged so that the next request can be sent as soon as the reply arrives
+                while len(pending) > 0 and len(outstanding) < window:
+                    
+                    # The PLM refuses a message while it is still waiting for a device to acknowledge the previous one.
+                    # A device that doesn't reply only holds up the next request until the pacer expects it to have
+                    # replied (rather than the full deadline) since its request stays outstanding alongside the next.
+                    if len(outstanding) > 0 and session.pacer.get_ack_delay() > 0:
+                        break
+                    
+                    device, attempts, plm_naks = pending.popleft()
+                    
+                    if SendInsteonCommandAlert.call_insteon_web_api(address, port, username, password, device, cls.STATUS_CMD1, cls.STATUS_CMD2, False, logger=logger):
+                        outstanding[device] = (time.time(), attempts + 1, plm_naks, len(received))
+                        delay = SendInsteonCommandAlert.RESPONSE_POLL_INITIAL_DELAY
+                    else:
+                        add_result(device, message='Failed to send the status request to the device')
+                
+                if len(outstanding) == 0:
+                    continue
+                
+                # Wait a bit for the devices to reply
+                SendInsteonCommandAlert.wait_for_data(address, port, username, password, delay)
+                
+                data, position = SendInsteonCommandAlert.get_new_data(address, port, username, password, position)
+                received = received + (data or '')
+                
+                # Match the replies to the devices
+                for device, (sent_time, attempts, plm_naks, start) in list(outstanding.items()):
+                    sent, reply = find_reply(decode_buffer(received[start:]), device, cls.STATUS_CMD1)
+                    
+                    if reply is not None:
+                        del outstanding[device]
+                        session.pacer.record_ack()
+                        state_cache.set_level(device, int(reply.cmd2, 16), DeviceStateCache.SOURCE_REPLY)
+                        
+                        if session.link_quality is not None:
+                            session.link_quality.record_reply(device, reply)
+                        
+                        add_result(device, reply, sent_time)
+                        delay = SendInsteonCommandAlert.RESPONSE_POLL_INITIAL_DELAY
+                    
+                    # Ask again if the PLM was too busy to take the request; this doesn't count as an attempt since
+                    # the device never got the request
+                    elif sent is not None and sent.is_plm_nak:
+                        del outstanding[device]
+                        
+                        if plm_naks < cls.MAX_PLM_NAKS:
+                            pending.appendleft((device, attempts - 1, plm_naks + 1))
+                        else:
+                            add_result(device, message='The PLM was too busy to send the status request to the device')
+                    
+                    # Ask again if the device didn't reply in time
+                    elif time.time() >= sent_time + deadline:
+                        del outstanding[device]
+                        
+                        # Go back to the full number of hops since the device may not have gotten the request
+                        if session.link_quality is not None:
+                            session.link_quality.record_failure(device)
+                        
+                        if attempts < cls.MAX_ATTEMPTS:
+                            pending.appendleft((device, attempts, plm_naks))
+                        else:
+                            add_result(device, message='No reply was received from the device')
+                
+                # Back off before checking again
+                delay = min(delay * 2, SendInsteonCommandAlert.RESPONSE_POLL_MAX_DELAY)
+        
+        return results
+    
+    def handle_results(self, results, session_key, in_preview):
+        
+        # Obtain the authentication information
+        hub_address, hub_port, username, password, min_gap, transport = self.get_hub_info(session_key)
+        
+        # Make sure we have the information necessary to connect to Insteon
+        for name, value in [('address', hub_address), ('port', hub_port), ('username', username), ('password', password)]:
+            if value is None:
+                self.output_results([{
+                                      'message' : 'Insufficient information to connect to Insteon hub: missing ' + name
+                                      }])
+                return False
+        
+        # Get the devices to sweep
+        try:
+            transport = InsteonTransportField("transport", none_allowed=True).to_python(transport)
+            window = IntegerField("window", none_allowed=True).to_python(self.window) or InsteonStatus.DEFAULT_WINDOW
+            deadline = FloatField("timeout", none_allowed=True).to_python(self.timeout)
+            
+            if window < 1:
+                raise FieldValidationException("The window must be at least 1")
+            
+            if self.device is not None:
+                devices = sorted(InsteonMultipleDeviceField.normalize_device_ids(self.device) or [])
+            elif self.lookup is not None:
+                devices = InsteonStatus.get_devices_from_lookup(self.lookup)
+            else:
+                raise FieldValidationException('Insufficient information provided: missing device or lookup')
+        
+        except FieldValidationException as e:
+            self.output_results([{
+                                  'message' : str(e)
+                                  }])
+            return False
+        
+        adaptive_hops = normalizeBoolean(self.adaptive_hops) is True
+        
+        SendInsteonCommandAlert.configure_session(hub_address, hub_port, username, password, min_gap, transport, adaptive_hops)
+        
+        # Sweep each hub (the hubs will be run concurrently)
+        default_hub = (hub_address, hub_port, username, password)
+        routes = HubRouter.group_by_hub(devices, lambda device: SendInsteonCommandAlert.get_hub_for_device(device, default_hub))
+        
+        def sweep(hub, hub_devices):
+            address, port, hub_username, hub_password = hub
+            
+            SendInsteonCommandAlert.configure_session(address, port, hub_username, hub_password, min_gap, transport, adaptive_hops)
+            
+            return InsteonStatus.sweep_hub(address, port, hub_username, hub_password, hub_devices, window, deadline, self.logger)
+        
+        results = []
+        
+        for hub, hub_results, failure in HubRouter().run(routes, sweep):
+            
+            # Report the devices of the hub that failed; the results of the other hubs are still output
+            if failure is not None:
+                self.logger.error("The sweep of the hub %s could not be completed: %s", hub[0], failure.traceback)
+                
+                for device in routes[hub]:
+                    results.append(OrderedDict([
+                                                ('device', device),
+                                                ('hub', hub[0]),
+                                                ('success', False),
+                                                ('message', 'The sweep of the hub could not be completed: %s' % (str(failure)))
+                                                ]))
+            else:
+                results.extend(hub_results)
+        
+        self.output_results(results)
+
+if __name__ == '__main__':
+    try:
+        InsteonStatus.execute()
+        sys.exit(0)
+    except Exception as e:
+        sys.exit(10)
@@ -1,104 +1,55 @@
 import sys
 import json
 import logging
-import httplib2
 import time
 import re
-import csv
 import os
-from xml.etree import ElementTree
+import random
+import threading
+from collections import OrderedDict
 
 from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
 
-from insteon_control_app.modular_alert import ModularAlert, Field, IPAddressField, PortField, FieldValidationException
+from insteon_control_app.modular_alert import ModularAlert, Field, BooleanField, IPAddressField, PortField, IntegerField, FloatField, FieldValidationException
+from insteon_control_app.hub_session import HubSession
+from insteon_control_app.insteon_messages import decode_buffer, find_reply, find_all_link_acks, find_product_info, PLM_ACK, MESSAGE_TYPE_DIRECT_NAK
+from insteon_control_app.device_lookup import DeviceLookupIndex
+from insteon_control_app.hub_router import HubRouter
+from insteon_control_app.transports import parse_transport
+from insteon_control_app.call_timing import CallTiming
+from insteon_control_app.hub_arbiter import HubArbiter
+from insteon_control_app.command_coalescer import CommandCoalescer
+from insteon_control_app.device_state import DeviceStateCache
+from insteon_control_app.link_quality import LinkQualityTable
+from insteon_control_app.device_capabilities import DeviceCapabilityCache
+from insteon_control_app.command_catalog import get_command, build_message
 
 class InsteonCommandField(Field):
     """
-    Represents shortcuts to common Insteon commands.
-    
-    This and the default/data/ui/alerts/send_insteon_command.html must be keep in sync.
+    Represents shortcuts to common Insteon commands. The commands are converted to InsteonCommand instances from the
+    command catalog (see command_catalog.py), which also generates the list of commands in
+    default/data/ui/alerts/send_insteon_command.html.
     """
     
-    class InsteonCommandMeta:
-        
-        def __init__(self, cmd1, cmd2, response_expected=False, times=1, extended=False, data=None):
-            self.cmd1 = cmd1
-            self.cmd2 = cmd2
-            self.response_expected = response_expected
-            self.times = times
-            self.extended = extended
-            self.data = data
-    
-    # These commands are a list of the shortcuts
-    # The tuple consists of:
-    #    1) cmd1
-    #    2) cmd2
-    #    3) should the command be polled for a response
-    #    4) how many times the command should be called
-    COMMANDS = {
-                'on' :                           ('11', 'FF', False, 1),
-                'fast_on' :                      ('12', 'FF', False, 1),
-                'off' :                          ('13', 'FF', False, 1),
-                'fast_off' :                     ('14', 'FF', False, 1),
-                'status' :                       ('15', 'FF', True , 1),
-                'light_status' :                 ('19', '02', True , 1),
-                'ping' :                         ('0F', '00', True , 1),
-                
-                # Beeps:
-                'beep' :                         ('30', '01', False, 1),
-                'beep_two_times' :               ('30', '01', False, 2),
-                'beep_three_times' :             ('30', '01', False, 3),
-                'beep_four_times' :              ('30', '01', False, 4),
-                'beep_five_times' :              ('30', '01', False, 5),
-                'beep_ten_times' :               ('30', '01', False, 10),
-                
-                # iMeter
-                'imeter_status' :                ('82', '00', True , 1),
-                'imeter_reset' :                 ('80', '00', False, 1),
-                
-                # Thermostat info
-                'thermostat_info' :              ('2E', '02', False, 1, '9296'),
-                'thermostat_temp' :              ('6A', '00', False, 1),
-                'thermostat_humidity' :          ('6A', '20', False, 1),
-                'thermostat_setpoint' :          ('6A', '60', False, 1, '9296'),
-                
-                # Thermostat control
-                'thermostat_mode_heat' :         ('6B', '04', False, 1),
-                'thermostat_mode_cool' :         ('6B', '05', False, 1),
-                'thermostat_mode_manual_auto' :  ('6B', '06', False, 1),
-                'thermostat_fan_on' :            ('6B', '07', False, 1),
-                'thermostat_fan_auto' :          ('6B', '08', False, 1),
-                'thermostat_all_off' :           ('6B', '09', False, 1),
-                'thermostat_mode_auto' :         ('6B', '0A', False, 1)
-                }
-    
     @classmethod
     def get_detailed_info_from_command(cls, command_value, return_as_dict=False):
         
-        command_data = InsteonCommandField.COMMANDS.get(command_value.lower().strip())
+        command = get_command(command_value)
         
-        if command_data is None:
+        if command is None:
             raise FieldValidationException("This is not a recognized Insteon command")
+        
+        if return_as_dict:
+            return {
+                'cmd1' : command.cmd1,
+                'cmd2' : command.cmd2,
+                'response_expected' : command.response_expected,
+                'times' : command.times,
+                'extended' : command.extended,
+                'data' : command.data
+                }
         else:
-            
-            extended = False
-            data = None
-            
-            if len(command_data) >= 5:
-                extended = True
-                data = command_data[4].zfill(28)
-            
-            if return_as_dict:
-                return {
-                    'cmd1' : command_data[0],
-                    'cmd2' : command_data[1],
-                    'response_expected' : command_data[2],
-                    'times' : command_data[3],
-                    'extended' : extended,
-                    'data' : data
-                    }
-            else:
-                return InsteonCommandField.InsteonCommandMeta(command_data[0], command_data[1], command_data[2], command_data[3], extended, data)
+            return command
             
     
     def to_python(self, value):
@@ -112,6 +63,15 @@ class InsteonDeviceField(Field):
     Represents an Insteon device in the various supported formats and converts the device name to a standard output with all uppercase and no separating characters (e.g. "1234ab")
     """
     
+    # These are the lookups that devices are loaded from (in order of preference)
+    LOOKUP_FILES = [
+                    ["etc", "apps", "insteon_alert", "lookups", "insteon_devices.csv"],
+                    ["etc", "apps", "insteon", "lookups", "insteon_devices.csv"]
+                    ]
+    
+    # This is where the pre-compiled indexes of the lookup files are stored
+    LOOKUP_INDEX_DIRECTORY = ["var", "run", "splunk", "insteon_control", "lookup_index"]
+    
     def to_python(self, value):
         
         v = Field.to_python(self, value)
@@ -141,32 +101,70 @@ class InsteonDeviceField(Field):
     @staticmethod
     def get_insteon_device_from_lookups(device_name):
         
-        # By default, we will try the lookup in this app
-        device = InsteonDeviceField.get_insteon_device_from_lookup(device_name, make_splunkhome_path(["etc", "apps", "insteon_alert", "lookups", "insteon_devices.csv"]))
+        return InsteonDeviceField.get_value_from_lookups(device_name, 'address')
+    
+    @staticmethod
+    def get_insteon_device_from_lookup(device_name, devices_lookup_file):
+        
+        return InsteonDeviceField.get_value_from_lookup(device_name, devices_lookup_file, 'address')
+    
+    @staticmethod
+    def get_value_from_lookups(device_name, column):
+        """
+        Get the value of the given column for the named entry from the first lookup that has it (or None if none do).
+        
+        Arguments:
+        device_name -- The name of the entry (e.g. "living room light")
+        column -- The name of the column to get the value of (e.g. "address")
+        """
         
-        # Otherwise, try this app
-        if device is None: 
-            device = InsteonDeviceField.get_insteon_device_from_lookup(device_name, make_splunkhome_path(["etc", "apps", "insteon", "lookups", "insteon_devices.csv"]))
+        # By default, we will try the lookup in this app; otherwise, try the Insteon app
+        for lookup_file in InsteonDeviceField.LOOKUP_FILES:
+            value = InsteonDeviceField.get_value_from_lookup(device_name, make_splunkhome_path(lookup_file), column)
             
-        return device
+            if value is not None and len(value.strip()) > 0:
+                return value
+            
+        return None
     
     @staticmethod
-    def get_insteon_device_from_lookup(device_name, devices_lookup_file):
+    def get_value_for_address_from_lookups(address, column):
+        """
+        Get the value of the given column for the device with the given address from the first lookup that has it (or None if none do).
+        
+        Arguments:
+        address -- The address of the device (e.g. "56789A")
+        column -- The name of the column to get the value of (e.g. "hub")
+        """
+        
+        for lookup_file in InsteonDeviceField.LOOKUP_FILES:
+            
+            try:
+                index = DeviceLookupIndex.get_index(make_splunkhome_path(lookup_file), make_splunkhome_path(InsteonDeviceField.LOOKUP_INDEX_DIRECTORY))
+                device = index.get_device_by_address(address)
+            except Exception:
+                device = None
+            
+            if device is not None and device.get(column, None) is not None and len(device[column].strip()) > 0:
+                return device[column]
+            
+        return None
+    
+    @staticmethod
+    def get_value_from_lookup(device_name, devices_lookup_file, column):
         
         try:
-                 
-            # See if we have a local lookup file, if we do, use that one
-            if not os.path.isfile(devices_lookup_file):
+            
+            # Get the index of the lookup file; this will only parse the file if it changed
+            index = DeviceLookupIndex.get_index(devices_lookup_file, make_splunkhome_path(InsteonDeviceField.LOOKUP_INDEX_DIRECTORY))
+            
+            # Try to find the device
+            device = index.get_device(device_name)
+            
+            if device is None:
                 return None
             
-            # Open the file and try to find the entry
-            with open(devices_lookup_file, 'rb') as csvfile:
-                insteon_devices = csv.DictReader(csvfile)
-                
-                # Try to find the device
-                for insteon_device in insteon_devices:
-                    if insteon_device.get('name', None) == device_name:
-                        return insteon_device.get('address', None)
+            return device.get(column, None)
                     
         except Exception as e:
             # Device not found
@@ -187,7 +185,7 @@ class InsteonMultipleDeviceField(Field):
     @staticmethod
     def normalize_device_ids(device_list_as_str):
         
-        if device_list_as_str is None:
+        if device_list_as_str is None or len(device_list_as_str.strip()) == 0:
             return None
         
         devices = []
@@ -198,6 +196,84 @@ class InsteonMultipleDeviceField(Field):
         # Return the devices while removing duplicates
         return set(devices)
 
+class InsteonGroupField(Field):
+    """
+    Represents an Insteon all-link group (a scene). The group can be provided as a number (0-255) or as the name of an entry in the insteon_devices.csv lookup that has a value in the group column. The group is converted to a hex string (e.g. "0A").
+    """
+    
+    def to_python(self, value):
+        
+        v = Field.to_python(self, value)
+        
+        return InsteonGroupField.normalize_group(v)
+    
+    @staticmethod
+    def normalize_group(group):
+        
+        if group is None or len(str(group).strip()) == 0:
+            return None
+        
+        group = str(group).strip()
+        
+        # Try to load the group from the lookup if a name was provided
+        if re.match("^[0-9]+$", group) is None:
+            group_from_lookup = InsteonDeviceField.get_value_from_lookups(group, 'group')
+            
+            if group_from_lookup is None:
+                raise FieldValidationException(group + " is not a recognized Insteon group (should be a number between 0 and 255)")
+            
+            group = group_from_lookup.strip()
+        
+        try:
+            group_number = int(group)
+        except ValueError:
+            raise FieldValidationException(group + " is not a valid Insteon group (should be a number between 0 and 255)")
+        
+        if group_number < 0 or group_number > 255:
+            raise FieldValidationException(group + " is not a valid Insteon group (should be a number between 0 and 255)")
+        
+        return "%02X" % group_number
+
+class InsteonTransportField(Field):
+    """
+    Represents how the messages are sent to the hub: "http" uses the hub's web interface and "plm" connects to the PLM
+    directly (optionally with a port, e.g. "plm:9761"). The transport is converted to a tuple of the name and the port.
+    """
+    
+    def to_python(self, value):
+        
+        v = Field.to_python(self, value)
+        
+        if v is None:
+            return None
+        
+        try:
+            return parse_transport(v)
+        except ValueError as e:
+            raise FieldValidationException(str(e))
+    
+class InsteonDeliveryField(Field):
+    """
+    Represents how the commands are delivered to the devices: "repeat" sends each command the number of times that it
+    calls for without checking whether the device got it and "ack" re-sends the command until the device acknowledges it.
+    """
+    
+    DELIVERY_MODES = ['repeat', 'ack']
+    
+    def to_python(self, value):
+        
+        v = Field.to_python(self, value)
+        
+        if v is None or len(v.strip()) == 0:
+            return None
+        
+        v = v.strip().lower()
+        
+        if v not in InsteonDeliveryField.DELIVERY_MODES:
+            raise FieldValidationException("The delivery must be one of: " + ", ".join(InsteonDeliveryField.DELIVERY_MODES))
+        
+        return v
+    
 class InsteonExtendedDataField(Field):
     """
     Represents an extended data field.
@@ -235,8 +311,70 @@ class SendInsteonCommandAlert(ModularAlert):
     This alert action supports sending commands to an Insteon Hub via its web interface.
     """
     
-    # This indicates how long to wait between each call when a command is supposed to be called several times
-    SLEEP_BETWEEN_CALL_DURATION = 1.0
+    # This is the socket that the dispatcher (insteon_dispatcher.py) listens on
+    DISPATCHER_SOCKET = ["var", "run", "splunk", "insteon_control", "dispatcher.sock"]
+    
+    # This is where the lock files that coordinate the processes using the hubs are stored
+    HUB_LOCK_DIRECTORY = ["var", "run", "splunk", "insteon_control", "hub_locks"]
+    
+    # This is where the commands waiting to be sent are tracked so that superseded commands can be collapsed
+    COALESCE_JOURNAL_FILE = ["var", "run", "splunk", "insteon_control", "coalesce_journal.json"]
+    
+    # This is where the last known state of each device is stored
+    DEVICE_STATE_CACHE_FILE = ["var", "run", "splunk", "insteon_control", "device_state_cache.json"]
+    
+    # This is the cache of the state of the devices (see get_state_cache())
+    state_cache = None
+    
+    # This is where the number of hops that the replies from each device took is stored
+    LINK_QUALITY_FILE = ["var", "run", "splunk", "insteon_control", "link_quality.json"]
+    
+    # This is the table of the hops of the devices (see get_link_quality())
+    link_quality = None
+    
+    # This is where the engine version and product information of each device is stored
+    DEVICE_CAPABILITIES_FILE = ["var", "run", "splunk", "insteon_control", "device_capabilities.json"]
+    
+    # This is the cache of the capabilities of the devices (see get_capability_cache())
+    capability_cache = None
+    
+    # This keeps the threads sending to each hub from creating the caches above more than once
+    caches_lock = threading.Lock()
+    
+    # This is the reason (cmd2) that i2cs devices give when refusing an extended message with a bad checksum
+    NAK_BAD_CHECKSUM = 'FD'
+    
+    # This indicates how long to wait for a device to respond to a command before giving up
+    RESPONSE_DEADLINE = 3.0
+    
+    # These are the lookups that describe the hubs (with the name, address, port, username and password columns)
+    HUB_LOOKUP_FILES = [
+                        ["etc", "apps", "insteon_alert", "lookups", "insteon_hubs.csv"],
+                        ["etc", "apps", "insteon", "lookups", "insteon_hubs.csv"]
+                        ]
+    
+    # This indicates how much longer to wait for the devices to acknowledge a group broadcast for each device in the group
+    GROUP_CLEANUP_DEADLINE_PER_DEVICE = 0.5
+    
+    # These control how frequently the hub's buffer is checked while waiting for a response
+    RESPONSE_POLL_INITIAL_DELAY = 0.05
+    RESPONSE_POLL_MAX_DELAY = 0.4
+    
+    # These are the ways that the commands can be delivered (see InsteonDeliveryField)
+    DELIVERY_REPEAT = 'repeat'
+    DELIVERY_ACK = 'ack'
+    
+    # These are the outcomes of delivering a command when waiting for the device to acknowledge it
+    DELIVERY_ACKED = 'acked'
+    DELIVERY_NAK = 'nak'
+    DELIVERY_TIMEOUT = 'timeout'
+    DELIVERY_FAILED = 'failed'
+    
+    # These control how many times a command is re-sent when the device doesn't acknowledge it and how long to wait
+    # before re-sending it (the delay doubles each time and is jittered so that the retries of several processes spread out)
+    DEFAULT_MAX_RETRIES = 3
+    RETRY_INITIAL_DELAY = 0.5
+    RETRY_MAX_DELAY = 4.0
     
     def __init__(self, **kwargs):
         params = [
@@ -248,23 +386,108 @@ class SendInsteonCommandAlert(ModularAlert):
                     Field("password", empty_allowed=False, none_allowed=False),
                     Field("username", empty_allowed=False, none_allowed=False),
                     
+                    # The minimum amount of time between calls to the hub
+                    FloatField("min_gap", empty_allowed=False, none_allowed=True),
+                    
+                    # How the messages are sent to the hub
+                    InsteonTransportField("transport", empty_allowed=True, none_allowed=True),
+                    
+                    # How long to wait for a later command to the same device that supersedes this one
+                    FloatField("coalesce_window", empty_allowed=True, none_allowed=True),
+                    
+                    # Don't send commands that wouldn't change the state of the device
+                    BooleanField("skip_if_in_state", empty_allowed=True, none_allowed=True),
+                    
+                    # Whether to re-send the commands until the devices acknowledge them (and how many times to do so)
+                    InsteonDeliveryField("delivery", empty_allowed=True, none_allowed=True),
+                    IntegerField("max_retries", empty_allowed=True, none_allowed=True),
+                    
+                    # Send the messages to nearby devices with fewer hops
+                    BooleanField("adaptive_hops", empty_allowed=True, none_allowed=True),
+                    
                     # The command to send
                     InsteonCommandField("command", empty_allowed=False, none_allowed=False),
-                    InsteonMultipleDeviceField("device", empty_allowed=False, none_allowed=False)
+                    InsteonMultipleDeviceField("device", empty_allowed=True, none_allowed=True),
+                    
+                    # The all-link group to broadcast the command to and whether the devices that don't acknowledge the broadcast should get the command directly
+                    InsteonGroupField("group", empty_allowed=True, none_allowed=True),
+                    BooleanField("cleanup", empty_allowed=False, none_allowed=True)
         ]
         
-        ModularAlert.__init__( self, params, logger_name="send_insteon_command_alert", log_level=logging.INFO )
+        ModularAlert.__init__( self, params, logger_name="send_insteon_command_alert", log_level=logging.INFO, dispatcher_socket=make_splunkhome_path(SendInsteonCommandAlert.DISPATCHER_SOCKET) )
     
     @classmethod
-    def get_response_if_matches(cls, address, port, username, password, device, cmd1, cmd2, logger=None):
+    def get_response_if_matches(cls, address, port, username, password, device, cmd1, cmd2, logger=None, deadline=None, timing=None, since=None):
+        """
+        Poll the buffer of the Insteon Hub until the response to the given command shows up. Returns the parsed response
+        or None if no matching response was received before the deadline.
         
-        max_tries = 5
-        delay_between_call = 0.5
+        The buffer still holds the earlier exchanges with the device, so an identical command sent before (and its reply)
+        would match too; pass the position of the buffer from before the command was sent to only consider what the hub
+        wrote after it.
         
-        for i in range(0, max_tries):
-            pass
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        device -- The device that the command was sent to
+        cmd1 -- The hex string of the first command portion of the command that was sent
+        cmd2 -- The hex string of the second command portion of the command that was sent
+        logger -- The logger to use
+        deadline -- How long to wait for the response (in seconds)
+        timing -- A CallTiming instance to record when the PLM acknowledged the command and when the device replied
+        since -- The position of the buffer from before the command was sent (see get_buffer_position())
+        """
+        
+        if deadline is None:
+            deadline = cls.RESPONSE_DEADLINE
+        
+        session = HubSession.get_session(address, port, username, password)
         
-        pass
+        give_up_time = time.time() + deadline
+        delay = cls.RESPONSE_POLL_INITIAL_DELAY
+        
+        while True:
+            
+            # Wait a bit to give the device time to respond
+            cls.wait_for_data(address, port, username, password, min(delay, max(give_up_time - time.time(), 0)))
+            
+            raw_response = cls.get_response(address, port, username, password, logger, since)
+            
+            if raw_response is not None:
+                messages = decode_buffer(raw_response)
+                sent, reply = find_reply(messages, device, cmd1)
+                
+                if timing is not None and sent is not None and sent.ack == PLM_ACK:
+                    timing.mark('ack')
+                
+                # Stop if we found the response
+                if reply is not None:
+                    session.pacer.record_ack()
+                    cls.get_state_cache().record_messages(messages)
+                    
+                    if session.link_quality is not None:
+                        session.link_quality.record_reply(device, reply)
+                    
+                    if timing is not None:
+                        timing.record_reply(reply)
+                    
+                    return cls.make_response(sent, reply)
+            
+            # Give up if we have waited long enough
+            if time.time() >= give_up_time:
+                
+                if logger is not None:
+                    logger.warn("No matching response was received from the device, " + cls.create_event_string({
+                                                                                                                    'device' : device,
+                                                                                                                    'cmd1' : cmd1,
+                                                                                                                    'cmd2' : cmd2
+                                                                                                                   }))
+                return None
+            
+            # Back off before checking again
+            delay = min(delay * 2, cls.RESPONSE_POLL_MAX_DELAY)
     
     @classmethod
     def parse_raw_response(cls, response_raw):
@@ -273,64 +496,131 @@ class SendInsteonCommandAlert(ModularAlert):
             
             02622C86260F15FF  06               0250          2C8626          2CB84E     2      F           19     00
             Last Command      Response Flag    Return Flag   Target Device   Source     Ack    Hop Count   cmd1   cmd2 (level)
+        
+        The entire buffer is decoded (see decode_buffer()); the response describes the first command that was sent and
+        the first reply that followed it.
+        """
+        
+        sent = None
+        reply = None
+        
+        for message in decode_buffer(response_raw):
+            
+            if sent is None and message.code == '62':
+                sent = message
+            elif reply is None and message.code in ['50', '51']:
+                reply = message
+                break
+        
+        return cls.make_response(sent, reply)
+    
+    @classmethod
+    def make_response(cls, sent, reply):
+        """
+        Make a dictionary describing the response to a command.
+        
+        Arguments:
+        sent -- The message that was sent to the device (an InsteonMessage)
+        reply -- The reply from the device (an InsteonMessage)
         """
         
-        # 
-        #for 
+        response = dict.fromkeys(['last_command', 'last_command_cmd1', 'last_command_cmd2', 'full_response', 'response_flag', 'return_flag',
+                                  'target_device', 'source_device', 'ack', 'hops', 'cmd1', 'cmd2'])
         
-        response = {
-         'last_command'      : response_raw[0:16],
-         'last_command_cmd1' : response_raw[12:14],
-         'last_command_cmd2' : response_raw[14:16],
-         'full_response'     : response_raw[16:40],
+        if sent is not None:
+            response['last_command'] = sent.raw[0:-2]
+            response['last_command_cmd1'] = sent.cmd1
+            response['last_command_cmd2'] = sent.cmd2
+            response['response_flag'] = sent.ack
         
-         'response_flag'     : response_raw[16:18],
-         'return_flag'       : response_raw[18:22],
-         'target_device'     : response_raw[22:28],
-         'source_device'     : response_raw[28:34],
-         'ack'               : response_raw[34:35],
-         'hops'              : response_raw[35:36],
-         'cmd1'              : response_raw[36:38],
-         'cmd2'              : response_raw[38:40]
-        }
+        if reply is not None:
+            response['full_response'] = (sent.ack if sent is not None else '') + reply.raw
+            response['return_flag'] = reply.raw[0:4]
+            response['target_device'] = reply.from_address
+            response['source_device'] = reply.to_address
+            response['ack'] = reply.flags[0]
+            response['hops'] = reply.flags[1]
+            response['cmd1'] = reply.cmd1
+            response['cmd2'] = reply.cmd2
         
         return response
     
     @classmethod
-    def get_response(cls, address, port, username, password, logger=None):
+    def wait_for_data(cls, address, port, username, password, timeout):
+        """
+        Wait for the hub's PLM to produce more data. This returns as soon as data arrives if the transport supports it
+        (otherwise, this waits the full amount of time).
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        timeout -- How long to wait (in seconds)
+        """
+        
+        HubSession.get_session(address, port, username, password).transport.wait_for_data(timeout)
+    
+    @classmethod
+    def get_buffer_position(cls, address, port, username, password):
+        """
+        Get the position that the hub will write the next data to in the PLM's buffer (or None if it couldn't be
+        obtained). Pass it to get_response() to only get the data written after it.
         
-        time.sleep(1.0)
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        """
+        
+        session = HubSession.get_session(address, port, username, password)
+        
+        position = session.transport.get_position()
+        session.pacer.record_call()
+        
+        return position
+    
+    @classmethod
+    def get_new_data(cls, address, port, username, password, since):
+        """
+        Get the data that the hub wrote to the PLM's buffer after the given position. Returns a tuple of the data (None
+        if it couldn't be obtained) and the position to get the next data from.
         
-        # Build the URL to perform the action
-        url = "http://%s:%s/buffstatus.xml" % (address, port)
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        since -- The position of the buffer (see get_buffer_position())
+        """
         
-        # Make the HTTP object for performing the action
-        http = httplib2.Http(timeout=5, disable_ssl_certificate_validation=True)
+        session = HubSession.get_session(address, port, username, password)
         
-        # Add in the credentials
-        http.add_credentials(username, password)
+        data, position = session.transport.read_new_data(since)
+        session.pacer.record_call()
         
-        # Perform the operation
-        response, content = http.request(url, 'GET')
+        return data, position
+    
+    @classmethod
+    def get_response(cls, address, port, username, password, logger=None, since=None):
         
-        if response.status == 200:
-            
-            if logger is not None:
-                logger.debug("Obtained response successfully, " + cls.create_event_string({
-                                                                                            'url' : url
-                                                                                           }))
-            
-            response_xml = ElementTree.fromstring(content)
-            
-            for data in response_xml.iter('BS'):
-                return data.text
-            
-        else:
-            return None
+        # Get the session for the hub so that the connection can be re-used
+        session = HubSession.get_session(address, port, username, password)
         
+        # Get the buffer from the PLM
+        buffer_hex = session.transport.read_buffer(since)
+        session.pacer.record_call()
+        
+        if buffer_hex is not None and logger is not None:
+            logger.debug("Obtained response successfully, " + cls.create_event_string({
+                                                                                        'transport' : session.transport.name
+                                                                                       }))
+        
+        return buffer_hex
     
     @classmethod
-    def call_insteon_web_api(cls, address, port, username, password, device, cmd1, cmd2, response_expected, extended=False, data=None, logger=None):
+    def call_insteon_web_api(cls, address, port, username, password, device, cmd1, cmd2, response_expected, extended=False, data=None, logger=None, retries=0):
         """
         Perform a call to the Insteon Web API.
         
@@ -346,54 +636,580 @@ class SendInsteonCommandAlert(ModularAlert):
         extended -- Whether the command is an extended direct command
         data -- The data to send to the server (in hexadecimal); should not exceed 28 characters (14 bytes of data in base 16)
         logger -- The logger to use
+        retries -- How many times the command was sent before this call (recorded with the timing of the call)
         """
         
         # Fill in zeroes before the cmd fields and convert them to upper case
         cmd1 = cmd1.zfill(2).upper()
         cmd2 = cmd2.zfill(2).upper()
         
-        # Build the URL to perform the action
+        # Get the session for the hub so that the connection can be re-used
+        session = HubSession.get_session(address, port, username, password)
+        
+        # Find out what engine the device uses so that the extended message is built the way the device expects it
+        checksum = False
+        
         if extended:
-            url = "http://%s:%s/3?0262%s1F%s%s%s=I=3" % (address, port, device, cmd1, cmd2, data)
+            capability_cache = cls.get_capability_cache()
+            
+            if capability_cache.get_capabilities(device) is None:
+                cls.probe_capabilities(address, port, username, password, device, logger)
+            
+            checksum = capability_cache.requires_checksum(device)
+        
+        # Use fewer hops for the devices that are known to be nearby
+        if session.link_quality is not None:
+            max_hops = session.link_quality.get_max_hops(device)
         else:
-            url = "http://%s:%s/3?0262%s0F%s%s=I=3" % (address, port, device, cmd1, cmd2)
+            max_hops = LinkQualityTable.MAX_HOPS
+        
+        # Build the message to send to the PLM
+        message = build_message(device, cmd1, cmd2, extended, data, max_hops, checksum)
+        
+        url = session.transport.describe(message)
         
         if logger is not None:
             logger.debug("Calling Insteon Hub API with url=%s", url)
         
-        # Make the HTTP object for performing the action
-        http = httplib2.Http(timeout=5, disable_ssl_certificate_validation=True)
+        # Keep the other processes from using the hub until we get the response
+        with session.exclusive():
+            
+            # Note where the hub is in its buffer so that an earlier exchange with the device isn't taken as the response
+            if response_expected:
+                position = cls.get_buffer_position(address, port, username, password)
+            
+            # Wait until the hub is ready for another command
+            wait_time = session.wait_to_send()
+            
+            # Keep track of how long each part of the call takes
+            timing = CallTiming(hub=address, transport=session.transport.name, device=device, cmd1=cmd1, cmd2=cmd2)
+            timing.record('wait', wait_time)
+            timing.retries = retries
+            
+            # Perform the operation
+            try:
+                timing.record('connect', session.transport.connect())
+            
+                http_start_time = time.time()
+                status = session.transport.send(message)
+                timing.record('http', time.time() - http_start_time)
+            except Exception:
+                timing.emit('error')
+                raise
+            
+            # The pacer only learns when the device acknowledged the command if the response is polled for; otherwise,
+            # the next call waits for the latency observed with the other commands (see HubPacer)
+            session.pacer.record_send()
+            
+            if status == 200:
+                
+                # The state of the device isn't known until it replies
+                cls.get_state_cache().record_sent(device, cmd1)
+                
+                if logger is not None:
+                    logger.info("Operation performed successfully, " + cls.create_event_string({
+                                                                                                 'url' : url
+                                                                                                }))
+                       
+                # Get the response
+                if response_expected:
+                    parsed_response = cls.get_response_if_matches(address, port, username, password, device, cmd1, cmd2, logger, timing=timing, since=position)
+                
+                    # The command was sent even though the device didn't respond in time
+                    if parsed_response is None:
+                        
+                        # Go back to the full number of hops since the device may not have gotten the message
+                        if session.link_quality is not None:
+                            session.link_quality.record_failure(device)
+                        
+                        timing.emit('no_reply')
+                        return True
+                
+                    if cls.get_delivery_status(parsed_response) == cls.DELIVERY_NAK:
+                        
+                        # Only i2cs devices check the checksum so the device must be one (the next try will include it)
+                        if extended and parsed_response['cmd2'] == cls.NAK_BAD_CHECKSUM:
+                            cls.get_capability_cache().update(device, engine=DeviceCapabilityCache.ENGINE_I2CS)
+                        
+                        timing.emit('nak')
+                    else:
+                        timing.emit('ok')
+                    
+                    return parsed_response
+            
+                timing.emit('ok')
+                return True
+            else:
+            
+                if logger is not None:
+                    logger.warn("Operation failed, " + cls.create_event_string({
+                                                                                 'status_code' : status
+                                                                                }))
+            
+                timing.emit('failed')
+                return False
+    
+    @classmethod
+    def get_delivery_status(cls, response):
+        """
+        Get the outcome of a command based on what call_insteon_web_api() returned when a response was expected:
+        DELIVERY_ACKED if the device acknowledged it, DELIVERY_NAK if the device refused it, DELIVERY_TIMEOUT if the
+        device didn't reply and DELIVERY_FAILED if the hub didn't accept the command.
+        
+        Arguments:
+        response -- The value returned by call_insteon_web_api()
+        """
+        
+        if response is False:
+            return cls.DELIVERY_FAILED
+        
+        # The response is only a dictionary if the device replied
+        if not isinstance(response, dict) or response.get('ack', None) is None:
+            return cls.DELIVERY_TIMEOUT
+        
+        # The "ack" is the first digit of the flags of the reply; the message type is in its top three bits
+        if (int(response['ack'], 16) >> 1) == MESSAGE_TYPE_DIRECT_NAK:
+            return cls.DELIVERY_NAK
+        
+        return cls.DELIVERY_ACKED
+    
+    @classmethod
+    def get_retry_delay(cls, retries):
+        """
+        Get how long to wait before re-sending a command (in seconds). The delay doubles with each retry and is jittered
+        by up to half of it.
+        
+        Arguments:
+        retries -- How many times the command was already re-sent
+        """
+        
+        delay = min(cls.RETRY_INITIAL_DELAY * (2 ** retries), cls.RETRY_MAX_DELAY)
+        
+        return (delay / 2) + random.uniform(0, delay / 2)
+    
+    @classmethod
+    def deliver(cls, address, port, username, password, device, cmd1, cmd2, extended=False, data=None, max_retries=None, logger=None):
+        """
+        Send the command and wait for the device to acknowledge it, re-sending it if the device refuses it or doesn't
+        reply. Returns a tuple of the outcome (see get_delivery_status()), the response (as returned by
+        call_insteon_web_api()) and how many times the command was re-sent.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        device -- The device to send the command to
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        extended -- Whether the command is an extended direct command
+        data -- The data to send to the server (in hexadecimal)
+        max_retries -- How many times the command can be re-sent (uses DEFAULT_MAX_RETRIES if None)
+        logger -- The logger to use
+        """
         
-        # Add in the credentials
-        http.add_credentials(username, password)
+        if max_retries is None:
+            max_retries = cls.DEFAULT_MAX_RETRIES
         
-        # Perform the operation
-        response, content = http.request(url, 'GET')
+        retries = 0
         
-        if response.status == 200:
+        while True:
+            response = cls.call_insteon_web_api(address, port, username, password, device, cmd1, cmd2, True, extended, data, logger, retries)
+            status = cls.get_delivery_status(response)
+            
+            if status == cls.DELIVERY_ACKED or retries >= max_retries:
+                return status, response, retries
+            
             if logger is not None:
-                logger.info("Operation performed successfully, " + cls.create_event_string({
-                                                                                             'url' : url
-                                                                                            }))
-                       
-            # Get the response
-            if response_expected:
-                raw_response = cls.get_response(address, port, username, password, logger)
+                logger.info("Insteon command was not acknowledged by the device, it will be sent again, " + cls.create_event_string({
+                                                                                                                                       'device' : device,
+                                                                                                                                       'cmd1' : cmd1,
+                                                                                                                                       'cmd2' : cmd2,
+                                                                                                                                       'delivery' : status,
+                                                                                                                                       'retries' : retries
+                                                                                                                                      }))
+            
+            time.sleep(cls.get_retry_delay(retries))
+            retries = retries + 1
+    
+    @classmethod
+    def get_product_info(cls, address, port, username, password, device, logger=None):
+        """
+        Poll the buffer of the Insteon Hub until the broadcast with the product information of the device shows up
+        (after sending it a product request). Returns the broadcast or None if it didn't arrive before the deadline.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        device -- The device that the product request was sent to
+        logger -- The logger to use
+        """
+        
+        give_up_time = time.time() + cls.RESPONSE_DEADLINE
+        delay = cls.RESPONSE_POLL_INITIAL_DELAY
+        
+        while True:
+            
+            # Wait a bit to give the device time to respond
+            cls.wait_for_data(address, port, username, password, min(delay, max(give_up_time - time.time(), 0)))
+            
+            broadcast = find_product_info(decode_buffer(cls.get_response(address, port, username, password, logger)), device)
+            
+            if broadcast is not None:
+                return broadcast
+            
+            # Give up if we have waited long enough
+            if time.time() >= give_up_time:
+                return None
+            
+            # Back off before checking again
+            delay = min(delay * 2, cls.RESPONSE_POLL_MAX_DELAY)
+    
+    @classmethod
+    def probe_capabilities(cls, address, port, username, password, device, logger=None):
+        """
+        Ask the device for its engine version and product information and store them in the capability cache. Returns
+        the capabilities (or None if the device didn't answer).
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        device -- The device to probe
+        logger -- The logger to use
+        """
+        
+        capability_cache = cls.get_capability_cache()
+        
+        # Get the engine version
+        response = cls.call_insteon_web_api(address, port, username, password, device, DeviceCapabilityCache.ENGINE_VERSION_CMD1, '00', True, logger=logger)
+        status = cls.get_delivery_status(response)
+        
+        if status not in [cls.DELIVERY_ACKED, cls.DELIVERY_NAK]:
+            capability_cache.record_failed_probe(device)
+            return None
+        
+        engine = DeviceCapabilityCache.get_engine_from_reply(response['cmd2'], status == cls.DELIVERY_NAK)
+        capability_cache.update(device, engine=engine)
+        
+        # Get the product information (which is sent in a broadcast after the device acknowledges the request)
+        if cls.get_delivery_status(cls.call_insteon_web_api(address, port, username, password, device, DeviceCapabilityCache.PRODUCT_REQUEST_CMD1, '00', True, logger=logger)) == cls.DELIVERY_ACKED:
+            broadcast = cls.get_product_info(address, port, username, password, device, logger)
+            
+            if broadcast is not None:
+                capability_cache.record_product_info(device, broadcast)
+        
+        capabilities = capability_cache.get_capabilities(device)
+        
+        if logger is not None:
+            logger.info("Probed the capabilities of the device, " + cls.create_event_string(dict(capabilities, device=device)))
+        
+        return capabilities
+    
+    @classmethod
+    def call_insteon_web_api_for_group(cls, address, port, username, password, group, cmd1, cmd2, logger=None):
+        """
+        Send a command to all of the devices in an all-link group with a single broadcast.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        group -- The hex string of the group to send the command to
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        logger -- The logger to use
+        """
+        
+        # Get the session for the hub so that the connection can be re-used
+        session = HubSession.get_session(address, port, username, password)
+        
+        message = "0261%s%s%s" % (group, cmd1.zfill(2).upper(), cmd2.zfill(2).upper())
+        
+        if logger is not None:
+            logger.debug("Calling Insteon Hub API with url=%s", session.transport.describe(message))
+        
+        # Keep the other processes from using the hub while we send the broadcast
+        with session.exclusive():
+            
+            # Wait until the hub is ready for another command
+            wait_time = session.wait_to_send()
+            
+            # Keep track of how long each part of the call takes
+            timing = CallTiming(hub=address, transport=session.transport.name, group=group, cmd1=cmd1, cmd2=cmd2)
+            timing.record('wait', wait_time)
+            
+            # Perform the operation
+            try:
+                timing.record('connect', session.transport.connect())
+            
+                http_start_time = time.time()
+                status = session.transport.send(message)
+                timing.record('http', time.time() - http_start_time)
+            except Exception:
+                timing.emit('error')
+                raise
+            
+            session.pacer.record_send()
+            timing.emit('ok' if status == 200 else 'failed')
+            
+            if status == 200:
+                if logger is not None:
+                    logger.info("Group broadcast performed successfully, " + cls.create_event_string({
+                                                                                                        'group' : group,
+                                                                                                        'cmd1' : cmd1,
+                                                                                                        'cmd2' : cmd2
+                                                                                                       }))
+                return True
+            else:
+                if logger is not None:
+                    logger.warn("Group broadcast failed, " + cls.create_event_string({
+                                                                                       'status_code' : status
+                                                                                      }))
+                return False
+    
+    @classmethod
+    def get_all_link_acks(cls, address, port, username, password, group, cmd1, devices, logger=None):
+        """
+        Poll the buffer of the Insteon Hub until the PLM finishes cleaning up after a group broadcast (or all of the
+        given devices acknowledged it) and return the set of the devices that acknowledged it.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        group -- The hex string of the group that the command was sent to
+        cmd1 -- The hex string of the first command portion of the command that was sent
+        devices -- The devices that are expected to be in the group
+        logger -- The logger to use
+        """
+        
+        session = HubSession.get_session(address, port, username, password)
+        
+        give_up_time = time.time() + cls.RESPONSE_DEADLINE + (cls.GROUP_CLEANUP_DEADLINE_PER_DEVICE * len(devices))
+        delay = cls.RESPONSE_POLL_INITIAL_DELAY
+        acked = set()
+        
+        while True:
+            
+            # Wait a bit to give the devices time to respond
+            cls.wait_for_data(address, port, username, password, min(delay, max(give_up_time - time.time(), 0)))
+            
+            raw_response = cls.get_response(address, port, username, password, logger)
+            
+            if raw_response is not None:
+                messages = decode_buffer(raw_response)
+                sent, acked, status = find_all_link_acks(messages, group, cmd1.zfill(2).upper())
                 
-                parsed_response = cls.parse_raw_response(raw_response)
-                return parsed_response
+                # Stop if the PLM is done or all of the devices acknowledged the broadcast
+                if status is not None or acked.issuperset(devices):
+                    session.pacer.record_ack()
+                    cls.get_state_cache().record_messages(messages)
+                    return acked
             
-            return True
-        else:
+            # Give up if we have waited long enough
+            if time.time() >= give_up_time:
+                return acked
             
-            if logger is not None:
-                logger.warn("Operation failed, " + cls.create_event_string({
-                                                                             'status_code' : response.status
-                                                                            }))
+            # Back off before checking again
+            delay = min(delay * 2, cls.RESPONSE_POLL_MAX_DELAY)
+    
+    @classmethod
+    def broadcast_to_group(cls, address, port, username, password, group, cmd1, cmd2, devices=None, cleanup=True, logger=None):
+        """
+        Send a command to an all-link group and return the devices that did not acknowledge it (which should get the
+        command directly). Returns a tuple of whether the broadcast was sent and the list of devices needing the command.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        group -- The hex string of the group to send the command to
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        devices -- The devices that are expected to be in the group
+        cleanup -- Whether to determine which of the devices did not acknowledge the broadcast
+        logger -- The logger to use
+        """
+        
+        if devices is None:
+            devices = []
+        
+        # Keep the other processes from using the hub until the PLM is done cleaning up after the broadcast
+        with HubSession.get_session(address, port, username, password).exclusive():
+            
+            # Send the broadcast; all of the devices will need the command directly if the broadcast failed
+            if not cls.call_insteon_web_api_for_group(address, port, username, password, group, cmd1, cmd2, logger):
+                return False, sorted(devices)
+            
+            # Determine which devices didn't get the command
+            if not cleanup or len(devices) == 0:
+                return True, []
+            
+            acked = cls.get_all_link_acks(address, port, username, password, group, cmd1, devices, logger)
+            
+            return True, sorted([device for device in devices if device not in acked])
+    
+    @classmethod
+    def configure_session(cls, address, port, username, password, min_gap=None, transport=None, adaptive_hops=None):
+        """
+        Configure the spacing between the calls to the hub, how the messages are sent to it and how the calls are
+        coordinated with the other processes that use the hub.
+        
+        Arguments:
+        address -- The address of the Insteon Hub
+        port -- The port of the Insteon Hub web-server
+        username -- The username to authenticate to the Insteon Hub
+        password -- The password to authenticate to the Insteon Hub
+        min_gap -- The minimum amount of time between calls to the hub (in seconds); left unchanged if None
+        transport -- A tuple of the name and port of the transport (see parse_transport()); left unchanged if None
+        adaptive_hops -- Whether the messages to nearby devices should use fewer hops; left unchanged if None
+        """
+        
+        session = HubSession.get_session(address, port, username, password)
+        
+        # Coordinate the calls to the hub with the other processes
+        if session.arbiter is None:
+            session.arbiter = HubArbiter(make_splunkhome_path(cls.HUB_LOCK_DIRECTORY), address, port)
+        
+        if min_gap is not None:
+            session.pacer.min_gap = float(min_gap)
+            
+            # Limit how quickly all of the processes combined send commands to the hub too
+            if session.pacer.min_gap > 0:
+                session.arbiter.rate = 1.0 / session.pacer.min_gap
+            
+        if transport is not None:
+            session.set_transport(transport[0], transport[1])
+        
+        if adaptive_hops is not None:
+            session.link_quality = cls.get_link_quality() if adaptive_hops else None
+    
+    @classmethod
+    def get_coalescer(cls, window):
+        """
+        Get the coalescer that collapses the commands sent within the given window to the same device (or None if the
+        commands shouldn't be collapsed).
+        
+        Arguments:
+        window -- How long to wait for a later command to the same device (in seconds)
+        """
+        
+        if window is None or float(window) <= 0:
+            return None
+        
+        return CommandCoalescer(make_splunkhome_path(cls.COALESCE_JOURNAL_FILE), float(window))
+    
+    @classmethod
+    def get_state_cache(cls):
+        """
+        Get the cache of the last known state of each device.
+        """
+        
+        with SendInsteonCommandAlert.caches_lock:
+            if SendInsteonCommandAlert.state_cache is None:
+                SendInsteonCommandAlert.state_cache = DeviceStateCache(make_splunkhome_path(cls.DEVICE_STATE_CACHE_FILE))
+            
+            return SendInsteonCommandAlert.state_cache
+    
+    @classmethod
+    def get_link_quality(cls):
+        """
+        Get the table of how many hops the replies from each device took.
+        """
+        
+        with SendInsteonCommandAlert.caches_lock:
+            if SendInsteonCommandAlert.link_quality is None:
+                SendInsteonCommandAlert.link_quality = LinkQualityTable(make_splunkhome_path(cls.LINK_QUALITY_FILE))
+            
+            return SendInsteonCommandAlert.link_quality
+    
+    @classmethod
+    def get_capability_cache(cls):
+        """
+        Get the cache of the engine version and product information of each device.
+        """
+        
+        with SendInsteonCommandAlert.caches_lock:
+            if SendInsteonCommandAlert.capability_cache is None:
+                SendInsteonCommandAlert.capability_cache = DeviceCapabilityCache(make_splunkhome_path(cls.DEVICE_CAPABILITIES_FILE))
+            
+            return SendInsteonCommandAlert.capability_cache
+    
+    @classmethod
+    def get_devices_not_in_state(cls, devices, cmd1, cmd2):
+        """
+        Split the devices into the ones that need the command and the ones that are known to already be in the state
+        that the command would put them in. Returns a tuple of the two lists.
+        
+        Arguments:
+        devices -- The addresses of the devices
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        """
+        
+        state_cache = cls.get_state_cache()
+        
+        needed = []
+        already_in_state = []
+        
+        for device in devices:
+            if state_cache.is_in_state(device, cmd1, cmd2):
+                already_in_state.append(device)
+            else:
+                needed.append(device)
+                
+        return needed, already_in_state
+    
+    @classmethod
+    def get_hub_for_device(cls, device, default_hub):
+        """
+        Get the hub that the device is connected to as a tuple of the address, port, username and password.
+        
+        The hub is obtained from the hub column of the insteon_devices.csv lookup. The value can be the name of an entry
+        in the insteon_hubs.csv lookup (with the address, port, username and password columns) or the address of the hub
+        with an optional port (e.g. "192.168.1.20:25105"). The default hub is used if the device has no hub listed and
+        for the values that the hub entry doesn't include.
+        
+        Arguments:
+        device -- The address of the device
+        default_hub -- The hub to use if the lookup doesn't list one (as a tuple of the address, port, username and password)
+        """
+        
+        hub_name = InsteonDeviceField.get_value_for_address_from_lookups(device, 'hub')
+        
+        if hub_name is None:
+            return default_hub
+        
+        hub_name = hub_name.strip()
+        default_address, default_port, default_username, default_password = default_hub
+        
+        # See if the hub is described in the hubs lookup
+        for lookup_file in cls.HUB_LOOKUP_FILES:
+            
+            try:
+                hub = DeviceLookupIndex.get_index(make_splunkhome_path(lookup_file), make_splunkhome_path(InsteonDeviceField.LOOKUP_INDEX_DIRECTORY)).get_device(hub_name)
+            except Exception:
+                hub = None
+            
+            if hub is not None and hub.get('address', None):
+                return (hub['address'], hub.get('port', None) or default_port, hub.get('username', None) or default_username, hub.get('password', None) or default_password)
+        
+        # Otherwise, the hub is an address with an optional port
+        if ':' in hub_name:
+            hub_address, hub_port = hub_name.rsplit(':', 1)
+        else:
+            hub_address, hub_port = hub_name, default_port
             
-            return False
+        return (hub_address, hub_port, default_username, default_password)
     
-    def call_insteon_web_api_repeatedly(self, address, port, username, password, device, cmd1, cmd2, times, response_expected=False, extended=False, data=None):
+    def call_insteon_web_api_repeatedly(self, address, port, username, password, device, cmd1, cmd2, times, response_expected=False, extended=False, data=None, delivery=None, max_retries=None):
         """
         Perform a call to the Insteon Web API.
         
@@ -409,6 +1225,8 @@ class SendInsteonCommandAlert(ModularAlert):
         response_expected -- Get the response from the command
         extended -- Whether the command is an extended direct command
         data -- The data to send to the server (in hexadecimal)
+        delivery -- Set to DELIVERY_ACK to re-send the command until the device acknowledges it
+        max_retries -- How many times the command can be re-sent when the delivery is DELIVERY_ACK
         """
         
         if times < 1:
@@ -420,6 +1238,21 @@ class SendInsteonCommandAlert(ModularAlert):
         # Call the API the number of times requested
         for i in range(0, times):
             
+            # Re-send the command until the device acknowledges it
+            if delivery == SendInsteonCommandAlert.DELIVERY_ACK:
+                status, response, retries = self.deliver(address, port, username, password, device, cmd1, cmd2, extended, data, max_retries, self.logger)
+                
+                results.append({
+                                  'message' : 'Insteon command was acknowledged by the device' if status == SendInsteonCommandAlert.DELIVERY_ACKED else 'Insteon command was not acknowledged by the device',
+                                  'cmd1' : cmd1,
+                                  'cmd2' : cmd2,
+                                  'device' : device,
+                                  'success' : status == SendInsteonCommandAlert.DELIVERY_ACKED,
+                                  'delivery' : status,
+                                  'retries' : retries
+                                   })
+                continue
+            
             # Call the API
             success = self.call_insteon_web_api(address, port, username, password, device, cmd1, cmd2, response_expected, extended, data, self.logger)
             
@@ -441,14 +1274,83 @@ class SendInsteonCommandAlert(ModularAlert):
                                   'device' : device,
                                   'success' : False
                                    })
-            
-            # If this isn't the last call, then wait a bit before calling it again
-            if i < times:
-                time.sleep(SendInsteonCommandAlert.SLEEP_BETWEEN_CALL_DURATION)
                 
         # Return the results
         return results
     
+    def run_rows(self, rows):
+        """
+        Run the rows of a batch (see ModularAlert.run_batch()). The commands that the rows send directly to devices are
+        coalesced all at once (so the coalesce window is waited out only once for the whole batch and a later row's
+        command to a device supersedes an earlier row's) and then the rows are run without coalescing them again.
+        
+        The rows that broadcast to a group are coalesced by run() as usual since only the devices that don't acknowledge
+        the broadcast get the command directly.
+        
+        Arguments:
+        rows -- A list of the rows as tuples of the number of the row, the cleaned parameters and the payload of the row
+        """
+        
+        # Collect the commands of the rows that are coalesced, grouped by the window
+        windows = OrderedDict()
+        
+        for row_number, cleaned_params, row_payload in rows:
+            coalesce_window = cleaned_params.get('coalesce_window', None)
+            command = cleaned_params.get('command', None)
+            
+            if self.get_coalescer(coalesce_window) is None or cleaned_params.get('group', None) is not None or command is None:
+                continue
+            
+            for device in cleaned_params.get('device', None) or []:
+                windows.setdefault(coalesce_window, []).append((device, command.cmd1, command.cmd2, (row_number, device, command.cmd1, command.cmd2)))
+        
+        # Coalesce the commands (this waits out each window once)
+        coalesced = {}
+        
+        for coalesce_window, commands in windows.items():
+            coalescer = self.get_coalescer(coalesce_window)
+            to_send, dropped = coalescer.coalesce(commands)
+            
+            for (row_number, device, cmd1, cmd2), ticket in to_send:
+                coalesced.setdefault(row_number, []).append((device, ticket, coalescer))
+            
+            for (row_number, device, cmd1, cmd2), reason in dropped:
+                coalesced.setdefault(row_number, [])
+                
+                self.logger.info("Insteon command was not sent since it was %s by another command, %s", reason, self.create_event_string({
+                                                                                                                                           'cmd1' : cmd1,
+                                                                                                                                           'cmd2' : cmd2,
+                                                                                                                                           'device' : device,
+                                                                                                                                           'row' : row_number
+                                                                                                                                          }))
+        
+        total = 0
+        
+        for row_number, cleaned_params, row_payload in rows:
+            
+            if row_number not in coalesced:
+                total = total + self.run_row(row_number, cleaned_params, row_payload)
+                continue
+            
+            # Only send the commands that weren't dropped (in the order that the row listed the devices)
+            row_commands = coalesced[row_number]
+            
+            if len(row_commands) == 0:
+                continue
+            
+            row_params = dict(cleaned_params)
+            row_params['device'] = [device for device in cleaned_params['device'] if device in [row_device for row_device, ticket, coalescer in row_commands]]
+            row_params['coalesce_window'] = None
+            
+            try:
+                total = total + self.run_row(row_number, row_params, row_payload)
+            finally:
+                for device, ticket, coalescer in row_commands:
+                    if ticket is not None:
+                        coalescer.finish(ticket)
+        
+        return total
+    
     def run(self, cleaned_params, payload):
         
         # Get the information we need to execute the alert action
@@ -461,11 +1363,107 @@ class SendInsteonCommandAlert(ModularAlert):
         devices = cleaned_params.get('device', None)
         command = cleaned_params.get('command', None)
         
+        group = cleaned_params.get('group', None)
+        cleanup = cleaned_params.get('cleanup', True)
+        
+        if group is None and devices is None:
+            raise FieldValidationException("Either a device or a group must be provided")
+        
+        # Configure the spacing between the calls to the hub and how the messages are sent to it
+        min_gap = cleaned_params.get('min_gap', None)
+        transport = cleaned_params.get('transport', None)
+        adaptive_hops = cleaned_params.get('adaptive_hops', None) is True
+        
+        self.configure_session(address, port, username, password, min_gap, transport, adaptive_hops)
+        
         successes = 0
+        default_hub = (address, port, username, password)
         
-        # Call the API the number of times requested
-        for device in devices:
-            results = self.call_insteon_web_api_repeatedly(address, port, username, password, device, command.cmd1, command.cmd2, command.times, command.response_expected)
+        # Send the command to the group; only the devices that didn't get the broadcast will get the command directly
+        if group is not None:
+            sent, devices = self.broadcast_to_group(address, port, username, password, group, command.cmd1, command.cmd2, devices, cleanup is not False, self.logger)
+            
+            if sent:
+                successes = successes + 1
+        
+        # Determine if the commands should be re-sent until the devices acknowledge them
+        delivery = cleaned_params.get('delivery', None)
+        max_retries = cleaned_params.get('max_retries', None)
+        
+        # Skip the devices that are already in the state that the command would put them in
+        skip_if_in_state = cleaned_params.get('skip_if_in_state', False)
+        response_expected = command.response_expected
+        
+        if skip_if_in_state and devices is not None and DeviceStateCache.get_expected_level(command.cmd1, command.cmd2) is not None:
+            devices, already_in_state = self.get_devices_not_in_state(devices, command.cmd1, command.cmd2)
+            
+            for device in already_in_state:
+                self.logger.info("Insteon command was not sent since the device is already in the requested state, %s", self.create_event_string({
+                                                                                                                                                    'cmd1' : command.cmd1,
+                                                                                                                                                    'cmd2' : command.cmd2,
+                                                                                                                                                    'device' : device
+                                                                                                                                                   }))
+                successes = successes + 1
+            
+            # Wait for the replies so that the state of the devices is known the next time
+            response_expected = True
+        
+        # Skip the devices that will get a later command within the window (from this alert or another one)
+        coalescer = self.get_coalescer(cleaned_params.get('coalesce_window', None))
+        tickets = {}
+        
+        if coalescer is not None and devices is not None:
+            to_send, dropped = coalescer.coalesce([(device, command.cmd1, command.cmd2, device) for device in devices])
+            
+            devices = [device for device, ticket in to_send]
+            tickets = dict(to_send)
+            
+            for device, reason in dropped:
+                self.logger.info("Insteon command was not sent since it was %s by another command, %s", reason, self.create_event_string({
+                                                                                                                                           'cmd1' : command.cmd1,
+                                                                                                                                           'cmd2' : command.cmd2,
+                                                                                                                                           'device' : device
+                                                                                                                                          }))
+        
+        # Send the commands to each hub (the hubs will be run concurrently)
+        routes = HubRouter.group_by_hub(devices or [], lambda device: self.get_hub_for_device(device, default_hub))
+        
+        def send_to_hub(hub, hub_devices):
+            
+            hub_address, hub_port, hub_username, hub_password = hub
+            results = []
+            
+            self.configure_session(hub_address, hub_port, hub_username, hub_password, min_gap, transport, adaptive_hops)
+            
+            # Call the API the number of times requested
+            for device in hub_devices:
+                try:
+                    results.extend(self.call_insteon_web_api_repeatedly(hub_address, hub_port, hub_username, hub_password, device, command.cmd1, command.cmd2, command.times, response_expected,
+                                                                        delivery=delivery, max_retries=max_retries))
+                finally:
+                    if tickets.get(device, None) is not None:
+                        coalescer.finish(tickets[device])
+                
+            return results
+        
+        for hub, results, failure in HubRouter().run(routes, send_to_hub):
+            
+            # Log the failure of the hub; the results of the other hubs are still output
+            if failure is not None:
+                self.logger.error("Insteon commands to the hub could not be completed, %s, %s", self.create_event_string({
+                                                                                                                         'hub' : hub[0],
+                                                                                                                         'devices' : ",".join(routes[hub]),
+                                                                                                                         'cmd1' : command.cmd1,
+                                                                                                                         'cmd2' : command.cmd2,
+                                                                                                                         'message' : str(failure)
+                                                                                                                        }), failure.traceback)
+                
+                # Let the commands waiting on the devices that weren't reached go ahead
+                for device in routes[hub]:
+                    if tickets.get(device, None) is not None:
+                        coalescer.finish(tickets[device])
+                
+                continue
             
             # Output the results
             for result in results:
@@ -481,9 +1479,6 @@ class SendInsteonCommandAlert(ModularAlert):
                 else:
                     self.logger.warn(message + " " + self.create_event_string(result))
             
-            # Sleep for a bit so that we don't overwhelm the Insteon device will requests
-            time.sleep(2*SendInsteonCommandAlert.SLEEP_BETWEEN_CALL_DURATION)
-            
         return successes
         
 """
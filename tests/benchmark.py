@@ -0,0 +1,258 @@
+"""
+This script benchmarks how quickly commands can be sent through the alert action and the search command. The commands
+are sent to a simulated hub (see hub_simulator.py) so that the results are repeatable.
+
+For each workload, the benchmark reports the latency of each command (p50, p95 and p99), the time that the entire batch
+took, the number of requests made to the hub and where the time went (sleeping, HTTP requests, polling for responses
+and looking up devices).
+
+Run it from the tests directory like the unit tests:
+
+    python benchmark.py
+    python benchmark.py --workload fifty_off --latency 0.1 --output results.json
+
+The results are written as JSON so that they can be compared across versions.
+"""
+
+import sys
+import os
+import time
+import math
+import json
+import argparse
+
+sys.path.append( os.path.join("..", "src", "bin") )
+
+from send_insteon_command import SendInsteonCommandAlert, InsteonCommandField
+from insteon_command import SendInsteonCommand
+from insteon_status import InsteonStatus
+from insteon_control_app.hub_session import HubSession
+from insteon_control_app.device_lookup import DeviceLookupIndex
+from hub_simulator import HubSimulator, SimulatedDevice
+
+def get_percentile(values, percentile):
+    """
+    Get the given percentile of the values (using the nearest-rank method). Returns None if there are no values.
+
+    Arguments:
+    values -- The list of values
+    percentile -- The percentile to get (0-100)
+    """
+
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+    rank = int(math.ceil((percentile / 100.0) * len(values))) - 1
+
+    return values[min(max(rank, 0), len(values) - 1)]
+
+class Timings(object):
+    """
+    Records how long the calls to the instrumented functions took while a workload ran.
+    """
+
+    def __init__(self):
+        self.command_latencies = []
+        self.totals = dict.fromkeys(['sleep', 'http', 'poll', 'lookup'], 0.0)
+        self.patches = []
+
+    def wrap(self, owner, name, category, is_classmethod=False):
+        """
+        Replace the function with one that records how long it took.
+
+        Arguments:
+        owner -- The class or module that has the function
+        name -- The name of the function
+        category -- The name of the total to add the time to (or None to record the latency of each call)
+        is_classmethod -- Whether the function is a classmethod
+        """
+
+        original = owner.__dict__[name] if is_classmethod else getattr(owner, name)
+        function = original.__func__ if is_classmethod else original
+
+        def timed(*args, **kwargs):
+            start_time = time.time()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.time() - start_time
+
+                if category is None:
+                    self.command_latencies.append(duration)
+                else:
+                    self.totals[category] = self.totals[category] + duration
+
+        setattr(owner, name, classmethod(timed) if is_classmethod else timed)
+        self.patches.append((owner, name, original))
+
+    def __enter__(self):
+        self.wrap(time, 'sleep', 'sleep')
+        self.wrap(HubSession, 'request', 'http')
+        self.wrap(SendInsteonCommandAlert, 'get_response', 'poll', True)
+        self.wrap(DeviceLookupIndex, 'get_device', 'lookup')
+        self.wrap(DeviceLookupIndex, 'get_device_by_address', 'lookup')
+        self.wrap(SendInsteonCommandAlert, 'call_insteon_web_api', None, True)
+        self.wrap(SendInsteonCommandAlert, 'call_insteon_web_api_for_group', None, True)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for owner, name, original in reversed(self.patches):
+            setattr(owner, name, original)
+
+        self.patches = []
+
+def make_devices(count):
+    return ["%06X" % (0x100000 + i) for i in range(0, count)]
+
+def run_alert(simulator, devices, command, group=None):
+    """
+    Send the command through the alert action.
+    """
+
+    alert = SendInsteonCommandAlert()
+
+    cleaned_params = {
+                      'address' : '127.0.0.1',
+                      'port' : simulator.port,
+                      'username' : simulator.username,
+                      'password' : simulator.password,
+                      'device' : devices,
+                      'command' : InsteonCommandField('command').to_python(command),
+                      'group' : group,
+                      'cleanup' : True
+                     }
+
+    return alert.run(cleaned_params, {})
+
+def run_search_command(simulator, devices, command):
+    """
+    Send the command through the search command (in streaming mode, with one result per device).
+    """
+
+    class BenchmarkSendInsteonCommand(SendInsteonCommand):
+
+        def get_hub_info(self, session_key):
+            return '127.0.0.1', simulator.port, simulator.username, simulator.password, None, None
+
+        def output_results(self, results):
+            self.output = results
+
+    search_command = BenchmarkSendInsteonCommand(command=command)
+    search_command.handle_results([{'device' : device} for device in devices], None, False)
+
+    return len([result for result in search_command.output if result.get('success', False)])
+
+def run_status_sweep(simulator, devices):
+    """
+    Get the status of the devices through the status search command (which pipelines the requests).
+    """
+    
+    results = InsteonStatus.sweep_hub('127.0.0.1', simulator.port, simulator.username, simulator.password, devices)
+    
+    return len([result for result in results if result['success']])
+
+# These are the workloads; each is a tuple of the name, a description, the number of devices, the groups that the
+# devices are in and a function that sends the commands
+WORKLOADS = [
+    ('single', "1 device x on", 1, [], lambda simulator, devices: run_alert(simulator, devices, 'on')),
+    ('fifty_off', "50 devices x off", 50, [], lambda simulator, devices: run_alert(simulator, devices, 'off')),
+    ('status_sweep', "20 devices x status (waits for each response)", 20, [], lambda simulator, devices: run_search_command(simulator, devices, 'status')),
+    ('status_pipelined', "20 devices x status through insteonstatus (pipelined)", 20, [], run_status_sweep),
+    ('thermostat', "10 thermostats x thermostat_info (extended)", 10, [], lambda simulator, devices: run_search_command(simulator, devices, 'thermostat_info')),
+    ('group_off', "25 devices x off through an all-link group", 25, ['05'], lambda simulator, devices: run_alert(simulator, devices, 'off', '05'))
+]
+
+def run_workload(name, latency=0.05, nak_rate=0.0, transport=None, seed=1):
+    """
+    Run the workload with the given name against a new simulated hub and return the results as a dictionary.
+
+    Arguments:
+    name -- The name of the workload
+    latency -- How long the simulated devices take to reply (in seconds)
+    nak_rate -- How often the simulated PLM refuses a message (between 0 and 1)
+    transport -- How to send the messages to the hub ("http" or "plm"); uses the web interface if None
+    seed -- The seed of the random number generator of the simulator
+    """
+
+    workload = [workload for workload in WORKLOADS if workload[0] == name][0]
+    name, description, device_count, groups, function = workload
+
+    devices = make_devices(device_count)
+
+    simulator = HubSimulator(devices=[SimulatedDevice(device, groups=groups) for device in devices], latency=latency,
+                             nak_rate=nak_rate, plm_socket=(transport == 'plm'), seed=seed).start()
+
+    try:
+        if transport == 'plm':
+            SendInsteonCommandAlert.configure_session('127.0.0.1', simulator.port, simulator.username, simulator.password, transport=('plm', simulator.plm_port))
+
+        with Timings() as timings:
+            start_time = time.time()
+            successes = function(simulator, devices)
+            batch_time = time.time() - start_time
+
+    finally:
+        HubSession.close_all()
+        simulator.stop()
+
+    return {
+            'workload' : name,
+            'description' : description,
+            'transport' : transport or 'http',
+            'latency' : latency,
+            'nak_rate' : nak_rate,
+            'devices' : device_count,
+            'successes' : successes,
+            'commands' : len(timings.command_latencies),
+            'batch_time' : batch_time,
+            'commands_per_minute' : (len(timings.command_latencies) * 60.0 / batch_time) if batch_time > 0 else None,
+            'latency_p50' : get_percentile(timings.command_latencies, 50),
+            'latency_p95' : get_percentile(timings.command_latencies, 95),
+            'latency_p99' : get_percentile(timings.command_latencies, 99),
+            'hub_requests' : len(simulator.requests),
+            'hub_sends' : len(simulator.sent_messages),
+            'hub_polls' : len([path for path in simulator.requests if path == '/buffstatus.xml']),
+            'time_sleeping' : timings.totals['sleep'],
+            'time_http' : timings.totals['http'],
+            'time_polling' : timings.totals['poll'],
+            'time_lookup' : timings.totals['lookup']
+           }
+
+def format_result(result):
+    return "%-14s %8.3fs %7.1f/min  p50=%.3fs p95=%.3fs p99=%.3fs  requests=%d (polls=%d)  sleep=%.3fs http=%.3fs poll=%.3fs lookup=%.3fs" % (
+            result['workload'], result['batch_time'], result['commands_per_minute'] or 0, result['latency_p50'] or 0,
+            result['latency_p95'] or 0, result['latency_p99'] or 0, result['hub_requests'], result['hub_polls'],
+            result['time_sleeping'], result['time_http'], result['time_polling'], result['time_lookup'])
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark sending commands to a simulated Insteon Hub")
+    parser.add_argument('--workload', action='append', choices=[workload[0] for workload in WORKLOADS], help="The workload to run (can be provided more than once; runs all of them by default)")
+    parser.add_argument('--latency', type=float, default=0.05, help="How long the simulated devices take to reply (in seconds)")
+    parser.add_argument('--nak-rate', type=float, default=0.0, help="How often the simulated PLM refuses a message (between 0 and 1)")
+    parser.add_argument('--transport', choices=['http', 'plm'], default='http', help="How to send the messages to the hub")
+    parser.add_argument('--output', help="The file to write the JSON results to (written to standard output if not provided)")
+
+    args = parser.parse_args()
+
+    results = []
+
+    for name in args.workload or [workload[0] for workload in WORKLOADS]:
+        result = run_workload(name, args.latency, args.nak_rate, args.transport)
+        results.append(result)
+
+        print >> sys.stderr, format_result(result)
+
+    output = json.dumps({
+                         'timestamp' : time.time(),
+                         'results' : results
+                        }, indent=2, sort_keys=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            fp.write(output)
+    else:
+        print output
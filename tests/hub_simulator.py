@@ -0,0 +1,466 @@
+"""
+This module provides a stand-in for an Insteon Hub so that the code that talks to the hub can be tested (and
+benchmarked) without a real hub.
+
+The simulator runs a web-server on localhost that implements the parts of the hub's web interface that the app uses:
+
+    /3?<message>=I=3     Send a message to the PLM (e.g. /3?02622C86260F11FF=I=3)
+    /1?XB=M=1            Clear the buffer
+    /buffstatus.xml      Get the PLM's buffer
+
+It can optionally expose the raw PLM serial stream over TCP too (like the hub does on port 9761).
+
+The simulated powerline is configurable: how long the devices take to reply, how often the PLM refuses a message
+(NAKs), how many hops the replies use and the state of each device.
+"""
+
+import base64
+import random
+import socket
+import threading
+import time
+import binascii
+import BaseHTTPServer
+import SocketServer
+
+class SimulatedDevice(object):
+    """
+    Represents a device on the simulated powerline.
+    """
+
+    def __init__(self, address, level=0, groups=None, responsive=True, naks=0, distance=1, engine=1, product='012045'):
+        """
+        Set up the device.
+
+        Arguments:
+        address -- The address of the device (e.g. "2C8626")
+        level -- The light level of the device (0-255)
+        groups -- The all-link groups that the device is a responder of (as hex strings, e.g. ["05"])
+        responsive -- Whether the device replies to messages (set this to False to simulate a device that is unplugged)
+        naks -- How many of the direct messages the device refuses (with a NAK) before it accepts them
+        distance -- How many hops the messages to and from the device take; direct messages with fewer max hops than this
+                    don't reach the device
+        engine -- The engine version of the device (0 for i1, 1 for i2 and 2 for i2cs); i2cs devices refuse extended
+                  messages without a valid checksum
+        product -- The hex string of the category, sub-category and firmware version of the device
+        """
+
+        self.address = address.upper()
+        self.level = level
+        self.groups = groups or []
+        self.responsive = responsive
+        self.naks = naks
+        self.distance = distance
+        self.engine = engine
+        self.product = product
+
+        # The messages that the device received (as a list of (cmd1, cmd2) tuples)
+        self.received = []
+
+    def handle_command(self, cmd1, cmd2):
+        """
+        Update the state of the device for the command and return the cmd1 and cmd2 of the reply.
+
+        Arguments:
+        cmd1 -- The hex string of the first command portion of the command
+        cmd2 -- The hex string of the second command portion of the command
+        """
+
+        self.received.append((cmd1, cmd2))
+
+        # On and fast on
+        if cmd1 in ['11', '12']:
+            self.level = int(cmd2, 16)
+
+        # Off and fast off
+        elif cmd1 in ['13', '14']:
+            self.level = 0
+
+        # Status requests reply with the level in cmd2 (and the all-link database delta in cmd1)
+        elif cmd1 == '19':
+            return '00', "%02X" % self.level
+
+        # Engine version requests reply with the version in cmd2
+        elif cmd1 == '0D':
+            return cmd1, "%02X" % self.engine
+
+        return cmd1, cmd2
+
+class HubSimulator(object):
+    """
+    A stand-in for an Insteon Hub. Call start() to start the servers and stop() to stop them.
+    """
+
+    # This is how many characters of messages the hub's buffer holds (the real hub holds 200 including the pointer)
+    BUFFER_LENGTH = 198
+
+    def __init__(self, username='admin', password='changeme', address='2CB84E', latency=0.05, nak_rate=0.0,
+                 hops=3, devices=None, plm_socket=False, seed=None, echo_latency=0):
+        """
+        Set up the simulator.
+
+        Arguments:
+        username -- The username that must be provided to the web interface
+        password -- The password that must be provided to the web interface
+        address -- The address of the hub's PLM
+        latency -- How long a device takes to reply to a message (in seconds)
+        nak_rate -- How often the PLM refuses a message because it is busy (between 0 and 1)
+        hops -- The maximum number of hops of the replies
+        devices -- A list of SimulatedDevice instances that are on the powerline
+        plm_socket -- Whether the raw PLM stream should be exposed over TCP
+        seed -- The seed of the random number generator (for deterministic NAKs)
+        echo_latency -- How long the PLM takes to echo a message back (in seconds); the replies come after the echo
+        """
+
+        self.username = username
+        self.password = password
+        self.address = address.upper()
+        self.latency = latency
+        self.echo_latency = echo_latency
+        self.nak_rate = nak_rate
+        self.hops = hops
+        self.plm_socket = plm_socket
+        self.random = random.Random(seed)
+
+        self.devices = {}
+
+        for device in devices or []:
+            self.devices[device.address] = device
+
+        # This is the data that the PLM has written (as a hex string); like the real hub, the buffer is a ring that the
+        # messages are written into at the write pointer (in characters), overwriting the oldest data once it is full
+        self.buffer = '0' * HubSimulator.BUFFER_LENGTH
+        self.pointer = 0
+
+        # These are the messages that will be written to the buffer later (as a list of (due time, message) tuples)
+        self.pending = []
+
+        # These are the connections to the raw PLM stream
+        self.plm_connections = []
+
+        self.lock = threading.RLock()
+
+        # Keep track of the requests for assertions and benchmarks
+        self.requests = []
+        self.sent_messages = []
+
+        self.http_server = None
+        self.plm_server = None
+        self.threads = []
+
+    @property
+    def port(self):
+        return self.http_server.server_address[1]
+
+    @property
+    def plm_port(self):
+        return self.plm_server.server_address[1]
+
+    def start(self):
+        """
+        Start the web-server (and the PLM socket if requested) on random ports of localhost.
+        """
+
+        self.http_server = SimulatorHTTPServer(('127.0.0.1', 0), SimulatorHTTPRequestHandler, self)
+        self.start_thread(self.http_server.serve_forever)
+
+        if self.plm_socket:
+            self.plm_server = SimulatorPLMServer(('127.0.0.1', 0), SimulatorPLMRequestHandler, self)
+            self.start_thread(self.plm_server.serve_forever)
+
+        return self
+
+    def start_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the servers.
+        """
+
+        for server in [self.http_server, self.plm_server]:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        with self.lock:
+            for connection in self.plm_connections:
+                try:
+                    connection.close()
+                except socket.error:
+                    pass
+
+            self.plm_connections = []
+
+    def get_device(self, address):
+        return self.devices.get(address.upper(), None)
+
+    @staticmethod
+    def is_checksum_valid(message):
+        """
+        Indicates if the last byte of the user data of an extended direct message is the checksum of the message.
+
+        Arguments:
+        message -- The message as a hex string
+        """
+
+        total = sum([int(message[position:position + 2], 16) for position in range(12, 42, 2)])
+
+        return ((-total) & 0xFF) == int(message[42:44], 16)
+
+    def get_flags(self, message_type, extended=False, distance=1):
+        """
+        Make the flags of a message from a device.
+
+        Arguments:
+        message_type -- The type of the message (the top three bits of the flags)
+        extended -- Whether the message is an extended message
+        distance -- How many hops the message took
+        """
+
+        flags = message_type << 5
+
+        if extended:
+            flags = flags | 0x10
+
+        hops_left = max(self.hops - distance, 0)
+
+        return "%02X" % (flags | (hops_left << 2) | self.hops)
+
+    def write(self, message, delay=0):
+        """
+        Write the message to the buffer (and the PLM stream) after the given delay.
+
+        Arguments:
+        message -- The message as a hex string
+        delay -- How long to wait before writing it (in seconds)
+        """
+
+        with self.lock:
+            if delay <= 0:
+                self.write_now(message)
+            else:
+                self.pending.append((time.time() + delay, message))
+
+                timer = threading.Timer(delay, self.flush_pending)
+                timer.daemon = True
+                timer.start()
+
+    def write_now(self, message):
+        with self.lock:
+            for position in range(0, len(message), 2):
+                self.buffer = self.buffer[:self.pointer] + message[position:position + 2] + self.buffer[self.pointer + 2:]
+                self.pointer = (self.pointer + 2) % HubSimulator.BUFFER_LENGTH
+
+            for connection in list(self.plm_connections):
+                try:
+                    connection.sendall(binascii.unhexlify(message))
+                except socket.error:
+                    self.plm_connections.remove(connection)
+
+    def flush_pending(self):
+        """
+        Write the messages that are due to the buffer.
+        """
+
+        with self.lock:
+            now = time.time()
+            due = sorted([entry for entry in self.pending if entry[0] <= now])
+            self.pending = [entry for entry in self.pending if entry[0] > now]
+
+            for due_time, message in due:
+                self.write_now(message)
+
+    def clear_buffer(self):
+        with self.lock:
+            self.buffer = '0' * HubSimulator.BUFFER_LENGTH
+            self.pointer = 0
+
+    def get_buffer(self):
+        """
+        Get the buffer the way that the hub presents it: the ring of messages followed by the position that the next
+        message will be written to (in bytes).
+        """
+
+        with self.lock:
+            self.flush_pending()
+
+            return self.buffer + "%02X" % (self.pointer / 2)
+
+    def handle_message(self, message):
+        """
+        Handle a message sent to the PLM and schedule the replies from the devices.
+
+        Arguments:
+        message -- The message as a hex string (e.g. "02622C86260F11FF")
+        """
+
+        message = message.upper()
+        self.sent_messages.append(message)
+
+        # The PLM refuses messages when it is busy
+        if self.nak_rate > 0 and self.random.random() < self.nak_rate:
+            self.write(message + '15', self.echo_latency)
+            return
+
+        # Direct messages
+        if message.startswith('0262') and len(message) >= 16:
+            self.write(message + '06', self.echo_latency)
+
+            device = self.get_device(message[4:10])
+            extended = (int(message[10:12], 16) & 0x10) != 0
+
+            # The message doesn't reach the device if it runs out of hops first
+            if device is not None and (int(message[10:12], 16) & 0x03) < device.distance:
+                device = None
+
+            if device is not None and device.responsive and device.naks > 0:
+                device.naks = device.naks - 1
+                self.write('0250' + device.address + self.address + self.get_flags(5, distance=device.distance) + message[12:14] + 'FF', self.echo_latency + self.latency)
+
+            # i2cs devices refuse extended messages with a bad checksum
+            elif device is not None and device.responsive and extended and device.engine == 2 and not HubSimulator.is_checksum_valid(message):
+                self.write('0250' + device.address + self.address + self.get_flags(5, distance=device.distance) + message[12:14] + 'FD', self.echo_latency + self.latency)
+
+            elif device is not None and device.responsive:
+                cmd1, cmd2 = device.handle_command(message[12:14], message[14:16])
+
+                self.write('0250' + device.address + self.address + self.get_flags(1, distance=device.distance) + cmd1 + cmd2, self.echo_latency + self.latency)
+
+                # Product requests are answered with a broadcast containing the product information
+                if message[12:14] == '10':
+                    self.write('0250' + device.address + device.product + self.get_flags(4, distance=device.distance) + '01FF', self.echo_latency + (self.latency * 2))
+
+        # All-link group broadcasts; the devices in the group acknowledge the clean-up messages one at a time
+        elif message.startswith('0261') and len(message) >= 10:
+            self.write(message + '06')
+
+            group = message[4:6]
+            cmd1 = message[6:8]
+            cmd2 = message[8:10]
+            delay = self.latency
+
+            for device in sorted(self.devices.values(), key=lambda device: device.address):
+                if group in device.groups:
+                    device.handle_command(cmd1, cmd2)
+
+                    if device.responsive:
+                        self.write('0250' + device.address + self.address + self.get_flags(3, distance=device.distance) + cmd1 + group, delay)
+
+                    delay = delay + self.latency
+
+            self.write('025806', delay)
+
+        else:
+            self.write(message + '15')
+
+class SimulatorHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, simulator):
+        self.simulator = simulator
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler_class)
+
+class SimulatorHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep the connection alive between requests like the hub does
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_content(self, status, content, content_type='text/html'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+
+        simulator = self.server.simulator
+        simulator.requests.append(self.path)
+
+        # Make sure the request is authenticated
+        expected = 'Basic ' + base64.b64encode('%s:%s' % (simulator.username, simulator.password))
+
+        if self.headers.getheader('Authorization') != expected:
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="Insteon Hub"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path.startswith('/3?') and self.path.endswith('=I=3'):
+            simulator.handle_message(self.path[3:-4])
+            self.send_content(200, '')
+
+        elif self.path == '/1?XB=M=1':
+            simulator.clear_buffer()
+            self.send_content(200, '')
+
+        elif self.path == '/buffstatus.xml':
+            self.send_content(200, '<response><BS>%s</BS></response>' % (simulator.get_buffer()), 'text/xml')
+
+        else:
+            self.send_content(404, '')
+
+class SimulatorPLMServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, simulator):
+        self.simulator = simulator
+        SocketServer.TCPServer.__init__(self, server_address, handler_class)
+
+class SimulatorPLMRequestHandler(SocketServer.BaseRequestHandler):
+
+    # These are the lengths of the messages that can be sent to the PLM (keyed by the message type)
+    MESSAGE_LENGTHS = {
+                       '61' : 5,
+                       '62' : 8
+                      }
+
+    def handle(self):
+
+        simulator = self.server.simulator
+
+        with simulator.lock:
+            simulator.plm_connections.append(self.request)
+
+        received = ''
+
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except socket.error:
+                break
+
+            if len(data) == 0:
+                break
+
+            received = received + binascii.hexlify(data).upper()
+
+            # Handle each of the complete messages
+            while len(received) >= 4:
+
+                length = SimulatorPLMRequestHandler.MESSAGE_LENGTHS.get(received[2:4], 2)
+
+                # Extended direct messages are longer
+                if received[2:4] == '62' and len(received) >= 12 and (int(received[10:12], 16) & 0x10) != 0:
+                    length = 22
+
+                if len(received) < length * 2:
+                    break
+
+                simulator.handle_message(received[0:length * 2])
+                received = received[length * 2:]
+
+        with simulator.lock:
+            if self.request in simulator.plm_connections:
+                simulator.plm_connections.remove(self.request)